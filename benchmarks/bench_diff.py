@@ -0,0 +1,170 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark of scandiff.diff_scans at several churn rates, against a baseline that diffs two {path: metadata} dicts with
+set operations (which finds additions, removals, and modifications but no moves).
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_diff [number of files]
+"""
+
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_store_memory import make_records
+from bvzscanfilesystem import savedscan
+from bvzscanfilesystem import scandiff
+
+# The fraction of files changed between the two scans. Each change is equally likely to be an addition, a removal, a
+# modification, or a move.
+CHURN_RATES = (0.001, 0.01, 0.1)
+
+
+def make_scans(count, churn, seed=0):
+    """
+    Builds an old and a new scan that differ by a given fraction of their files.
+
+    :param count:
+        The number of files in the old scan.
+    :param churn:
+        The fraction of files to change.
+    :param seed:
+        The random seed.
+
+    :return:
+        A tuple of the old files, the new files, and a dictionary of the number of changes of each kind that were made.
+    """
+
+    old_files = dict(make_records(count, seed))
+    new_files = dict(old_files)
+
+    rng = random.Random(seed)
+    changed_p = rng.sample(sorted(old_files), int(count * churn))
+    expected = {scandiff.ADDED: 0, scandiff.REMOVED: 0, scandiff.MODIFIED: 0, scandiff.MOVED: 0}
+
+    for i, file_p in enumerate(changed_p):
+        kind = (scandiff.ADDED, scandiff.REMOVED, scandiff.MODIFIED, scandiff.MOVED)[i % 4]
+        expected[kind] += 1
+        metadata = dict(new_files[file_p])
+        if kind == scandiff.REMOVED:
+            del new_files[file_p]
+            continue
+        if kind == scandiff.MODIFIED:
+            metadata["size"] += 1
+            metadata["mtime"] += 1.0
+            new_files[file_p] = metadata
+            continue
+        if kind == scandiff.ADDED:
+            metadata["st_ino"] += 10 * count
+            metadata["mtime"] += 1.0
+        else:
+            del new_files[file_p]
+        metadata["file_d"] = os.path.join(metadata["file_d"], "published")
+        new_files[os.path.join(metadata["file_d"], metadata["file_n"])] = metadata
+
+    return old_files, new_files, expected
+
+
+def baseline(old_files, new_files):
+    """
+    Diffs two scans with set operations.
+
+    :param old_files:
+        The {path: metadata} dict of the old scan.
+    :param new_files:
+        The {path: metadata} dict of the new scan.
+
+    :return:
+        A dictionary of the number of changes of each kind.
+    """
+
+    old_keys = set(old_files)
+    new_keys = set(new_files)
+    modified = {file_p for file_p in old_keys & new_keys if old_files[file_p] != new_files[file_p]}
+
+    return {scandiff.ADDED: len(new_keys - old_keys),
+            scandiff.REMOVED: len(old_keys - new_keys),
+            scandiff.MODIFIED: len(modified),
+            scandiff.MOVED: 0}
+
+
+def count_changes(changes):
+    """
+    :param changes:
+        An iterable of (change, path, old path) tuples.
+
+    :return:
+        A dictionary of the number of changes of each kind.
+    """
+
+    counts = {scandiff.ADDED: 0, scandiff.REMOVED: 0, scandiff.MODIFIED: 0, scandiff.MOVED: 0}
+    for change, _, _ in changes:
+        counts[change] += 1
+
+    return counts
+
+
+def measure(func):
+    """
+    Runs a function twice: once to time it, and once under tracemalloc to measure its peak memory.
+
+    :param func:
+        A callable taking no arguments.
+
+    :return:
+        A tuple of what the function returned, the time it took (in seconds), and the peak memory it allocated (in
+        bytes).
+    """
+
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    print(f"{count} files")
+    print(f"{'churn':>7}  {'method':<22} {'seconds':>8} {'peak MB':>8}  added/removed/modified/moved")
+
+    with tempfile.TemporaryDirectory() as work_d:
+
+        for churn in CHURN_RATES:
+
+            old_files, new_files, expected = make_scans(count, churn)
+
+            old_p = os.path.join(work_d, "old.bin")
+            new_p = os.path.join(work_d, "new.bin")
+            savedscan.write_scan(old_p, dict(), old_files.items())
+            savedscan.write_scan(new_p, dict(), new_files.items())
+
+            methods = (("sets (no moves)", lambda: baseline(old_files, new_files)),
+                       ("diff_scans in memory", lambda: count_changes(scandiff.diff_scans(old_files, new_files))),
+                       ("diff_scans on disk", lambda: count_changes(scandiff.diff_scans(old_p, new_p))))
+
+            for name, func in methods:
+                counts, elapsed, peak = measure(func)
+                if name != methods[0][0]:
+                    assert counts == expected, (counts, expected)
+                print(f"{churn:>7.1%}  {name:<22} {elapsed:8.2f} {peak / 1e6:8.1f}  "
+                      f"{counts[scandiff.ADDED]}/{counts[scandiff.REMOVED]}/{counts[scandiff.MODIFIED]}/"
+                      f"{counts[scandiff.MOVED]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark of queryindex.QueryIndex against the linear passes over ScanFiles.files that it replaces.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_query [number of files]
+"""
+
+import fnmatch
+import sys
+import time
+
+from benchmarks.bench_store_memory import make_records
+from bvzscanfilesystem.queryindex import QueryIndex
+
+# The number of times each query is run (the best time is kept).
+REPEATS = 5
+
+
+def make_queries(files):
+    """
+    Builds pairs of equivalent queries: one run against a QueryIndex, one a linear pass over the files.
+
+    :param files:
+        The {path: metadata} dict of the files.
+
+    :return:
+        A list of (name, index query, linear query) tuples. The index query takes the index, the linear query takes the
+        files, and both return a sorted list of paths.
+    """
+
+    root_p = "/mnt/projects/show/seq000/"
+    shot_p = "/mnt/projects/show/seq000/shot00012/"
+    big = 45_000_000
+    week_start = 1.7e9 + 9.4e6
+
+    return [
+        ("subtree (one shot)",
+         lambda index: list(index.under(shot_p)),
+         lambda files: sorted(p for p in files if p.startswith(shot_p))),
+        ("size > 45 MB",
+         lambda index: list(index.size(min_size=big)),
+         lambda files: sorted(p for p, m in files.items() if m["size"] >= big)),
+        ("subtree & size & mtime",
+         lambda index: list(index.under(root_p) & index.size(min_size=big) & index.mtime(min_mtime=week_start)),
+         lambda files: sorted(p for p, m in files.items()
+                              if p.startswith(root_p) and m["size"] >= big and m["mtime"] >= week_start)),
+        ("glob with literal prefix",
+         lambda index: list(index.glob(shot_p + "*/beauty_v001.*.exr")),
+         lambda files: sorted(p for p in files if fnmatch.fnmatchcase(p, shot_p + "*/beauty_v001.*.exr"))),
+        ("glob with literal suffix",
+         lambda index: list(index.glob("*.0123.exr")),
+         lambda files: sorted(p for p in files if fnmatch.fnmatchcase(p, "*.0123.exr"))),
+    ]
+
+
+def best_time(func, arg):
+    """
+    :param func:
+        The query to run.
+    :param arg:
+        What to run it against.
+
+    :return:
+        A tuple of the result of the query and the best of REPEATS run times (in seconds).
+    """
+
+    best = None
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return result, best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    files = dict(make_records(count))
+
+    start = time.perf_counter()
+    index = QueryIndex(files)
+    build = time.perf_counter() - start
+
+    print(f"{count} files, index built in {build:.2f} s")
+    print(f"{'query':<26} {'matches':>8} {'linear ms':>10} {'index ms':>10} {'speedup':>8}")
+
+    for name, index_query, linear_query in make_queries(files):
+        linear_result, linear_time = best_time(linear_query, files)
+        index_result, index_time = best_time(index_query, index)
+        assert index_result == linear_result, name
+        print(f"{name:<26} {len(index_result):>8} {linear_time * 1000:>10.2f} {index_time * 1000:>10.2f} "
+              f"{linear_time / index_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
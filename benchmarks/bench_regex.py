@@ -0,0 +1,94 @@
+#! /usr/bin/env python3
+
+"""
+Micro-benchmark comparing the original per-item regex loop (re.search on every regex for every item) against the
+precompiled RegexMatcher used by ScanFiles.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_regex
+"""
+
+import random
+import re
+import time
+
+from bvzscanfilesystem.regexmatcher import RegexMatcher
+
+
+# A mix of the kinds of filters we see in practice: extension suffixes, prefixes, plain substrings and real regexes.
+PATTERNS = [r"\.tmp$", r"\.bak$", r"\.swp$", r"~$", r"\.pyc$", r"^\.", r"^core\.", "autosave", r"_v\d+\.", r"\.exr$",
+            r"\.DS_Store$", r"^#.*#$", r"\.(log|out)$", "backup", r"\.o$", r"\.lock$"]
+
+EXTENSIONS = [".txt", ".tmp", ".exr", ".py", ".pyc", ".jpg", ".log", ".o", ""]
+
+
+def old_match_any_regex(regexes, item):
+    """
+    The matching loop that ScanFiles used before the regexes were precompiled.
+
+    :param regexes:
+        A list of regex expressions to check against.
+    :param item:
+        A string to run the regex against.
+
+    :return:
+        True if any item matches any regex. False otherwise.
+    """
+
+    assert type(regexes) in [list, set, tuple]
+    for regex in regexes:
+        assert type(regex) is str
+
+    for regex in regexes:
+        if re.search(str(regex), item) is not None:
+            return True
+    return False
+
+
+def make_items(count, seed=0):
+    """
+    Builds a reproducible list of file names to match against.
+
+    :param count:
+        The number of file names to build.
+    :param seed:
+        The random seed.
+
+    :return:
+        A list of file names.
+    """
+
+    rng = random.Random(seed)
+    items = list()
+    for i in range(count):
+        prefix = rng.choice(["", "", "", ".", "core.", "#"])
+        items.append(f"{prefix}shot_{i % 997}_v{i % 13}{rng.choice(EXTENSIONS)}")
+    return items
+
+
+def main():
+    items = make_items(200000)
+
+    matcher = RegexMatcher(regexes=PATTERNS)
+    for item in items:
+        assert matcher.search(item) == old_match_any_regex(PATTERNS, item), item
+
+    start = time.perf_counter()
+    old_matches = sum(1 for item in items if old_match_any_regex(PATTERNS, item))
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_matches = sum(1 for item in items if matcher.search(item))
+    new_time = time.perf_counter() - start
+
+    assert old_matches == new_matches
+
+    print(f"{len(items)} items, {len(PATTERNS)} patterns, {new_matches} matches")
+    print(f"re.search loop:  {old_time * 1e9 / len(items):10.1f} ns/item")
+    print(f"RegexMatcher:    {new_time * 1e9 / len(items):10.1f} ns/item")
+    print(f"speedup:         {old_time / new_time:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#! /usr/bin/env python3
+
+"""
+Memory benchmark comparing the plain {path: metadata dict} layout of ScanFiles.files against CompactFileStore.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_store_memory [number of files]
+"""
+
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+from bvzscanfilesystem.compactstore import CompactFileStore
+
+
+def make_records(count, seed=0):
+    """
+    Yields reproducible (path, metadata) tuples shaped like the records ScanFiles stores.
+
+    :param count:
+        The number of records to yield.
+    :param seed:
+        The random seed.
+
+    :return:
+        An iterator of (path, metadata) tuples.
+    """
+
+    rng = random.Random(seed)
+    root_p = "/mnt/projects/show"
+    for i in range(count):
+        file_d = os.path.join(root_p, f"seq{i // 20000:03d}", f"shot{i // 400:05d}", "render", "beauty")
+        file_n = f"beauty_v{rng.randint(1, 30):03d}.{i % 400:04d}.exr"
+        file_p = os.path.join(file_d, file_n)
+        mtime = 1.7e9 + rng.random() * 1e7
+        yield file_p, {"file_n": file_n,
+                       "file_d": file_d,
+                       "rel_p": os.path.relpath(file_p, root_p),
+                       "size": rng.randint(1, 50_000_000),
+                       "ctime": mtime,
+                       "mtime": mtime,
+                       "islink": False,
+                       "st_mode": 0o100644,
+                       "file_uid": 1000,
+                       "file_gid": 1000,
+                       "st_dev": 2049,
+                       "st_ino": 1_000_000 + i}
+
+
+def measure(factory, count):
+    """
+    Fills a store with records and measures how much memory it holds on to.
+
+    :param factory:
+        A callable that returns an empty store.
+    :param count:
+        The number of records to add.
+
+    :return:
+        The number of bytes allocated.
+    """
+
+    gc.collect()
+    tracemalloc.start()
+
+    store = factory()
+    for file_p, metadata in make_records(count):
+        store[file_p] = metadata
+
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(store) == count
+    del store
+
+    return allocated
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    dict_bytes = measure(dict, count)
+    compact_bytes = measure(CompactFileStore, count)
+
+    print(f"{count} files")
+    print(f"dict of dicts:     {dict_bytes / count:8.1f} bytes/file")
+    print(f"CompactFileStore:  {compact_bytes / count:8.1f} bytes/file")
+    print(f"reduction:         {dict_bytes / compact_bytes:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+
+"""
+Compares two sets of results saved by benchmarks.scanbench.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.compare before.json after.json
+"""
+
+from argparse import ArgumentParser
+import json
+
+
+def compare(before, after):
+    """
+    Lines up the profiles that appear in both sets of results.
+
+    :param before:
+        The results dictionary of the earlier run.
+    :param after:
+        The results dictionary of the later run.
+
+    :return:
+        A list of (profile name, before result, after result) tuples.
+    """
+
+    if before["meta"]["spec"] != after["meta"]["spec"]:
+        print("WARNING: the two runs used different trees, the numbers are not directly comparable.")
+
+    return [(name, before["results"][name], after["results"][name])
+            for name in before["results"] if name in after["results"]]
+
+
+def main():
+    parser = ArgumentParser(description="Compares two sets of scan benchmark results.")
+    parser.add_argument("before", help="The JSON results of the earlier run.")
+    parser.add_argument("after", help="The JSON results of the later run.")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{'profile':<12} {'files/s before':>15} {'files/s after':>14} {'speedup':>8} "
+          f"{'calls/file':>16} {'peak RSS MB':>18}")
+
+    for name, old, new in compare(before, after):
+        old_calls = sum(old["calls_per_file"].values())
+        new_calls = sum(new["calls_per_file"].values())
+        speedup = new["files_per_sec"] / old["files_per_sec"] if old["files_per_sec"] else float("nan")
+        print(f"{name:<12} {old['files_per_sec']:>15.0f} {new['files_per_sec']:>14.0f} {speedup:>7.2f}x "
+              f"{old_calls:>7.2f} -> {new_calls:<6.2f} "
+              f"{old['peak_rss_bytes'] / 2 ** 20:>7.1f} -> {new['peak_rss_bytes'] / 2 ** 20:<7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#! /usr/bin/env python3
+
+"""
+Benchmarks ScanFiles.scan_directories against a synthetic tree (see treegen.py) under several filter profiles.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.scanbench /tmp/scan_bench_tree --output results.json
+
+Each profile is run in a fresh process (so that peak RSS is measured for that profile alone): first a timed run, then
+an untimed run that counts the filesystem calls made per file. Results are printed and, with --output, saved as JSON
+that benchmarks.compare can diff against another run. The "instrumented" profile turns on the instrument option, so its
+results also hold the time spent in each phase of the scan (listing, filtering, metadata, permissions).
+"""
+
+from argparse import ArgumentParser
+from dataclasses import asdict
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+from benchmarks import treegen
+
+# Each profile is a set of keyword arguments for the Options object.
+PROFILES = {
+    "default": dict(),
+    "no_hidden": dict(skip_hidden_files=True, skip_hidden_dirs=True),
+    "regex": dict(incl_dir_regexes=["dir_00[0-5]"], excl_file_regexes=[r"\.tmp$", r"\.py$"]),
+    "direntry": dict(direntry_metadata=True),
+    "threads_8": dict(scan_threads=8),
+    "compact": dict(compact_storage=True),
+    "instrumented": dict(instrument=True),
+    "lazy": dict(lazy_metadata=True, skip_zero_len=False, check_read_permissions=False),
+}
+
+
+class _CountingEntry(object):
+    """
+    Wraps an os.DirEntry, counting the calls that can reach the filesystem.
+    """
+
+    def __init__(self, entry, counts):
+        self._entry = entry
+        self._counts = counts
+        self.name = entry.name
+        self.path = entry.path
+
+    def stat(self, *, follow_symlinks=True):
+        self._counts["direntry.stat"] += 1
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, *, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, *, follow_symlinks=True):
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self):
+        return self._entry.is_symlink()
+
+    def inode(self):
+        return self._entry.inode()
+
+
+class _CountingScandir(object):
+    """
+    Wraps the iterator returned by os.scandir so that it hands out _CountingEntry objects.
+    """
+
+    def __init__(self, iterator, counts):
+        self._iterator = iterator
+        self._counts = counts
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _CountingEntry(next(self._iterator), self._counts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._iterator.close()
+
+
+def _install_call_counters():
+    """
+    Replaces os.scandir, os.stat, and os.lstat with versions that count their calls. os.path.islink,
+    os.path.getsize etc. go through these as well. Stat calls made by DirEntry objects are counted separately. Calls
+    made from C code (other than through DirEntry) are not seen.
+
+    :return:
+        A dictionary of call counts that is updated as the calls are made.
+    """
+
+    counts = {"scandir": 0, "stat": 0, "lstat": 0, "direntry.stat": 0}
+    real_scandir = os.scandir
+    real_stat = os.stat
+    real_lstat = os.lstat
+
+    def scandir(*args, **kwargs):
+        counts["scandir"] += 1
+        return _CountingScandir(real_scandir(*args, **kwargs), counts)
+
+    def stat(*args, **kwargs):
+        counts["stat"] += 1
+        return real_stat(*args, **kwargs)
+
+    def lstat(*args, **kwargs):
+        counts["lstat"] += 1
+        return real_lstat(*args, **kwargs)
+
+    os.scandir = scandir
+    os.stat = stat
+    os.lstat = lstat
+
+    return counts
+
+
+def run_profile(root_p,
+                options_kwargs,
+                count_calls):
+    """
+    Scans the tree once with the given options. Meant to be run in its own process.
+
+    :param root_p:
+        The root of the tree to scan.
+    :param options_kwargs:
+        The keyword arguments for the Options object.
+    :param count_calls:
+        If True, the filesystem calls are counted (which slows the scan down, so the timings are not meaningful).
+
+    :return:
+        A dictionary of results.
+    """
+
+    from bvzscanfilesystem.options import Options
+    from bvzscanfilesystem.scanfiles import ScanFiles
+
+    counts = _install_call_counters() if count_calls else None
+
+    scan_obj = ScanFiles(scan_options=Options(**options_kwargs))
+
+    start = time.perf_counter()
+    for _ in scan_obj.scan_directories([root_p]):
+        pass
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    phases = {"scan": elapsed}
+    if scan_obj.stats is not None:
+        phases.update(scan_obj.stats.totals)
+
+    return {"seconds": elapsed,
+            "phases": phases,
+            "checked": scan_obj.checked_count,
+            "kept": scan_obj.initial_count,
+            "errors": scan_obj.error_count,
+            "peak_rss_bytes": peak_rss,
+            "calls": counts}
+
+
+def _run_in_process(root_p,
+                    options_kwargs,
+                    count_calls):
+    """
+    Runs run_profile in a freshly spawned process.
+
+    :param root_p:
+        The root of the tree to scan.
+    :param options_kwargs:
+        The keyword arguments for the Options object.
+    :param count_calls:
+        Whether to count the filesystem calls.
+
+    :return:
+        The dictionary returned by run_profile.
+    """
+
+    with multiprocessing.get_context("spawn").Pool(processes=1) as pool:
+        return pool.apply(run_profile, (root_p, options_kwargs, count_calls))
+
+
+def run_benchmark(root_p,
+                  spec,
+                  profiles,
+                  repeats=1):
+    """
+    Makes sure the tree exists and runs every profile against it.
+
+    :param root_p:
+        The directory holding (or to hold) the tree.
+    :param spec:
+        A treegen.TreeSpec object.
+    :param profiles:
+        A dictionary of {profile name: Options keyword arguments}.
+    :param repeats:
+        The number of timed runs per profile. The fastest one is reported.
+
+    :return:
+        A dictionary holding the settings and the results of every profile.
+    """
+
+    start = time.perf_counter()
+    counts, generated = treegen.ensure_tree(root_p=root_p, spec=spec)
+    generate_seconds = time.perf_counter() - start
+
+    results = dict()
+    for name, options_kwargs in profiles.items():
+
+        timed = min((_run_in_process(root_p, options_kwargs, False) for _ in range(repeats)),
+                    key=lambda result: result["seconds"])
+        counted = _run_in_process(root_p, options_kwargs, True)
+
+        checked = max(timed["checked"], 1)
+        results[name] = {"options": options_kwargs,
+                         "seconds": timed["seconds"],
+                         "files_per_sec": timed["checked"] / timed["seconds"] if timed["seconds"] else 0.0,
+                         "checked": timed["checked"],
+                         "kept": timed["kept"],
+                         "errors": timed["errors"],
+                         "peak_rss_bytes": timed["peak_rss_bytes"],
+                         "calls_per_file": {call: count / checked for call, count in counted["calls"].items()},
+                         "phases": timed["phases"]}
+
+    return {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "python": platform.python_version(),
+                     "platform": platform.platform(),
+                     "root": root_p,
+                     "spec": asdict(spec),
+                     "tree": counts,
+                     "generate_seconds": generate_seconds if generated else None},
+            "results": results}
+
+
+def print_results(report):
+    """
+    Prints a table of benchmark results.
+
+    :param report:
+        The dictionary returned by run_benchmark.
+
+    :return:
+        Nothing.
+    """
+
+    print(f"Tree: {report['meta']['tree']}")
+    print(f"{'profile':<12} {'seconds':>9} {'files/s':>11} {'calls/file':>11} {'peak RSS MB':>12}")
+    for name, result in report["results"].items():
+        calls = sum(result["calls_per_file"].values())
+        print(f"{name:<12} {result['seconds']:>9.3f} {result['files_per_sec']:>11.0f} {calls:>11.2f} "
+              f"{result['peak_rss_bytes'] / 2 ** 20:>12.1f}")
+
+
+def main():
+    parser = ArgumentParser(description="Benchmarks ScanFiles against a synthetic tree.")
+    parser.add_argument("root", help="The directory holding (or to hold) the synthetic tree.")
+    parser.add_argument("--profiles", nargs="+", choices=sorted(PROFILES), default=list(PROFILES),
+                        help="The profiles to run. Default: all of them.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per profile. Default: 3")
+    parser.add_argument("--output", help="A JSON file to save the results to.")
+    treegen.add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    report = run_benchmark(root_p=args.root,
+                           spec=treegen.spec_from_args(args),
+                           profiles={name: PROFILES[name] for name in args.profiles},
+                           repeats=args.repeats)
+
+    print_results(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
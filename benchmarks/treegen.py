@@ -0,0 +1,165 @@
+#! /usr/bin/env python3
+
+"""
+Generates reproducible synthetic directory trees to benchmark scans against.
+
+Run from the root of the repository with (see --help for the tree settings):
+
+    python -m benchmarks.treegen /tmp/scan_bench_tree
+"""
+
+from argparse import ArgumentParser
+from dataclasses import asdict
+from dataclasses import dataclass
+import json
+import os
+import random
+import shutil
+
+# Written into the root of every generated tree, so that an existing tree can be reused if the settings match.
+MANIFEST_N = ".treegen.json"
+
+
+@dataclass
+class TreeSpec:
+    width: int = 8
+    depth: int = 3
+    files_per_dir: int = 50
+    hidden_ratio: float = 0.05
+    zero_len_ratio: float = 0.05
+    symlink_ratio: float = 0.02
+    max_file_size: int = 4096
+    seed: int = 0
+
+
+def generate_tree(root_p,
+                  spec):
+    """
+    Builds a synthetic tree. Every directory down to spec.depth levels holds spec.files_per_dir entries and (apart from
+    the deepest level) spec.width subdirectories. The given ratios of files (and of directories, for hidden_ratio) are
+    hidden, empty, or symlinks to other files in the same directory. The same spec always builds the same tree.
+
+    :param root_p:
+        The directory to build the tree in. It must not exist yet.
+    :param spec:
+        A TreeSpec object holding the shape of the tree.
+
+    :return:
+        A dictionary of counts of what was created.
+    """
+
+    assert type(root_p) is str
+    assert not os.path.exists(root_p)
+
+    rng = random.Random(spec.seed)
+    counts = {"dirs": 0, "files": 0, "hidden": 0, "zero_len": 0, "symlinks": 0}
+    payload = b"x" * spec.max_file_size
+
+    pending = [(root_p, 0)]
+    while pending:
+
+        dir_p, level = pending.pop()
+        os.mkdir(dir_p)
+        counts["dirs"] += 1
+
+        targets = list()
+        for i in range(spec.files_per_dir):
+
+            hidden = rng.random() < spec.hidden_ratio
+            file_n = f"{'.' if hidden else ''}file_{i:05d}.{rng.choice(['exr', 'txt', 'tmp', 'py', 'jpg'])}"
+            file_p = os.path.join(dir_p, file_n)
+            counts["hidden"] += hidden
+
+            if targets and rng.random() < spec.symlink_ratio:
+                os.symlink(rng.choice(targets), file_p)
+                counts["symlinks"] += 1
+                continue
+
+            size = 0 if rng.random() < spec.zero_len_ratio else rng.randint(1, spec.max_file_size)
+            with open(file_p, "wb") as f:
+                f.write(payload[:size])
+            targets.append(file_n)
+            counts["files"] += 1
+            counts["zero_len"] += size == 0
+
+        if level < spec.depth:
+            for i in range(spec.width):
+                hidden = rng.random() < spec.hidden_ratio
+                pending.append((os.path.join(dir_p, f"{'.' if hidden else ''}dir_{i:03d}"), level + 1))
+
+    with open(os.path.join(root_p, MANIFEST_N), "w") as f:
+        json.dump({"spec": asdict(spec), "counts": counts}, f)
+
+    return counts
+
+
+def ensure_tree(root_p,
+                spec):
+    """
+    Reuses the tree at root_p if it was generated with the same spec. Otherwise (re)generates it.
+
+    :param root_p:
+        The directory holding the tree.
+    :param spec:
+        A TreeSpec object holding the shape of the tree.
+
+    :return:
+        A tuple containing the dictionary of counts of what the tree holds and whether it had to be generated.
+    """
+
+    manifest_p = os.path.join(root_p, MANIFEST_N)
+    if os.path.exists(manifest_p):
+        with open(manifest_p) as f:
+            manifest = json.load(f)
+        if manifest["spec"] == asdict(spec):
+            return manifest["counts"], False
+        shutil.rmtree(root_p)
+    elif os.path.exists(root_p):
+        raise IOError(f"{root_p} exists and was not generated by treegen. Refusing to overwrite it.")
+
+    return generate_tree(root_p=root_p, spec=spec), True
+
+
+def add_spec_arguments(parser):
+    """
+    Adds one command line argument for every field of TreeSpec.
+
+    :param parser:
+        An ArgumentParser.
+
+    :return:
+        Nothing.
+    """
+
+    for name, default in asdict(TreeSpec()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}",
+                            dest=name,
+                            type=type(default),
+                            default=default,
+                            help=f"Default: {default}")
+
+
+def spec_from_args(args):
+    """
+    :param args:
+        The parsed command line arguments (see add_spec_arguments).
+
+    :return:
+        A TreeSpec object.
+    """
+
+    return TreeSpec(**{name: getattr(args, name) for name in asdict(TreeSpec())})
+
+
+def main():
+    parser = ArgumentParser(description="Generates a reproducible synthetic directory tree.")
+    parser.add_argument("root", help="The directory to build the tree in.")
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    counts, generated = ensure_tree(root_p=args.root, spec=spec_from_args(args))
+    print(f"{'Generated' if generated else 'Reused'} {args.root}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+#! /usr/bin/env python3
+
+from array import array
+from collections.abc import MutableMapping
+import os
+import sys
+
+# A layout id that marks a row whose file has been deleted from the store.
+_DELETED = 0xFFFF
+
+# The store is compacted once it holds more than this many deleted rows and they outnumber the files still in it (so
+# that the cost of compacting is spread over at least as many deletions as there are files left).
+_COMPACT_MIN_DELETED = 4096
+
+
+class _Column(object):
+    """
+    A single metadata attribute for every row in a CompactFileStore. Integers, floats, and booleans are held in typed
+    arrays (8 or fewer bytes per row instead of a full python object). If a value turns up that does not fit the array,
+    the column quietly falls back to a plain list.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 sample,
+                 length):
+        """
+        :param sample:
+            The first value stored in this column. Used to pick the storage type.
+        :param length:
+            The number of rows already in the store (these are padded with filler values).
+        """
+
+        if type(sample) is bool:
+            self.kind = "bool"
+            self.values = array("b", bytes(length))
+        elif type(sample) is int:
+            self.kind = "int"
+            self.values = array("q", bytes(8 * length))
+        elif type(sample) is float:
+            self.kind = "float"
+            self.values = array("d", bytes(8 * length))
+        else:
+            self.kind = "object"
+            self.values = [None] * length
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _fits(self,
+              value):
+        """
+        :param value:
+            The value to test.
+
+        :return:
+            True if the value can be stored in this column without losing its type.
+        """
+
+        if self.kind == "object":
+            return True
+        if self.kind == "bool":
+            return type(value) is bool
+        if self.kind == "int":
+            return type(value) is int and -2 ** 63 <= value < 2 ** 63
+        return type(value) is float
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _to_list(self):
+        """
+        Converts the column to a plain list.
+
+        :return:
+            Nothing.
+        """
+
+        self.values = [self.get(row) for row in range(len(self.values))]
+        self.kind = "object"
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def append(self,
+               value):
+        """
+        :param value:
+            The value to append as a new row.
+
+        :return:
+            Nothing.
+        """
+
+        if not self._fits(value):
+            self._to_list()
+        self.values.append(value)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def pad(self):
+        """
+        Appends a filler value for a row that does not have this attribute.
+
+        :return:
+            Nothing.
+        """
+
+        self.values.append(None if self.kind == "object" else 0)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def set(self,
+            row,
+            value):
+        """
+        :param row:
+            The row to overwrite.
+        :param value:
+            The new value.
+
+        :return:
+            Nothing.
+        """
+
+        if not self._fits(value):
+            self._to_list()
+        self.values[row] = value
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def keep(self,
+             rows):
+        """
+        Drops every row except the given ones.
+
+        :param rows:
+            A list of the rows to keep, in the order they should be in afterwards.
+
+        :return:
+            Nothing.
+        """
+
+        values = self.values
+        if self.kind == "object":
+            self.values = [values[row] for row in rows]
+        else:
+            self.values = array(values.typecode, [values[row] for row in rows])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def get(self,
+            row):
+        """
+        :param row:
+            The row to read.
+
+        :return:
+            The value stored in that row.
+        """
+
+        if self.kind == "bool":
+            return bool(self.values[row])
+        return self.values[row]
+
+
+class CompactFileStore(MutableMapping):
+    """
+    A drop-in replacement for the dictionary of {file path: metadata dictionary} that ScanFiles builds, using a small
+    fraction of the memory. Instead of one dictionary per file (and one full path string per file), it keeps:
+
+    - each directory path once, with each file stored as a (directory id, file name) pair,
+    - each metadata attribute in its own column (typed arrays for numbers and booleans),
+    - string attributes that are equal to the file's directory or name as references to those same strings.
+
+    Reading a file returns a newly built metadata dictionary. Changing that dictionary does NOT change the store. Store
+    the modified dictionary back (store[path] = metadata) to do that.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 files=None):
+        """
+        :param files:
+            An optional mapping of {file path: metadata dictionary} to start with.
+        """
+
+        self._dirs = list()
+        self._parents = list()
+        self._dir_ids = dict()
+        self._dir_rows = list()
+
+        self._row_dir = array("l")
+        self._row_name = list()
+        self._row_layout = array("H")
+
+        self._layouts = list()
+        self._layout_ids = dict()
+
+        self._columns = dict()
+        self._length = 0
+
+        if files is not None:
+            self.update(files)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _split(file_p):
+        """
+        Splits a path into a directory part (including the trailing separator) and a name part. Unlike os.path.split,
+        the two parts always add back up to exactly the original path.
+
+        :param file_p:
+            The path to split.
+
+        :return:
+            A tuple containing the directory and the name.
+        """
+
+        position = file_p.rfind(os.path.sep) + 1
+        return file_p[:position], file_p[position:]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _find_row(self,
+                  file_p):
+        """
+        :param file_p:
+            The path of the file to look up.
+
+        :return:
+            The row that holds the file. None if the file is not in the store.
+        """
+
+        if type(file_p) is not str:
+            return None
+
+        dir_p, file_n = self._split(file_p)
+
+        dir_id = self._dir_ids.get(dir_p)
+        if dir_id is None:
+            return None
+
+        return self._dir_rows[dir_id].get(file_n)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _layout_id(self,
+                   keys):
+        """
+        :param keys:
+            A tuple of the metadata keys of a file (in order).
+
+        :return:
+            The id of that layout, adding it if it is new.
+        """
+
+        layout_id = self._layout_ids.get(keys)
+        if layout_id is None:
+            layout_id = len(self._layouts)
+            assert layout_id < _DELETED
+            self._layouts.append(keys)
+            self._layout_ids[keys] = layout_id
+        return layout_id
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _shared_value(self,
+                      value,
+                      dir_id,
+                      file_n):
+        """
+        Returns the parent directory or name string already held by the store in place of an equal value, so that the
+        same string is not stored once per file.
+
+        :param value:
+            The metadata value.
+        :param dir_id:
+            The id of the directory that holds the file.
+        :param file_n:
+            The name of the file.
+
+        :return:
+            The value, or an existing equal string.
+        """
+
+        if type(value) is str:
+            if value == file_n:
+                return file_n
+            parent = self._parents[dir_id]
+            if value == parent:
+                return parent
+        return value
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __setitem__(self,
+                    file_p,
+                    metadata):
+        """
+        :param file_p:
+            The full path to the file.
+        :param metadata:
+            The metadata dictionary of the file.
+
+        :return:
+            Nothing.
+        """
+
+        assert type(file_p) is str
+
+        keys = tuple(metadata)
+        layout_id = self._layout_id(keys)
+        row = self._find_row(file_p)
+
+        if row is not None:
+            dir_id = self._row_dir[row]
+            file_n = self._row_name[row]
+            for key in keys:
+                if key not in self._columns:
+                    self._columns[key] = _Column(sample=metadata[key], length=len(self._row_name))
+                self._columns[key].set(row, self._shared_value(metadata[key], dir_id, file_n))
+            self._row_layout[row] = layout_id
+            return
+
+        dir_p, file_n = self._split(file_p)
+        file_n = sys.intern(file_n)
+
+        dir_id = self._dir_ids.get(dir_p)
+        if dir_id is None:
+            dir_id = len(self._dirs)
+            self._dirs.append(dir_p)
+            # The same string os.path.split returns as the directory of a file in this directory.
+            self._parents.append(dir_p.rstrip(os.path.sep) or dir_p)
+            self._dir_ids[dir_p] = dir_id
+            self._dir_rows.append(dict())
+
+        row = len(self._row_name)
+        self._dir_rows[dir_id][file_n] = row
+        self._row_dir.append(dir_id)
+        self._row_name.append(file_n)
+        self._row_layout.append(layout_id)
+
+        for key in keys:
+            if key not in self._columns:
+                self._columns[key] = _Column(sample=metadata[key], length=row)
+        for key, column in self._columns.items():
+            if key in metadata:
+                column.append(self._shared_value(metadata[key], dir_id, file_n))
+            else:
+                column.pad()
+
+        self._length += 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __getitem__(self,
+                    file_p):
+        """
+        :param file_p:
+            The full path to the file.
+
+        :return:
+            A new metadata dictionary for the file.
+        """
+
+        row = self._find_row(file_p)
+        if row is None:
+            raise KeyError(file_p)
+
+        return self._build_metadata(row)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _build_metadata(self,
+                        row):
+        """
+        :param row:
+            The row to read.
+
+        :return:
+            A new metadata dictionary for the file in that row.
+        """
+
+        columns = self._columns
+        return {key: columns[key].get(row) for key in self._layouts[self._row_layout[row]]}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __delitem__(self,
+                    file_p):
+        """
+        Removes a file. Its row is only marked as deleted, and the space used by deleted rows is reclaimed by compact
+        (which is called automatically once they outnumber the files left in the store).
+
+        :param file_p:
+            The full path to the file.
+
+        :return:
+            Nothing.
+        """
+
+        row = self._find_row(file_p)
+        if row is None:
+            raise KeyError(file_p)
+
+        del self._dir_rows[self._row_dir[row]][self._row_name[row]]
+        self._row_layout[row] = _DELETED
+        self._length -= 1
+
+        deleted = len(self._row_name) - self._length
+        if deleted > _COMPACT_MIN_DELETED and deleted > self._length:
+            self.compact()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def compact(self):
+        """
+        Reclaims the space used by deleted rows (and by directories that no longer hold any files). The order the files
+        are iterated in does not change.
+
+        :return:
+            Nothing.
+        """
+
+        rows = [row for row, layout_id in enumerate(self._row_layout) if layout_id != _DELETED]
+
+        dir_map = dict()
+        dirs = list()
+        parents = list()
+        for row in rows:
+            dir_id = self._row_dir[row]
+            if dir_id not in dir_map:
+                dir_map[dir_id] = None
+        for dir_id in sorted(dir_map):
+            dir_map[dir_id] = len(dirs)
+            dirs.append(self._dirs[dir_id])
+            parents.append(self._parents[dir_id])
+
+        dir_rows = [dict() for _ in dirs]
+        row_dir = array("l")
+        row_name = list()
+        for new_row, row in enumerate(rows):
+            dir_id = dir_map[self._row_dir[row]]
+            file_n = self._row_name[row]
+            dir_rows[dir_id][file_n] = new_row
+            row_dir.append(dir_id)
+            row_name.append(file_n)
+
+        self._row_layout = array("H", [self._row_layout[row] for row in rows])
+        for column in self._columns.values():
+            column.keep(rows)
+
+        self._dirs = dirs
+        self._parents = parents
+        self._dir_ids = {dir_p: dir_id for dir_id, dir_p in enumerate(dirs)}
+        self._dir_rows = dir_rows
+        self._row_dir = row_dir
+        self._row_name = row_name
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __contains__(self,
+                     file_p):
+        return self._find_row(file_p) is not None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __iter__(self):
+        for dir_p, rows in zip(self._dirs, self._dir_rows):
+            for file_n in rows:
+                yield dir_p + file_n
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __len__(self):
+        return self._length
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} files in {len(self._dirs)} directories)"
@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+
+from dataclasses import dataclass
+from dataclasses import field
+import hashlib
+import os
+
+from bvzscanfilesystem.sqlitefile import SQLiteFile
+
+# Bump this whenever the layout of the cache table changes. A cache with a different version is thrown away.
+CACHE_VERSION = 1
+
+# A partial hash covers this many bytes from the start of the file and the same number from the end. Files no larger
+# than twice this are read in full by the partial hash, so their partial hash is also their full hash.
+PARTIAL_BYTES = 64 * 1024
+
+# The size of the buffer that files are read into when hashing them in full.
+READ_BYTES = 1024 * 1024
+
+
+@dataclass
+class HashReport:
+    """
+    What happened during a call to ScanFiles.hash_files.
+    """
+    files_hashed: int = 0
+    files_cached: int = 0
+    bytes_read: int = 0
+    seconds: float = 0.0
+    failed: set = field(default_factory=set)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @property
+    def mb_per_sec(self):
+        """
+        :return:
+            The read throughput in megabytes (1,000,000 bytes) per second.
+        """
+
+        if not self.seconds:
+            return 0.0
+        return self.bytes_read / self.seconds / 1000000
+
+
+class HashCache(SQLiteFile):
+    """
+    A persistent (SQLite) cache of file hashes, keyed on the device and inode of a file. A stored hash is only handed
+    back if the size and mtime of the file still match the ones it was stored with, so a file that has not changed is
+    never read again, while a file that has been modified (or replaced by a new file that reuses its inode) is.
+
+    Only use a HashCache from the thread that created it.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 cache_p,
+                 algorithm):
+        """
+        :param cache_p:
+            The path to the cache file. It is created if it does not exist.
+        :param algorithm:
+            The name of the hashlib algorithm the hashes are made with. If it differs from the one the cache was built
+            with, the cache is cleared.
+        """
+
+        assert type(cache_p) is str
+        assert type(algorithm) is str
+
+        super().__init__(file_p=cache_p,
+                         tables={"hashes": "st_dev INTEGER, "
+                                           "st_ino INTEGER, "
+                                           "size INTEGER, "
+                                           "mtime REAL, "
+                                           "partial TEXT, "
+                                           "full TEXT, "
+                                           "PRIMARY KEY (st_dev, st_ino)"},
+                         settings={"version": str(CACHE_VERSION),
+                                   "algorithm": algorithm})
+
+        self.cache_p = cache_p
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def get(self,
+            key):
+        """
+        :param key:
+            A tuple containing the device, inode, size, and mtime of a file.
+
+        :return:
+            A tuple containing the partial and full hashes stored for the file (either may be None). None if nothing is
+            stored for the file or if it has changed since its hashes were stored.
+        """
+
+        st_dev, st_ino, size, mtime = key
+
+        row = self.connection.execute("SELECT size, mtime, partial, full FROM hashes WHERE st_dev = ? AND st_ino = ?",
+                                      (st_dev, st_ino)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+
+        return row[2], row[3]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def put(self,
+            key,
+            partial,
+            full):
+        """
+        Stores the hashes of a file. A hash passed as None keeps whatever was stored for the same version of the file.
+
+        :param key:
+            A tuple containing the device, inode, size, and mtime of the file (as they were when it was read).
+        :param partial:
+            The partial hash of the file, or None.
+        :param full:
+            The full hash of the file, or None.
+
+        :return:
+            Nothing.
+        """
+
+        stored = self.get(key)
+        if stored is not None:
+            partial = stored[0] if partial is None else partial
+            full = stored[1] if full is None else full
+
+        self.connection.execute("INSERT OR REPLACE INTO hashes (st_dev, st_ino, size, mtime, partial, full) "
+                                "VALUES (?, ?, ?, ?, ?, ?)",
+                                (*key, partial, full))
+
+
+def hash_file(file_p,
+              algorithm,
+              partial):
+    """
+    Hashes a single file. Releases the GIL while reading and hashing, so it can be run on several threads at once.
+
+    :param file_p:
+        The full path to the file.
+    :param algorithm:
+        The name of the hashlib algorithm to use.
+    :param partial:
+        If True, only the first and last PARTIAL_BYTES of the file are hashed (the whole file if it is no larger than
+        twice that).
+
+    :return:
+        A tuple containing the hex digest, whether the whole file was read (in which case the digest is also the full
+        hash), the number of bytes read, and the key (device, inode, size, mtime) of the file as it was read.
+    """
+
+    hasher = hashlib.new(algorithm)
+
+    with open(file_p, "rb", buffering=0) as f:
+
+        stat_result = os.fstat(f.fileno())
+        key = (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime)
+
+        if partial and stat_result.st_size > 2 * PARTIAL_BYTES:
+            head = f.read(PARTIAL_BYTES)
+            f.seek(-PARTIAL_BYTES, os.SEEK_END)
+            tail = f.read(PARTIAL_BYTES)
+            hasher.update(head)
+            hasher.update(tail)
+            return hasher.hexdigest(), False, len(head) + len(tail), key
+
+        buffer = bytearray(READ_BYTES)
+        view = memoryview(buffer)
+        bytes_read = 0
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            hasher.update(view[:count])
+            bytes_read += count
+
+    return hasher.hexdigest(), True, bytes_read, key
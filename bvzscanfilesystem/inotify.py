@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+# Event masks (see inotify(7)).
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# Flags for inotify_init1.
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# The fixed size part of every event: wd, mask, cookie, and the length of the name that follows it.
+_EVENT = struct.Struct("iIII")
+
+# Enough room for a few hundred events per read.
+_READ_BYTES = 64 * 1024
+
+
+def _load_libc():
+    """
+    :return:
+        The C library, with the inotify functions set up. None if it (or inotify) is not available on this system.
+    """
+
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+
+    libc = ctypes.CDLL(name, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        return None
+
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_init1.restype = ctypes.c_int
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_add_watch.restype = ctypes.c_int
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    libc.inotify_rm_watch.restype = ctypes.c_int
+
+    return libc
+
+
+_libc = _load_libc()
+
+
+def available():
+    """
+    :return:
+        True if inotify can be used on this system.
+    """
+
+    return _libc is not None
+
+
+class Inotify(object):
+    """
+    A thin wrapper around a Linux inotify instance (using ctypes, so that there are no dependencies outside of the
+    standard library).
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this system.")
+
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def add_watch(self,
+                  path,
+                  mask):
+        """
+        Starts watching a path (or changes the events watched for, if it is already being watched).
+
+        :param path:
+            The path to watch.
+        :param mask:
+            The events to watch for.
+
+        :return:
+            The watch descriptor. Raises OSError if the path cannot be watched (ENOSPC when the limit on the number of
+            watches, fs.inotify.max_user_watches, has been reached).
+        """
+
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+
+        return wd
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def rm_watch(self,
+                 wd):
+        """
+        Stops watching. Errors (for example, a watch that the kernel already removed because its directory was deleted)
+        are ignored.
+
+        :param wd:
+            The watch descriptor returned by add_watch.
+
+        :return:
+            Nothing.
+        """
+
+        _libc.inotify_rm_watch(self.fd, wd)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def read_events(self,
+                    timeout):
+        """
+        Waits for events and reads every one that is ready.
+
+        :param timeout:
+            The longest time to wait (in seconds). None to wait until there is an event.
+
+        :return:
+            A list of (wd, mask, cookie, name) tuples. Empty if the timeout ran out. The name is an empty string for
+            events on the watched directory itself.
+        """
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return list()
+
+        events = list()
+        while True:
+            try:
+                data = os.read(self.fd, _READ_BYTES)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+        return events
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Closes the inotify instance, removing every watch.
+
+        :return:
+            Nothing.
+        """
+
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
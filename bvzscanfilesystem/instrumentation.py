@@ -0,0 +1,256 @@
+#! /usr/bin/env python3
+
+import heapq
+import threading
+import time
+
+# The phases of a scan that are timed.
+#   listing:     reading directory entries (os.scandir)
+#   filtering:   the hidden file/dir and regex filters
+#   metadata:    gathering the metadata of a file (stat calls)
+#   permissions: checking the read permissions of a file
+PHASES = ("listing", "filtering", "metadata", "permissions")
+
+# The histograms have one bucket per power of two microseconds: bucket n holds durations of 2**(n-1) up to 2**n
+# microseconds (bucket 0 holds anything under a microsecond). The last bucket also holds anything longer.
+HISTOGRAM_BUCKETS = 32
+
+
+class ScanStats(object):
+    """
+    Timings gathered while scanning (when the instrument option is on). For every phase it keeps the total time, the
+    number of times the phase ran, and a histogram of how long each run took. It also keeps the directories that took
+    the longest to list, and how many files were checked under each root and over what span of time.
+
+    ScanStats objects may be updated from several threads at once.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 slowest_count=10):
+        """
+        :param slowest_count:
+            The number of slowest directories to keep.
+        """
+
+        assert type(slowest_count) is int
+
+        self.slowest_count = slowest_count
+
+        self.totals = {phase: 0.0 for phase in PHASES}
+        self.counts = {phase: 0 for phase in PHASES}
+        self.histograms = {phase: [0] * HISTOGRAM_BUCKETS for phase in PHASES}
+
+        # A min-heap of (seconds, directory) so that the fastest of the slowest directories can be dropped cheaply.
+        self.slowest_dirs = list()
+
+        # {root path: [files checked, time first seen, time last seen]}
+        self.roots = dict()
+
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _bucket(seconds):
+        """
+        :param seconds:
+            A duration.
+
+        :return:
+            The histogram bucket the duration falls in.
+        """
+
+        return min(int(seconds * 1000000).bit_length(), HISTOGRAM_BUCKETS - 1)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def add(self,
+            phase,
+            seconds):
+        """
+        Records one run of a phase.
+
+        :param phase:
+            One of the PHASES.
+        :param seconds:
+            How long the phase took.
+
+        :return:
+            Nothing.
+        """
+
+        with self._lock:
+            self.totals[phase] += seconds
+            self.counts[phase] += 1
+            self.histograms[phase][self._bucket(seconds)] += 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def add_listing(self,
+                    dir_p,
+                    seconds):
+        """
+        Records the time taken to list a directory.
+
+        :param dir_p:
+            The directory that was listed.
+        :param seconds:
+            How long the listing took.
+
+        :return:
+            Nothing.
+        """
+
+        self.add("listing", seconds)
+
+        with self._lock:
+            if len(self.slowest_dirs) < self.slowest_count:
+                heapq.heappush(self.slowest_dirs, (seconds, dir_p))
+            elif self.slowest_dirs and seconds > self.slowest_dirs[0][0]:
+                heapq.heapreplace(self.slowest_dirs, (seconds, dir_p))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def add_root_files(self,
+                       root_p,
+                       count):
+        """
+        Records that files were checked under a root.
+
+        :param root_p:
+            The root the files were found under.
+        :param count:
+            The number of files.
+
+        :return:
+            Nothing.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            root = self.roots.get(root_p)
+            if root is None:
+                self.roots[root_p] = [count, now, now]
+            else:
+                root[0] += count
+                root[2] = now
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def to_dict(self):
+        """
+        :return:
+            The timings held by this object as a dictionary of plain python types (for saving, see from_dict).
+        """
+
+        with self._lock:
+            return {"slowest_count": self.slowest_count,
+                    "totals": dict(self.totals),
+                    "counts": dict(self.counts),
+                    "histograms": {phase: list(buckets) for phase, buckets in self.histograms.items()},
+                    "slowest_dirs": list(self.slowest_dirs),
+                    "roots": {root_p: list(root) for root_p, root in self.roots.items()}}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def from_dict(cls,
+                  state):
+        """
+        :param state:
+            A dictionary returned by to_dict.
+
+        :return:
+            A new ScanStats object holding the same timings.
+        """
+
+        stats = cls(slowest_count=state["slowest_count"])
+        for phase in PHASES:
+            stats.totals[phase] = state["totals"].get(phase, 0.0)
+            stats.counts[phase] = state["counts"].get(phase, 0)
+            stats.histograms[phase] = list(state["histograms"].get(phase, [0] * HISTOGRAM_BUCKETS))
+        stats.slowest_dirs = [tuple(item) for item in state["slowest_dirs"]]
+        heapq.heapify(stats.slowest_dirs)
+        stats.roots = {root_p: list(root) for root_p, root in state["roots"].items()}
+
+        return stats
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def merge(self,
+              other):
+        """
+        Adds the timings held by another ScanStats object (for example, one gathered in a worker process).
+
+        :param other:
+            The other ScanStats object.
+
+        :return:
+            Nothing.
+        """
+
+        with self._lock:
+            for phase in PHASES:
+                self.totals[phase] += other.totals[phase]
+                self.counts[phase] += other.counts[phase]
+                for bucket, count in enumerate(other.histograms[phase]):
+                    self.histograms[phase][bucket] += count
+
+            for seconds, dir_p in other.slowest_dirs:
+                if len(self.slowest_dirs) < self.slowest_count:
+                    heapq.heappush(self.slowest_dirs, (seconds, dir_p))
+                elif seconds > self.slowest_dirs[0][0]:
+                    heapq.heapreplace(self.slowest_dirs, (seconds, dir_p))
+
+            # Times from another process are not on the same clock, so only their span is kept.
+            now = time.monotonic()
+            for root_p, (count, first, last) in other.roots.items():
+                root = self.roots.get(root_p)
+                if root is None:
+                    self.roots[root_p] = [count, now - (last - first), now]
+                else:
+                    root[0] += count
+                    root[1] = min(root[1], now - (last - first))
+                    root[2] = now
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def slowest(self):
+        """
+        :return:
+            A list of (seconds, directory) tuples for the slowest directories to list, slowest first.
+        """
+
+        with self._lock:
+            return sorted(self.slowest_dirs, reverse=True)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def root_throughput(self):
+        """
+        :return:
+            A dictionary of {root path: files checked per second}.
+        """
+
+        with self._lock:
+            return {root_p: count / (last - first) if last > first else 0.0
+                    for root_p, (count, first, last) in self.roots.items()}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def summary(self):
+        """
+        :return:
+            A dictionary of plain python types summarizing the timings (suitable for printing or saving as JSON).
+        """
+
+        with self._lock:
+            phases = {phase: {"seconds": self.totals[phase],
+                              "count": self.counts[phase],
+                              "histogram": list(self.histograms[phase])} for phase in PHASES}
+
+        return {"phases": phases,
+                "slowest_dirs": self.slowest(),
+                "root_files_per_sec": self.root_throughput()}
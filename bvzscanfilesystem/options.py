@@ -15,3 +15,16 @@ class Options:
     report_frequency: int = 10
     uid: int = os.getuid()
     gid: int = os.getgid()
+    scan_threads: int = 1
+    direntry_metadata: bool = False
+    compact_storage: bool = False
+    scan_processes: int = 1
+    walk_order: str = "depth"
+    max_depth: (None, int) = None
+    instrument: bool = False
+    build_indexes: bool = False
+    same_filesystem: bool = False
+    collapse_hardlinks: bool = False
+    batch_loose_files: bool = False
+    lazy_metadata: bool = False
+    check_read_permissions: bool = True
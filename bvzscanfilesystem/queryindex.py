@@ -0,0 +1,677 @@
+#! /usr/bin/env python3
+
+import abc
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from collections.abc import Mapping
+import fnmatch
+import math
+import os
+import re
+
+# The characters that start a wildcard in a glob pattern (see fnmatch).
+_WILDCARDS = re.compile(r"[*?\[]")
+
+# The characters that can end a wildcard in a glob pattern.
+_WILDCARD_ENDS = re.compile(r"[*?\]]")
+
+# Stands in for a missing size (sizes are never negative).
+_NO_SIZE = -1
+
+
+class _NumericColumn(object):
+    """
+    A single numeric attribute (size or mtime) for every file in a QueryIndex, held twice: by row (to test a single
+    file) and sorted by value along with the row each value came from (to find every file in a range with a binary
+    search). Files whose metadata does not hold the attribute are left out of the sorted copy.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 typecode,
+                 values,
+                 missing):
+        """
+        :param typecode:
+            The array typecode to store the values with ("q" or "d").
+        :param values:
+            A list of the value for each row (the missing value for rows that do not have one).
+        :param missing:
+            The value that marks a row without a value.
+        """
+
+        self.missing = missing
+        self.by_row = array(typecode, values)
+
+        present = [row for row, value in enumerate(values) if not self.is_missing(value)]
+        present.sort(key=values.__getitem__)
+
+        self.rows = array("q", present)
+        self.sorted = array(typecode, [values[row] for row in present])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def is_missing(self,
+                   value):
+        """
+        :param value:
+            A value from the column.
+
+        :return:
+            True if the value marks a row without a value (NaN never equals itself, so it is tested separately).
+        """
+
+        if value != value:
+            return True
+        return value == self.missing
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def bounds(self,
+               min_value,
+               max_value):
+        """
+        :param min_value:
+            The smallest value to include. None for no lower limit.
+        :param max_value:
+            The largest value to include. None for no upper limit.
+
+        :return:
+            The start and end (exclusive) positions of the matching values in the sorted copy.
+        """
+
+        start = 0 if min_value is None else bisect_left(self.sorted, min_value)
+        end = len(self.sorted) if max_value is None else bisect_right(self.sorted, max_value)
+
+        return start, max(start, end)
+
+
+class Query(abc.ABC):
+    """
+    A set of files in a QueryIndex, as returned by its query methods. Queries are lazy: nothing is looked at until the
+    query is iterated. They can be combined with & (files in both), | (files in either), and - (files in the first but
+    not the second). An & starts from the smallest of its parts and narrows that down with the rest, so a narrow query
+    keeps the whole combination cheap.
+
+    Iterating a query yields the paths of the files in it, in sorted order.
+    """
+
+    # True if _candidates yields exactly the rows in the query (so there is no need to test them with _contains).
+    _exact = False
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 index):
+        """
+        :param index:
+            The QueryIndex this query is run against.
+        """
+
+        self.index = index
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @abc.abstractmethod
+    def _estimate(self):
+        """
+        :return:
+            The largest number of rows this query can hold (the number of rows _candidates may yield).
+        """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @abc.abstractmethod
+    def _candidates(self):
+        """
+        :return:
+            An iterable of rows that includes every row in this query (each once). It may include rows that are not,
+            unless _exact is True.
+        """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @abc.abstractmethod
+    def _contains(self,
+                  row):
+        """
+        :param row:
+            The row to test.
+
+        :return:
+            True if the row is in this query.
+        """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _matching(self):
+        """
+        :return:
+            A set of the rows in this query.
+        """
+
+        if self._exact:
+            return set(self._candidates())
+
+        return {row for row in self._candidates() if self._contains(row)}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _narrow(self,
+                rows):
+        """
+        Keeps only the rows that are also in this query.
+
+        :param rows:
+            A set of rows.
+
+        :return:
+            A set of the rows that are in both.
+        """
+
+        # Intersecting with the rows of this query happens in C, which is much quicker than testing the rows one at a
+        # time, as long as this query does not hold many more rows than the set.
+        if self._exact and self._estimate() <= 8 * len(rows):
+            return rows.intersection(self._candidates())
+
+        return {row for row in rows if self._contains(row)}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def rows(self):
+        """
+        :return:
+            A sorted list of the rows in this query (a row is the position of a file in the index's sorted paths).
+        """
+
+        return sorted(self._matching())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __iter__(self):
+        paths = self.index.paths
+        for row in self.rows():
+            yield paths[row]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self._matching())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __and__(self, other):
+        assert isinstance(other, Query) and other.index is self.index
+        return _And(self.index, (self, other))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __or__(self, other):
+        assert isinstance(other, Query) and other.index is self.index
+        return _Or(self.index, (self, other))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __sub__(self, other):
+        assert isinstance(other, Query) and other.index is self.index
+        return _Difference(self.index, self, other)
+
+
+class _RowRange(Query):
+    """
+    A contiguous range of rows (the files under a directory, since the rows are in path order).
+    """
+
+    _exact = True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 index,
+                 start,
+                 end):
+        """
+        :param index:
+            The QueryIndex this query is run against.
+        :param start:
+            The first row in the range.
+        :param end:
+            The row just after the last one in the range.
+        """
+
+        super().__init__(index)
+        self.start = start
+        self.end = end
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _estimate(self):
+        return self.end - self.start
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _candidates(self):
+        return range(self.start, self.end)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _contains(self,
+                  row):
+        return self.start <= row < self.end
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _narrow(self,
+                rows):
+        start = self.start
+        end = self.end
+        return {row for row in rows if start <= row < end}
+
+
+class _ValueRange(Query):
+    """
+    The rows whose value in a numeric column falls in a range.
+    """
+
+    _exact = True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 index,
+                 column,
+                 min_value,
+                 max_value):
+        """
+        :param index:
+            The QueryIndex this query is run against.
+        :param column:
+            The _NumericColumn to look in.
+        :param min_value:
+            The smallest value to include. None for no lower limit.
+        :param max_value:
+            The largest value to include. None for no upper limit.
+        """
+
+        super().__init__(index)
+        self.column = column
+        self.start, self.end = column.bounds(min_value, max_value)
+        self.min_value = min_value
+        self.max_value = max_value
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _estimate(self):
+        return self.end - self.start
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _candidates(self):
+        return self.column.rows[self.start:self.end]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _contains(self,
+                  row):
+
+        value = self.column.by_row[row]
+
+        # A missing value has to be ruled out even when there are no limits.
+        if self.column.is_missing(value):
+            return False
+        if self.min_value is not None and value < self.min_value:
+            return False
+        if self.max_value is not None and value > self.max_value:
+            return False
+        return True
+
+
+class _Glob(Query):
+    """
+    The rows whose path matches a glob pattern. Only the rows sharing the pattern's literal prefix (or, if that leaves
+    more than half of the index, its literal suffix) are tested against the pattern.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 index,
+                 pattern):
+        """
+        :param index:
+            The QueryIndex this query is run against.
+        :param pattern:
+            The glob pattern.
+        """
+
+        super().__init__(index)
+        self.match = re.compile(fnmatch.translate(pattern)).match
+
+        wildcard = _WILDCARDS.search(pattern)
+        prefix = pattern if wildcard is None else pattern[:wildcard.start()]
+
+        ends = list(_WILDCARD_ENDS.finditer(pattern))
+        suffix = pattern[ends[-1].end():] if ends and wildcard is not None else ""
+
+        self.start, self.end = index.prefix_bounds(prefix)
+        self.by_suffix = False
+
+        if suffix and self.end - self.start > len(index.paths) // 2:
+            start, end = index.suffix_bounds(suffix)
+            if end - start < self.end - self.start:
+                self.start, self.end = start, end
+                self.by_suffix = True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _estimate(self):
+        return self.end - self.start
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _candidates(self):
+        if self.by_suffix:
+            return self.index.suffix_rows[self.start:self.end]
+        return range(self.start, self.end)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _contains(self,
+                  row):
+        return self.match(self.index.paths[row]) is not None
+
+
+class _And(Query):
+    """
+    The rows that are in every one of a number of queries.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 index,
+                 parts):
+        """
+        :param index:
+            The QueryIndex this query is run against.
+        :param parts:
+            The queries to combine.
+        """
+
+        super().__init__(index)
+
+        # (a & b) & c is flattened into a single & of a, b, and c, so that the smallest of all three is started from.
+        flat = list()
+        for part in parts:
+            flat.extend(part.parts if isinstance(part, _And) else (part,))
+
+        self.parts = sorted(flat, key=lambda part: part._estimate())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _estimate(self):
+        return self.parts[0]._estimate()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _candidates(self):
+        return self.parts[0]._candidates()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _contains(self,
+                  row):
+        return all(part._contains(row) for part in self.parts)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _matching(self):
+        return self._narrow_by(self.parts[1:], self.parts[0]._matching())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _narrow(self,
+                rows):
+        return self._narrow_by(self.parts, rows)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _narrow_by(parts,
+                   rows):
+        """
+        :param parts:
+            The queries to narrow the rows down with, smallest first.
+        :param rows:
+            A set of rows.
+
+        :return:
+            A set of the rows that are in every one of the queries.
+        """
+
+        for part in parts:
+            if not rows:
+                break
+            rows = part._narrow(rows)
+
+        return rows
+
+
+class _Or(Query):
+    """
+    The rows that are in any of a number of queries.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 index,
+                 parts):
+        """
+        :param index:
+            The QueryIndex this query is run against.
+        :param parts:
+            The queries to combine.
+        """
+
+        super().__init__(index)
+        self.parts = tuple(parts)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _estimate(self):
+        return sum(part._estimate() for part in self.parts)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _candidates(self):
+        return self._matching()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _contains(self,
+                  row):
+        return any(part._contains(row) for part in self.parts)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _matching(self):
+        return set().union(*(part._matching() for part in self.parts))
+
+
+class _Difference(Query):
+    """
+    The rows that are in one query but not in another.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 index,
+                 included,
+                 excluded):
+        """
+        :param index:
+            The QueryIndex this query is run against.
+        :param included:
+            The query whose rows are kept.
+        :param excluded:
+            The query whose rows are taken out.
+        """
+
+        super().__init__(index)
+        self.included = included
+        self.excluded = excluded
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _estimate(self):
+        return self.included._estimate()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _candidates(self):
+        return self.included._candidates()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _contains(self,
+                  row):
+        return self.included._contains(row) and not self.excluded._contains(row)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _matching(self):
+        rows = self.included._matching()
+        return rows - self.excluded._narrow(rows)
+
+
+class QueryIndex(object):
+    """
+    A read only index of the files found by a scan, for answering repeated questions about them without a pass over
+    every file each time. It holds:
+
+    - every path, sorted (so the files under a directory, or sharing the literal start of a glob pattern, are a single
+      range found with a binary search),
+    - the size and mtime of every file, sorted along with the file each came from (so a size or mtime range is also a
+      single range found with a binary search),
+    - built the first time a glob pattern needs them, the paths reversed and sorted (so files sharing the literal end
+      of a pattern, such as "*.exr", are a range too).
+
+    The index is a snapshot: build a new one after the scan changes. Queries return Query objects, which can be
+    combined before they are run:
+
+        index = QueryIndex(scan_obj.files)
+        for file_p in index.under("/mnt/show") & index.size(min_size=2 ** 30) & index.mtime(min_mtime=week_ago):
+            ...
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 files):
+        """
+        :param files:
+            The files to index: a ScanFiles object or a {path: metadata} mapping (such as ScanFiles.files).
+        """
+
+        if not isinstance(files, Mapping):
+            files = files.files
+
+        items = sorted(files.items(), key=lambda item: item[0])
+
+        self.paths = [file_p for file_p, _ in items]
+
+        self.size_column = _NumericColumn(typecode="q",
+                                          values=[metadata.get("size", _NO_SIZE) for _, metadata in items],
+                                          missing=_NO_SIZE)
+        self.mtime_column = _NumericColumn(typecode="d",
+                                           values=[float(metadata.get("mtime", math.nan)) for _, metadata in items],
+                                           missing=math.nan)
+
+        self._reversed_paths = None
+        self.suffix_rows = None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.paths)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def prefix_bounds(self,
+                      prefix):
+        """
+        :param prefix:
+            The start of a path.
+
+        :return:
+            The first row whose path starts with the prefix and the row just after the last one. All such rows are
+            between the two, since the rows are in path order.
+        """
+
+        start = bisect_left(self.paths, prefix)
+        if not prefix:
+            return start, len(self.paths)
+
+        # Every string starting with the prefix sorts before the prefix with its last character bumped up by one.
+        end = bisect_left(self.paths, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+
+        return start, end
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def suffix_bounds(self,
+                      suffix):
+        """
+        :param suffix:
+            The end of a path.
+
+        :return:
+            The start and end (exclusive) positions in suffix_rows of the rows whose path ends with the suffix.
+        """
+
+        if self._reversed_paths is None:
+            order = sorted(range(len(self.paths)), key=lambda row: self.paths[row][::-1])
+            self._reversed_paths = [self.paths[row][::-1] for row in order]
+            self.suffix_rows = array("q", order)
+
+        prefix = suffix[::-1]
+        start = bisect_left(self._reversed_paths, prefix)
+        end = bisect_left(self._reversed_paths, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+
+        return start, end
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def all(self):
+        """
+        :return:
+            A Query holding every file.
+        """
+
+        return _RowRange(self, 0, len(self.paths))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def under(self,
+              dir_p):
+        """
+        :param dir_p:
+            A directory.
+
+        :return:
+            A Query holding every file under the directory (at any depth).
+        """
+
+        assert type(dir_p) is str
+
+        start, end = self.prefix_bounds(os.path.join(dir_p, ""))
+        return _RowRange(self, start, end)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def glob(self,
+             pattern):
+        """
+        :param pattern:
+            A glob pattern matched against the full path, with the same rules as fnmatch.fnmatchcase (so * and ? also
+            match the path separator).
+
+        :return:
+            A Query holding every file whose path matches the pattern.
+        """
+
+        assert type(pattern) is str
+
+        return _Glob(self, pattern)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def size(self,
+             min_size=None,
+             max_size=None):
+        """
+        :param min_size:
+            The smallest size (in bytes) to include. None for no lower limit.
+        :param max_size:
+            The largest size (in bytes) to include. None for no upper limit.
+
+        :return:
+            A Query holding every file whose size is in the range. Files whose metadata does not hold a size (see the
+            lazy_metadata option) are never included.
+        """
+
+        assert min_size is None or type(min_size) is int
+        assert max_size is None or type(max_size) is int
+
+        return _ValueRange(self, self.size_column, min_size, max_size)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def mtime(self,
+              min_mtime=None,
+              max_mtime=None):
+        """
+        :param min_mtime:
+            The earliest modification time (in seconds since the epoch) to include. None for no lower limit.
+        :param max_mtime:
+            The latest modification time to include. None for no upper limit.
+
+        :return:
+            A Query holding every file whose mtime is in the range. Files whose metadata does not hold an mtime are
+            never included.
+        """
+
+        assert min_mtime is None or type(min_mtime) in (int, float)
+        assert max_mtime is None or type(max_mtime) in (int, float)
+
+        return _ValueRange(self, self.mtime_column, min_mtime, max_mtime)
@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+
+import re
+
+# Characters that have a special meaning in a regular expression. A pattern that contains none of these (other than
+# escaped punctuation and the ^ and $ anchors at either end) is a plain literal and can be matched with str methods.
+_META_CHARS = set(".^$*+?{}[]\\|()")
+
+
+class RegexMatcher(object):
+    """
+    Matches a string against a list of regular expressions, returning True if ANY of them would match with re.search.
+    The regexes are compiled once when the matcher is created. Patterns that are really just literals (for example:
+    "\\.tmp$" or "^cache") are matched using str.endswith, str.startswith, or the in operator. The rest are combined
+    into a single alternation where that is safe to do, so that each item only has to be run through the regex engine
+    once.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 regexes):
+        """
+        :param regexes:
+            A list, set, or tuple of regex expressions (as strings).
+        """
+
+        assert type(regexes) in [list, set, tuple]
+        for regex in regexes:
+            assert type(regex) is str
+
+        self.regexes = tuple(regexes)
+
+        self._match_all = False
+        prefixes = list()
+        suffixes = list()
+        exact = set()
+        substrings = list()
+        combinable = list()
+        separate = list()
+
+        for regex in self.regexes:
+
+            literal = self._parse_literal(regex)
+
+            if literal is None:
+                compiled = re.compile(regex)
+                if compiled.groups == 0 and compiled.flags == re.compile("").flags:
+                    combinable.append(regex)
+                else:
+                    separate.append(compiled)
+                continue
+
+            text, anchored_start, anchored_end = literal
+
+            # $ (without the MULTILINE flag) also matches just before a newline at the very end of the string.
+            if anchored_start and anchored_end:
+                exact.add(text)
+                exact.add(text + "\n")
+            elif anchored_start:
+                prefixes.append(text)
+            elif anchored_end:
+                suffixes.append(text)
+                suffixes.append(text + "\n")
+            elif text:
+                substrings.append(text)
+            else:
+                self._match_all = True
+
+        self._prefixes = tuple(prefixes)
+        self._suffixes = tuple(suffixes)
+        self._exact = frozenset(exact)
+        self._substrings = tuple(substrings)
+
+        if combinable:
+            separate.insert(0, re.compile("|".join(f"(?:{regex})" for regex in combinable)))
+        self._compiled = tuple(separate)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _parse_literal(regex):
+        """
+        Determines whether a regex is a plain literal string, optionally anchored at the start and/or the end.
+
+        :param regex:
+            The regex to examine.
+
+        :return:
+            None if the regex is not a literal. Otherwise a tuple containing the literal text, whether it was anchored
+            with a leading ^, and whether it was anchored with a trailing $.
+        """
+
+        anchored_start = regex.startswith("^")
+        body = regex[1:] if anchored_start else regex
+
+        anchored_end = False
+        if body.endswith("$"):
+            # Make sure the $ is not itself escaped (i.e. preceded by an odd number of backslashes).
+            backslashes = len(body[:-1]) - len(body[:-1].rstrip("\\"))
+            if backslashes % 2 == 0:
+                anchored_end = True
+                body = body[:-1]
+
+        text = list()
+        i = 0
+        while i < len(body):
+            char = body[i]
+            if char == "\\":
+                if i + 1 >= len(body):
+                    return None
+                escaped = body[i + 1]
+                # Escaped letters, digits and underscores are classes (\d), anchors (\b), backreferences (\1) etc.
+                if escaped.isalnum() or escaped == "_":
+                    return None
+                text.append(escaped)
+                i += 2
+                continue
+            if char in _META_CHARS:
+                return None
+            text.append(char)
+            i += 1
+
+        return "".join(text), anchored_start, anchored_end
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def search(self,
+               item):
+        """
+        Returns whether any of the regexes matches (anywhere in) the item.
+
+        :param item:
+            A string to run the regexes against.
+
+        :return:
+            True if any regex matches the item. False otherwise.
+        """
+
+        if self._match_all:
+            return True
+
+        if self._suffixes and item.endswith(self._suffixes):
+            return True
+
+        if self._prefixes and item.startswith(self._prefixes):
+            return True
+
+        if item in self._exact:
+            return True
+
+        for substring in self._substrings:
+            if substring in item:
+                return True
+
+        for compiled in self._compiled:
+            if compiled.search(item) is not None:
+                return True
+
+        return False
@@ -0,0 +1,220 @@
+#! /usr/bin/env python3
+
+import io
+from itertools import islice
+import pickle
+import struct
+
+# Identifies a saved scan file.
+MAGIC = b"BVZSCAN\x00"
+
+# Bump this whenever the layout of a saved scan changes. Files saved with a different version cannot be loaded.
+SAVE_VERSION = 2
+
+# The number of files stored in each chunk. Chunks are pickled (and unpickled) one at a time, so this bounds the
+# memory needed on top of the files themselves while saving or loading.
+CHUNK_FILES = 65536
+
+# Every section of a saved scan is written as its length (an unsigned 64 bit int) followed by that many bytes of
+# pickled data. A length of zero ends the file.
+_LENGTH = struct.Struct("<Q")
+
+
+class _PlainUnpickler(pickle.Unpickler):
+    """
+    An unpickler that only rebuilds plain python data (dicts, lists, tuples, sets, strings, bytes, numbers, booleans,
+    and None). Every section of a saved scan (and every directory record in a scan index) is plain data, so anything
+    that asks for a class or a function (which is how a pickle runs code while it is loaded) is refused. This also means
+    a saved scan does not depend on the names of any of the classes in this package.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Only plain data may be loaded (found a reference to {module}.{name}).")
+
+
+def loads_plain(data):
+    """
+    Unpickles data that may only hold plain python data (see _PlainUnpickler).
+
+    :param data:
+        The pickled bytes.
+
+    :return:
+        The unpickled object. Raises pickle.UnpicklingError if the data holds anything other than plain data.
+    """
+
+    return _PlainUnpickler(io.BytesIO(data)).load()
+
+
+def _write_section(f,
+                   section):
+    """
+    Pickles a single section and writes it (preceded by its length) to an open file.
+
+    :param f:
+        A file opened for writing in binary mode.
+    :param section:
+        The object to pickle. It may only hold plain python data (see _PlainUnpickler).
+
+    :return:
+        Nothing.
+    """
+
+    data = pickle.dumps(section, protocol=pickle.HIGHEST_PROTOCOL)
+    f.write(_LENGTH.pack(len(data)))
+    f.write(data)
+
+
+def _read_section(f):
+    """
+    Reads a single section from an open file.
+
+    :param f:
+        A file opened for reading in binary mode, positioned at the start of a section.
+
+    :return:
+        The unpickled section. None if this is the end of the file. Raises pickle.UnpicklingError if the section holds
+        anything other than plain data.
+    """
+
+    length = _LENGTH.unpack(f.read(_LENGTH.size))[0]
+    if length == 0:
+        return None
+
+    return loads_plain(f.read(length))
+
+
+def _chunk(files):
+    """
+    Packs some files into a chunk. Files with the same metadata keys are stored together as a tuple of the keys, a list
+    of paths, and a list of tuples of values (so the keys are stored once per chunk rather than once per file). The
+    file_d value of files in the same directory is made the same string object, which pickle then stores only once.
+
+    :param files:
+        A list of (path, metadata dictionary) tuples.
+
+    :return:
+        A list of (keys, paths, rows) tuples.
+    """
+
+    groups = dict()
+    dirs = dict()
+
+    for file_p, metadata in files:
+        keys = tuple(metadata)
+        group = groups.get(keys)
+        if group is None:
+            group = groups[keys] = (list(), list(), keys.index("file_d") if "file_d" in keys else None)
+        paths, rows, dir_index = group
+        paths.append(file_p)
+        row = tuple(metadata.values())
+        if dir_index is not None:
+            file_d = row[dir_index]
+            if dirs.setdefault(file_d, file_d) is not file_d:
+                row = row[:dir_index] + (dirs[file_d],) + row[dir_index + 1:]
+        rows.append(row)
+
+    return [(keys, paths, rows) for keys, (paths, rows, _) in groups.items()]
+
+
+def write_scan(file_p,
+               header,
+               files):
+    """
+    Writes a saved scan file: the magic string and version, a header section, and then the files in chunks.
+
+    :param file_p:
+        The path to write to. It is overwritten if it exists.
+    :param header:
+        A dictionary holding everything other than the files (plain python data only).
+    :param files:
+        An iterable of (path, metadata dictionary) tuples.
+
+    :return:
+        The number of files written.
+    """
+
+    assert type(file_p) is str
+    assert type(header) is dict
+
+    count = 0
+
+    with open(file_p, "wb") as f:
+
+        f.write(MAGIC)
+        f.write(struct.pack("<I", SAVE_VERSION))
+        _write_section(f, header)
+
+        files = iter(files)
+        while True:
+            pending = list(islice(files, CHUNK_FILES))
+            if not pending:
+                break
+            _write_section(f, _chunk(pending))
+            count += len(pending)
+
+        f.write(_LENGTH.pack(0))
+
+    return count
+
+
+def read_header(f):
+    """
+    Checks the magic string and version of an open saved scan file and reads its header.
+
+    :param f:
+        A file opened for reading in binary mode, positioned at the start.
+
+    :return:
+        The header dictionary.
+    """
+
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} is not a saved scan.")
+
+    version = struct.unpack("<I", f.read(4))[0]
+    if version != SAVE_VERSION:
+        raise ValueError(f"{f.name} was saved with version {version} (only version {SAVE_VERSION} can be loaded).")
+
+    return _read_section(f)
+
+
+def iter_files(f):
+    """
+    Streams the files out of an open saved scan file, one chunk at a time.
+
+    :param f:
+        A file opened for reading in binary mode, positioned just after the header (see read_header).
+
+    :return:
+        Nothing. Yields lists of (path, metadata dictionary) tuples.
+    """
+
+    while True:
+        chunk = _read_section(f)
+        if chunk is None:
+            return
+        for keys, paths, rows in chunk:
+            yield [(file_p, dict(zip(keys, row))) for file_p, row in zip(paths, rows)]
+
+
+def iter_records(f):
+    """
+    Streams the files out of an open saved scan file one at a time. Only the pickled chunk being read is held in memory,
+    not a metadata dictionary for every file in it.
+
+    :param f:
+        A file opened for reading in binary mode, positioned just after the header (see read_header).
+
+    :return:
+        Nothing. Yields (path, metadata dictionary) tuples.
+    """
+
+    while True:
+        chunk = _read_section(f)
+        if chunk is None:
+            return
+        for keys, paths, rows in chunk:
+            for file_p, row in zip(paths, rows):
+                yield file_p, dict(zip(keys, row))
@@ -0,0 +1,475 @@
+#! /usr/bin/env python3
+
+from collections.abc import Mapping
+import os
+import pickle
+import tempfile
+
+from bvzscanfilesystem.savedscan import iter_records
+from bvzscanfilesystem.savedscan import read_header
+
+# The kinds of change yielded by diff_scans.
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+MOVED = "moved"
+
+# The ways diff_scans can match a removed file with an added one to report a move.
+MOVE_KEYS = ("inode", "size_mtime", None)
+
+# The number of partitions used when the scans are diffed on disk. Only about 1/128th of a scan is held in memory at
+# once (pass more partitions for very large scans).
+DEFAULT_PARTITIONS = 128
+
+# Attributes that are worked out from the path of a file, so they are left out when deciding whether a file with the
+# same path in both scans was modified (rel_p differs between two scans of the same files made from different roots).
+_PATH_ATTRS = ("file_n", "file_d", "rel_p")
+
+# The number of items buffered for each partition before they are written to disk. Kept small since every partition
+# has its own buffer.
+_CHUNK_ITEMS = 256
+
+
+class _Partitions(object):
+    """
+    A set of temporary files that items are spread over (by the caller's choice of partition), written in pickled
+    chunks and read back one partition at a time.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 work_d,
+                 name,
+                 count):
+        """
+        :param work_d:
+            The directory to create the partition files in.
+        :param name:
+            The prefix of the partition file names.
+        :param count:
+            The number of partitions.
+        """
+
+        self.paths = [os.path.join(work_d, f"{name}.{index}") for index in range(count)]
+        self._buffers = [list() for _ in range(count)]
+        self._files = [None] * count
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def add(self,
+            index,
+            item):
+        """
+        Adds an item to a partition.
+
+        :param index:
+            The partition to add the item to.
+        :param item:
+            Any picklable object.
+
+        :return:
+            Nothing.
+        """
+
+        buffer = self._buffers[index]
+        buffer.append(item)
+        if len(buffer) >= _CHUNK_ITEMS:
+            self._flush(index)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _flush(self,
+               index):
+        """
+        Writes the buffered items of a partition to its file.
+
+        :param index:
+            The partition to flush.
+
+        :return:
+            Nothing.
+        """
+
+        if self._files[index] is None:
+            self._files[index] = open(self.paths[index], "wb")
+        pickle.dump(self._buffers[index], self._files[index], protocol=pickle.HIGHEST_PROTOCOL)
+        self._buffers[index] = list()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Writes out everything still buffered and closes the partition files.
+
+        :return:
+            Nothing.
+        """
+
+        for index in range(len(self.paths)):
+            if self._buffers[index]:
+                self._flush(index)
+            if self._files[index] is not None:
+                self._files[index].close()
+                self._files[index] = None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def read(self,
+             index):
+        """
+        Reads a partition back. Call close first.
+
+        :param index:
+            The partition to read.
+
+        :return:
+            Nothing. Yields the items in the partition.
+        """
+
+        if not os.path.exists(self.paths[index]):
+            return
+
+        with open(self.paths[index], "rb") as f:
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    return
+                yield from chunk
+
+
+def _as_mapping(scan):
+    """
+    :param scan:
+        A scan as passed to diff_scans.
+
+    :return:
+        The {path: metadata} mapping of the scan. None if the scan is a saved scan (which is only ever streamed).
+    """
+
+    if type(scan) is str:
+        return None
+
+    if isinstance(scan, Mapping):
+        return scan
+
+    return scan.files
+
+
+def _iter_scan(scan):
+    """
+    Streams the files out of a scan.
+
+    :param scan:
+        A scan as passed to diff_scans.
+
+    :return:
+        Nothing. Yields (path, metadata) tuples.
+    """
+
+    files = _as_mapping(scan)
+
+    if files is not None:
+        yield from files.items()
+        return
+
+    with open(scan, "rb") as f:
+        read_header(f)
+        yield from iter_records(f)
+
+
+def _is_modified(old_metadata,
+                 new_metadata):
+    """
+    Compares the metadata of a file with the same path in both scans. Only attributes held by both are compared (so a
+    scan that was hashed, or stored lazily, can still be compared with one that was not), and attributes worked out
+    from the path are ignored.
+
+    :param old_metadata:
+        The metadata of the file in the old scan.
+    :param new_metadata:
+        The metadata of the file in the new scan.
+
+    :return:
+        True if the file was modified.
+    """
+
+    if old_metadata == new_metadata:
+        return False
+
+    for attr, value in old_metadata.items():
+        if attr in new_metadata and attr not in _PATH_ATTRS and new_metadata[attr] != value:
+            return True
+
+    return False
+
+
+def _move_key(metadata,
+              move_key):
+    """
+    Returns the key that a removed file and an added file must share for the pair to be reported as a move. Either way
+    the size and mtime must match, so a file that was moved and also modified is reported as removed and added (which
+    also keeps an inode that was reused by an unrelated file from being mistaken for a move).
+
+    :param metadata:
+        The metadata of the file.
+    :param move_key:
+        "inode" to match on the device and inode numbers (falling back to "size_mtime" for metadata that does not hold
+        them), or "size_mtime" to match on the size and mtime alone.
+
+    :return:
+        The key. None if the metadata does not hold what is needed (the file can then never be part of a move).
+    """
+
+    size = metadata.get("size")
+    mtime = metadata.get("mtime")
+    if size is None or mtime is None:
+        return None
+
+    if move_key == "inode" and "st_ino" in metadata:
+        return metadata["st_dev"], metadata["st_ino"], size, mtime
+
+    return size, mtime
+
+
+def _match_moves(removed_p,
+                 added_p):
+    """
+    Pairs up the removed and added files that share a move key. Files with the same name are paired first, then the
+    rest in path order. Anything left over is reported as removed or added.
+
+    :param removed_p:
+        A list of the paths of removed files sharing a key.
+    :param added_p:
+        A list of the paths of added files sharing the same key.
+
+    :return:
+        Nothing. Yields (change, path, old path) tuples.
+    """
+
+    if len(removed_p) == 1 and len(added_p) == 1:
+        yield MOVED, added_p[0], removed_p[0]
+        return
+
+    unpaired_p = dict()
+    for old_p in sorted(removed_p):
+        unpaired_p.setdefault(os.path.split(old_p)[1], list()).append(old_p)
+
+    leftover_p = list()
+    for new_p in sorted(added_p):
+        same_name_p = unpaired_p.get(os.path.split(new_p)[1])
+        if same_name_p:
+            yield MOVED, new_p, same_name_p.pop(0)
+        else:
+            leftover_p.append(new_p)
+
+    remaining_p = sorted(old_p for paths in unpaired_p.values() for old_p in paths)
+
+    for new_p, old_p in zip(leftover_p, remaining_p):
+        yield MOVED, new_p, old_p
+
+    for new_p in leftover_p[len(remaining_p):]:
+        yield ADDED, new_p, None
+
+    for old_p in remaining_p[len(leftover_p):]:
+        yield REMOVED, old_p, None
+
+
+def _resolve_candidates(removed_by_key,
+                        added_by_key):
+    """
+    Turns the removed and added files that could be part of a move into moves, removals, and additions.
+
+    :param removed_by_key:
+        A dictionary of {move key: list of paths} of the removed files.
+    :param added_by_key:
+        A dictionary of {move key: list of paths} of the added files.
+
+    :return:
+        Nothing. Yields (change, path, old path) tuples.
+    """
+
+    for key, removed_p in removed_by_key.items():
+        added_p = added_by_key.pop(key, None)
+        if added_p is None:
+            for old_p in removed_p:
+                yield REMOVED, old_p, None
+        else:
+            yield from _match_moves(removed_p=removed_p, added_p=added_p)
+
+    for added_p in added_by_key.values():
+        for new_p in added_p:
+            yield ADDED, new_p, None
+
+
+def diff_scans(old,
+               new,
+               move_key="inode",
+               partitions=None,
+               temp_d=None):
+    """
+    Compares two scans and yields the changes that turn the old one into the new one, as they are found. A removed
+    file and an added file with the same size and mtime (and, for move_key="inode", the same device and inode) are
+    reported as a single move rather than as a removal and an addition. A file with the same path in both scans is
+    reported as modified if any attribute held by both differs.
+
+    If both scans are in memory, the diff is a hash join against the dictionaries that already hold the files: the
+    only memory used on top of them goes to the files that could be part of a move. If either scan is a saved scan,
+    both are streamed into partitions on disk (split by a hash of the path, and then by a hash of the move key) and
+    diffed one partition at a time, so that only about 1/partitions of a scan is ever held in memory.
+
+    :param old:
+        The earlier scan: a ScanFiles object, a {path: metadata} mapping (such as ScanFiles.files), or the path to a
+        scan saved by ScanFiles.save.
+    :param new:
+        The later scan, in any of the same forms.
+    :param move_key:
+        "inode" to match moves on the device and inode numbers (falling back to "size_mtime" for files whose metadata
+        does not hold them, which is the case unless the scan used direntry_metadata, build_indexes, or
+        collapse_hardlinks), "size_mtime" to match on the size and mtime alone, or None to not look for moves at all.
+    :param partitions:
+        The number of partitions to diff on disk with. If None, scans that are both in memory are diffed in memory
+        and any other scans with DEFAULT_PARTITIONS partitions. Pass a number to diff on disk regardless.
+    :param temp_d:
+        The directory to create the partitions in. If None, the system's temporary directory is used.
+
+    :return:
+        Nothing. Yields (change, path, old path) tuples. The change is ADDED, REMOVED, MODIFIED, or MOVED. The path is
+        the path of the file in the new scan (in the old scan for REMOVED). The old path is only set for MOVED.
+    """
+
+    assert move_key in MOVE_KEYS
+    assert partitions is None or (type(partitions) is int and partitions > 0)
+    assert temp_d is None or type(temp_d) is str
+
+    old_files = _as_mapping(old)
+    new_files = _as_mapping(new)
+
+    if partitions is None and old_files is not None and new_files is not None:
+        yield from _diff_in_memory(old_files=old_files, new_files=new_files, move_key=move_key)
+        return
+
+    yield from _diff_on_disk(old=old,
+                             new=new,
+                             move_key=move_key,
+                             partitions=partitions or DEFAULT_PARTITIONS,
+                             temp_d=temp_d)
+
+
+def _diff_in_memory(old_files,
+                    new_files,
+                    move_key):
+    """
+    Diffs two scans that are both in memory (see diff_scans).
+
+    :param old_files:
+        The {path: metadata} mapping of the old scan.
+    :param new_files:
+        The {path: metadata} mapping of the new scan.
+    :param move_key:
+        See diff_scans.
+
+    :return:
+        Nothing. Yields (change, path, old path) tuples.
+    """
+
+    removed_by_key = dict()
+    added_by_key = dict()
+
+    for new_p, metadata in new_files.items():
+        old_metadata = old_files.get(new_p)
+        if old_metadata is not None:
+            if _is_modified(old_metadata=old_metadata, new_metadata=metadata):
+                yield MODIFIED, new_p, None
+            continue
+        key = None if move_key is None else _move_key(metadata=metadata, move_key=move_key)
+        if key is None:
+            yield ADDED, new_p, None
+        else:
+            added_by_key.setdefault(key, list()).append(new_p)
+
+    for old_p, metadata in old_files.items():
+        if old_p in new_files:
+            continue
+        key = None if move_key is None else _move_key(metadata=metadata, move_key=move_key)
+        if key is None:
+            yield REMOVED, old_p, None
+        else:
+            removed_by_key.setdefault(key, list()).append(old_p)
+
+    yield from _resolve_candidates(removed_by_key=removed_by_key, added_by_key=added_by_key)
+
+
+def _diff_on_disk(old,
+                  new,
+                  move_key,
+                  partitions,
+                  temp_d):
+    """
+    Diffs two scans one partition at a time (see diff_scans).
+
+    :param old:
+        The old scan, as passed to diff_scans.
+    :param new:
+        The new scan, as passed to diff_scans.
+    :param move_key:
+        See diff_scans.
+    :param partitions:
+        The number of partitions.
+    :param temp_d:
+        The directory to create the partitions in, or None.
+
+    :return:
+        Nothing. Yields (change, path, old path) tuples.
+    """
+
+    with tempfile.TemporaryDirectory(prefix="scandiff.", dir=temp_d) as work_d:
+
+        # Split both scans by path, so that a file that is in both ends up in the same partition of each.
+        by_path = dict()
+        for name, scan in (("old", old), ("new", new)):
+            by_path[name] = _Partitions(work_d=work_d, name=name, count=partitions)
+            for file_p, metadata in _iter_scan(scan):
+                by_path[name].add(hash(file_p) % partitions, (file_p, metadata))
+            by_path[name].close()
+
+        # The files that could be part of a move are split again by their move key, since the two ends of a move have
+        # different paths (and so will usually have landed in different partitions).
+        removed_by_key = _Partitions(work_d=work_d, name="removed", count=partitions)
+        added_by_key = _Partitions(work_d=work_d, name="added", count=partitions)
+
+        for index in range(partitions):
+
+            old_files = dict(by_path["old"].read(index))
+
+            for new_p, metadata in by_path["new"].read(index):
+                old_metadata = old_files.pop(new_p, None)
+                if old_metadata is not None:
+                    if _is_modified(old_metadata=old_metadata, new_metadata=metadata):
+                        yield MODIFIED, new_p, None
+                    continue
+                key = None if move_key is None else _move_key(metadata=metadata, move_key=move_key)
+                if key is None:
+                    yield ADDED, new_p, None
+                else:
+                    added_by_key.add(hash(key) % partitions, (key, new_p))
+
+            for old_p, metadata in old_files.items():
+                key = None if move_key is None else _move_key(metadata=metadata, move_key=move_key)
+                if key is None:
+                    yield REMOVED, old_p, None
+                else:
+                    removed_by_key.add(hash(key) % partitions, (key, old_p))
+
+            del old_files
+
+        removed_by_key.close()
+        added_by_key.close()
+
+        for index in range(partitions):
+
+            removed_p = dict()
+            for key, old_p in removed_by_key.read(index):
+                removed_p.setdefault(key, list()).append(old_p)
+
+            added_p = dict()
+            for key, new_p in added_by_key.read(index):
+                added_p.setdefault(key, list()).append(new_p)
+
+            yield from _resolve_candidates(removed_by_key=removed_p, added_by_key=added_p)
@@ -1,11 +1,344 @@
 #! /usr/bin/env python3
 
+import asyncio
+from collections import deque
+from concurrent.futures import as_completed
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from dataclasses import asdict
+from dataclasses import fields
+from dataclasses import replace
+import gc
+import heapq
 import os.path
-import re
+import pickle
 import stat
+import struct
+import threading
+import time
 
 from bvzcomparefiles import comparefiles
 
+from bvzscanfilesystem.compactstore import CompactFileStore
+from bvzscanfilesystem.filehasher import hash_file
+from bvzscanfilesystem.filehasher import HashCache
+from bvzscanfilesystem.filehasher import HashReport
+from bvzscanfilesystem import inotify
+from bvzscanfilesystem.instrumentation import ScanStats
+from bvzscanfilesystem.options import Options
+from bvzscanfilesystem.regexmatcher import RegexMatcher
+from bvzscanfilesystem.savedscan import iter_files
+from bvzscanfilesystem.savedscan import read_header
+from bvzscanfilesystem.savedscan import write_scan
+from bvzscanfilesystem.scanindex import ScanDelta
+from bvzscanfilesystem.scanindex import ScanIndex
+
+# The names of the sets that hold files which could not be scanned. A file whose examination ends with one of these
+# reasons is recorded as an error instead of as a skipped file.
+_FILE_ERROR_SETS = ("file_not_found_err_files", "file_permission_err_files")
+
+# Every counter and every error set that makes up the results of a scan (alongside the files dictionary itself).
+_COUNTER_ATTRS = ("initial_count",
+                  "checked_count",
+                  "skipped_links",
+                  "error_count",
+                  "skipped_zero_len",
+                  "skipped_hidden_files",
+                  "skipped_hidden_dirs",
+                  "skipped_exclude_dirs",
+                  "skipped_include_dirs",
+                  "skipped_exclude_files",
+                  "skipped_include_files",
+                  "skipped_repeated_dirs",
+                  "skipped_other_fs_dirs",
+                  "skipped_hardlinks")
+
+_ERROR_SET_ATTRS = ("file_permission_err_files",
+                    "dir_permission_err_dirs",
+                    "file_not_found_err_files",
+                    "dir_not_found_err_dirs",
+                    "dir_generic_err_dirs",
+                    "file_generic_err_files")
+
+_DIR_ERROR_SET_ATTRS = ("dir_permission_err_dirs",
+                        "dir_not_found_err_dirs",
+                        "dir_generic_err_dirs")
+
+# The kinds of tuples yielded by ScanFiles._examine_directory.
+_FILE = "file"
+_DIR = "dir"
+_ERROR = "error"
+
+_WALK_ORDERS = ("depth", "breadth", "inode")
+
+# The secondary indexes kept when the build_indexes option is on, and the attribute each one is stored in.
+_INDEX_ATTRS = {"size": "size_index",
+                "extension": "extension_index",
+                "inode": "inode_index"}
+
+# Stands in for a directory filter decision that has not been made yet.
+_UNCHECKED = object()
+
+# The largest number of directory filter decisions remembered for loose files (see ScanFiles._dir_filter_reason).
+_MAX_CACHED_DIR_REASONS = 65536
+
+# When scanning with multiple processes, the top of the tree is split up in the parent process until there are at least
+# this many directories (shards) per worker process, or until this many levels have been split.
+_SHARDS_PER_PROCESS = 4
+_MAX_SHARD_LEVELS = 3
+
+# A resumable scan spends at most about this fraction of its time writing checkpoints (see
+# ScanFiles.scan_directories_resumable).
+_CHECKPOINT_BUDGET = 0.05
+
+# The inotify events watched for on every directory in watch mode. Writes are picked up when the file is closed, so a
+# file that is held open and written to in place is only updated once it is closed.
+_WATCH_MASK = (inotify.IN_ATTRIB | inotify.IN_CLOSE_WRITE | inotify.IN_CREATE | inotify.IN_DELETE |
+               inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR | inotify.IN_DONT_FOLLOW |
+               inotify.IN_EXCL_UNLINK)
+
+# When scanning loose files in batches, a directory holding at least _DENSE_GROUP_FILES of the files, and for which the
+# files make up at least 1/_DENSE_GROUP_SHARE of its entries, is listed once instead of checking each file on its own
+# (listing costs far less per entry than a stat, but a huge directory is not worth listing for a handful of files). The
+# number of entries is estimated from the size of the directory, at about _DIRENT_BYTES per entry, which costs one extra
+# stat per directory. The estimate only holds where the size of a directory grows with its entries (ext4, btrfs, tmpfs,
+# and NFS exports of those). It means nothing on filesystems that report a fixed size for every directory (Lustre, and
+# many NFS servers and FUSE filesystems report 4096 or 0): there, every directory looks small, so any directory holding
+# at least _DENSE_GROUP_FILES of the files is listed, however large it is. The rest of the files are checked in jobs of
+# _LOOSE_FILES_PER_JOB files each.
+_DENSE_GROUP_FILES = 8
+_DENSE_GROUP_SHARE = 8
+_DIRENT_BYTES = 32
+_LOOSE_FILES_PER_JOB = 256
+
+
+class _Frontier(object):
+    """
+    The directories that are still waiting to be scanned, handed out in one of the walk orders:
+
+    - "depth": depth first, in the order os.scandir lists them (the same order as a recursive walk),
+    - "breadth": breadth first, one whole level of the tree before the next,
+    - "inode": lowest inode number first, which on most local filesystems roughly follows the layout on disk and cuts
+      down on seeking.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 order):
+        """
+        :param order:
+            One of "depth", "breadth", or "inode".
+        """
+
+        assert order in _WALK_ORDERS
+
+        self.order = order
+        self._items = list() if order == "inode" else deque()
+        self._sequence = 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self._items)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def push_children(self,
+                      children):
+        """
+        Adds the subdirectories of a directory that has just been scanned.
+
+        :param children:
+            A list of (directory, root path, depth, inode) tuples, in the order they were listed.
+
+        :return:
+            Nothing.
+        """
+
+        if self.order == "depth":
+            self._items.extend((dir_p, root_p, depth) for dir_p, root_p, depth, _ in reversed(children))
+        elif self.order == "breadth":
+            self._items.extend((dir_p, root_p, depth) for dir_p, root_p, depth, _ in children)
+        else:
+            for dir_p, root_p, depth, inode in children:
+                heapq.heappush(self._items, (inode, self._sequence, dir_p, root_p, depth))
+                self._sequence += 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def to_list(self):
+        """
+        :return:
+            The directories still waiting to be scanned, as a list of tuples (for saving in a checkpoint, see
+            from_list).
+        """
+
+        return list(self._items)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def from_list(cls,
+                  order,
+                  items):
+        """
+        :param order:
+            The walk order the list was taken in.
+        :param items:
+            A list returned by to_list.
+
+        :return:
+            A new _Frontier holding the same directories.
+        """
+
+        frontier = cls(order=order)
+        if order == "inode":
+            frontier._items = [tuple(item) for item in items]
+            heapq.heapify(frontier._items)
+            frontier._sequence = max((item[1] for item in frontier._items), default=-1) + 1
+        else:
+            frontier._items.extend(tuple(item) for item in items)
+
+        return frontier
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def pop(self):
+        """
+        :return:
+            The next directory to scan as a (directory, root path, depth) tuple.
+        """
+
+        if self.order == "depth":
+            return self._items.pop()
+        if self.order == "breadth":
+            return self._items.popleft()
+        return heapq.heappop(self._items)[2:]
+
+
+class _PathEntry(object):
+    """
+    Stands in for an os.DirEntry for a single path that has already been lstat'ed, so that a file can be examined
+    exactly as if it had come from a directory listing (see ScanFiles.watch).
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 path,
+                 stat_result):
+        """
+        :param path:
+            The full path to the entry.
+        :param stat_result:
+            The result of os.lstat for the path.
+        """
+
+        self.path = path
+        self.name = os.path.split(path)[1]
+        self._stat_result = stat_result
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def is_dir(self, *, follow_symlinks=True):
+        if follow_symlinks and self.is_symlink():
+            return os.path.isdir(self.path)
+        return stat.S_ISDIR(self._stat_result.st_mode)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def is_file(self, *, follow_symlinks=True):
+        if follow_symlinks and self.is_symlink():
+            return os.path.isfile(self.path)
+        return stat.S_ISREG(self._stat_result.st_mode)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def is_symlink(self):
+        return stat.S_ISLNK(self._stat_result.st_mode)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def stat(self, *, follow_symlinks=True):
+        if follow_symlinks and self.is_symlink():
+            return os.stat(self.path)
+        return self._stat_result
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def inode(self):
+        return self._stat_result.st_ino
+
+
+class _WatchedDir(object):
+    """
+    What watch mode knows about a directory that has been scanned: where it sits in the scan, its inotify watch, and
+    the outcome of examining every entry in it (so that the counters can be wound back when an entry changes).
+    """
+
+    __slots__ = ("root_p", "depth", "wd", "mtime_ns", "dir_key", "entries")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 root_p,
+                 depth,
+                 wd,
+                 mtime_ns,
+                 dir_key,
+                 entries):
+        """
+        :param root_p:
+            The path to the root directory the directory was scanned under.
+        :param depth:
+            How many levels below the root the directory is.
+        :param wd:
+            The inotify watch descriptor. None if the directory could not be watched (it is polled instead).
+        :param mtime_ns:
+            The mtime of the directory, taken before it was listed.
+        :param dir_key:
+            The (st_dev, st_ino) of the directory.
+        :param entries:
+            The outcome of examining every entry in the directory: {name: (_FILE or _DIR, the reason it was skipped or
+            None)}. Kept up to date as the entries change.
+        """
+
+        self.root_p = root_p
+        self.depth = depth
+        self.wd = wd
+        self.mtime_ns = mtime_ns
+        self.dir_key = dir_key
+        self.entries = entries
+
+
+def _scan_shard(scan_options,
+                visited_dirs,
+                scan_dir,
+                root_p,
+                depth):
+    """
+    Scans a single directory (and everything under it) in a worker process.
+
+    :param scan_options:
+        The options object of the ScanFiles object that started the scan.
+    :param visited_dirs:
+        The (st_dev, st_ino) of every directory the parent process has already visited (the roots of the scan and the
+        directories it listed while splitting up the tree), so that the worker skips them just as a serial scan would.
+    :param scan_dir:
+        A full path to the directory to scan.
+    :param root_p:
+        The path to the root directory (for comparing relative paths)
+    :param depth:
+        How many levels below the root of the scan this directory is.
+
+    :return:
+        A tuple containing the results of scanning the directory (as returned by ScanFiles._get_record) and the
+        ScanStats gathered while scanning it (None unless the instrument option is on).
+    """
+
+    shard_options = replace(scan_options, scan_processes=1, compact_storage=False)
+    shard = ScanFiles(scan_options=shard_options)
+    shard._visited_dirs.update(visited_dirs)
+
+    for _ in shard._scan_directory(scan_dir=scan_dir,
+                                   root_p=root_p,
+                                   uid=shard_options.uid,
+                                   gid=shard_options.gid,
+                                   depth=depth):
+        pass
+
+    return shard._get_record(), shard.stats
+
 
 class ScanFiles(object):
     """
@@ -15,15 +348,28 @@ class ScanFiles(object):
 
     # ------------------------------------------------------------------------------------------------------------------
     def __init__(self,
-                 scan_options):
+                 scan_options,
+                 stats_callback=None):
         """
         :param scan_options:
             An options object containing the preferences for the scan parameters.
+        :param stats_callback:
+            An optional function that is called every time a scan reports its progress, with the running count of
+            checked files and self.stats (a ScanStats object if the instrument option is on, None otherwise).
         """
 
         self.options = scan_options
+        self.stats_callback = stats_callback
+
+        if self.options.instrument:
+            self.stats = ScanStats()
+        else:
+            self.stats = None
 
-        self.files = dict()
+        if self.options.compact_storage:
+            self.files = CompactFileStore()
+        else:
+            self.files = dict()
 
         self.file_permission_err_files = set()
         self.dir_permission_err_dirs = set()
@@ -43,9 +389,60 @@ class ScanFiles(object):
         self.skipped_include_dirs = 0
         self.skipped_exclude_files = 0
         self.skipped_include_files = 0
+        self.skipped_repeated_dirs = 0
+        self.skipped_other_fs_dirs = 0
+        self.skipped_hardlinks = 0
 
         self.scanned_files = set()
 
+        # The (st_dev, st_ino) of every directory that has been scanned, so that a directory reached a second time
+        # (through a bind mount, or because it sits under more than one of the roots) is not scanned again.
+        self._visited_dirs = set()
+
+        # {root path: st_dev of the root}, for the same_filesystem option.
+        self._root_devices = dict()
+
+        # {(st_dev, st_ino): path} of every file kept so far, for the collapse_hardlinks option.
+        self._file_inodes = dict()
+
+        # Secondary indexes of the files dictionary, kept up to date as files are added (see _append_to_scan). Each
+        # maps a key to the set of paths sharing it: size -> paths, lower case extension -> paths, and
+        # (st_dev, st_ino) -> paths. None unless the build_indexes option is on.
+        if self.options.build_indexes:
+            self.size_index = dict()
+            self.extension_index = dict()
+            self.inode_index = dict()
+        else:
+            self.size_index = None
+            self.extension_index = None
+            self.inode_index = None
+
+        self.delta = None
+        self.hash_report = None
+
+        self._stream_buffer = None
+        self._retain_files = True
+
+        # Set by cancel() to ask the running scan to stop.
+        self._cancel = threading.Event()
+
+        # Only used in watch mode (see watch). {dir path: _WatchedDir}, {watch descriptor: dir path},
+        # {dir path: (watch descriptor, mtime, (st_dev, st_ino))} for directories being listed, and the set of
+        # directories that could not be watched (which are polled instead).
+        self._inotify = None
+        self._watched = None
+        self._watch_wds = None
+        self._watch_pending = None
+        self._watch_polled = None
+
+        self._incl_dir_matcher = None
+        self._excl_dir_matcher = None
+        self._incl_file_matcher = None
+        self._excl_file_matcher = None
+        self._dir_reasons = dict()
+        self._lazy_metadata = False
+        self._compile_filters()
+
     # ------------------------------------------------------------------------------------------------------------------
     @staticmethod
     def _get_filesystem_root():
@@ -77,7 +474,23 @@ class ScanFiles(object):
 
         assert type(file_p) is str
 
-        return os.path.split(file_p)[1][0] == "."
+        return ScanFiles._is_hidden_name(file_n=os.path.split(file_p)[1])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _is_hidden_name(file_n):
+        """
+        The same as _is_hidden, but for a file name rather than a path (for when the name is already known and there is
+        no need to split the path again).
+
+        :param file_n:
+            The name of the file.
+
+        :return:
+            True if the file is hidden. False otherwise.
+        """
+
+        return file_n[0] == "."
 
     # ------------------------------------------------------------------------------------------------------------------
     @staticmethod
@@ -119,6 +532,96 @@ class ScanFiles(object):
 
         return bool(stat.S_IROTH & st_mode)
 
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _metadata_from_stat(file_p,
+                            root_p,
+                            stat_result):
+        """
+        Builds the metadata for a file from a stat result that has already been gathered (usually the one cached on the
+        os.DirEntry returned by os.scandir). This holds the same attributes that comparefiles.get_metadata collects,
+        plus the device and inode numbers, without touching the filesystem again.
+
+        :param file_p:
+            The full path to the file.
+        :param root_p:
+            The root path against which a relative path for the file can be extracted.
+        :param stat_result:
+            The os.stat_result for the file (NOT following symlinks).
+
+        :return:
+            A dictionary of metadata.
+        """
+
+        file_d, file_n = os.path.split(file_p)
+
+        return {"file_n": file_n,
+                "file_d": file_d,
+                "rel_p": os.path.relpath(file_p, root_p),
+                "size": stat_result.st_size,
+                "ctime": stat_result.st_ctime,
+                "mtime": stat_result.st_mtime,
+                "islink": stat.S_ISLNK(stat_result.st_mode),
+                "st_mode": stat_result.st_mode,
+                "file_uid": stat_result.st_uid,
+                "file_gid": stat_result.st_gid,
+                "st_dev": stat_result.st_dev,
+                "st_ino": stat_result.st_ino}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _lazy_metadata_for(file_p,
+                           root_p):
+        """
+        Builds the metadata stored for a file in lazy mode (the lazy_metadata option): only what can be worked out from
+        its path. The rest is fetched by file_metadata the first time it is asked for.
+
+        :param file_p:
+            The full path to the file.
+        :param root_p:
+            The root path against which a relative path for the file can be extracted.
+
+        :return:
+            A dictionary holding the file_n, file_d, and rel_p attributes.
+        """
+
+        file_d, file_n = os.path.split(file_p)
+
+        return {"file_n": file_n,
+                "file_d": file_d,
+                "rel_p": os.path.relpath(file_p, root_p)}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def file_metadata(self,
+                      file_p):
+        """
+        Returns the full metadata of a file in the scan. A file stored in lazy mode (see the lazy_metadata option) only
+        holds its name, directory, and relative path. The first time its metadata is asked for here, it is stat'ed and
+        the full metadata is stored in the scan in place of the partial one.
+
+        :param file_p:
+            The full path to a file in the scan.
+
+        :return:
+            The metadata dictionary. Raises KeyError if the file is not in the scan, and OSError if it has to be
+            stat'ed but no longer can be.
+        """
+
+        metadata = self.files[file_p]
+        if "size" in metadata:
+            return metadata
+
+        full_metadata = self._metadata_from_stat(file_p=file_p,
+                                                 root_p=metadata["file_d"],
+                                                 stat_result=os.lstat(file_p))
+        # Keep the relative path worked out against the root of the scan.
+        full_metadata.update(metadata)
+
+        self._append_to_scan(file_path=file_p,
+                             metadata=full_metadata)
+
+        return full_metadata
+
     # ------------------------------------------------------------------------------------------------------------------
     def _append_to_scan(self,
                         file_path,
@@ -135,247 +638,2888 @@ class ScanFiles(object):
             Nothing.
         """
 
+        if self.size_index is not None:
+            previous = self.files.get(file_path)
+            if previous is not None:
+                self._unindex_file(file_path=file_path, metadata=previous)
+            self._index_file(file_path=file_path, metadata=metadata)
+
         self.files[file_path] = metadata
 
     # ------------------------------------------------------------------------------------------------------------------
-    @staticmethod
-    def _match_any_regex(regexes,
-                         item):
+    def _remove_from_scan(self,
+                          file_path):
         """
-        Given a list of regex expressions and an item, returns True if the item matches ALL the regex expressions.
+        Removes a file from the scan dictionary (the reverse of _append_to_scan).
 
-        :param regexes:
-            A list of regex expressions to check against.
-        :param item:
-            A string to run the regex against.
+        :param file_path:
+            The path to the file to remove.
 
         :return:
-            True if any item matches any regex. False otherwise.
+            The metadata the file was stored with. None if it was not in the scan.
         """
 
-        assert type(regexes) in [list, set, tuple]
-        for regex in regexes:
-            assert type(regex) is str
+        metadata = self.files.pop(file_path, None)
+        if metadata is None:
+            return None
+
+        if self.size_index is not None:
+            self._unindex_file(file_path=file_path, metadata=metadata)
+
+        if self.options.collapse_hardlinks:
+            file_key = (metadata["st_dev"], metadata["st_ino"])
+            if self._file_inodes.get(file_key) == file_path:
+                del self._file_inodes[file_key]
 
-        for regex in regexes:
-            if re.search(str(regex), item) is not None:
-                return True
-        return False
+        return metadata
 
     # ------------------------------------------------------------------------------------------------------------------
-    def scan_directories(self,
-                         scan_dirs):
+    @staticmethod
+    def _index_keys(metadata):
         """
-        Scan a list of directories and store the metadata for every file (optionally include subdirectories).
+        Returns the key a file is stored under in each of the secondary indexes.
 
-        :param scan_dirs:
-            A list containing full paths to directories to scan.
+        :param metadata:
+            The metadata for the file.
 
         :return:
-            Nothing.
+            A tuple containing the size key, the extension key, and the inode key.
         """
 
-        assert type(scan_dirs) in [list, set, tuple]
-
-        for scan_dir in scan_dirs:
-            for _ in self._scan_directory(scan_dir=scan_dir,
-                                          root_p=scan_dir,
-                                          uid=self.options.uid,
-                                          gid=self.options.gid):
-                yield self.checked_count
+        return (metadata["size"],
+                os.path.splitext(metadata["file_n"])[1].lower(),
+                (metadata["st_dev"], metadata["st_ino"]))
 
     # ------------------------------------------------------------------------------------------------------------------
-    def _scan_directory(self,
-                        scan_dir,
-                        root_p,
-                        uid,
-                        gid):
+    def _index_file(self,
+                    file_path,
+                    metadata):
         """
-        Recursively scan an entire directory and its subdirectories and store the metadata for every file.
+        Adds a file to the secondary indexes.
 
-        :param scan_dir:
-            A full path to the directory to scan.
-        :param root_p:
-            The path to the root directory (for comparing relative paths)
-        :param uid:
-            The user id of the user running the script
-        :param gid:
-            The group id of the user running the script
+        :param file_path:
+            The path to the file.
+        :param metadata:
+            The metadata for this file.
 
         :return:
             Nothing.
         """
 
-        assert type(scan_dir) is str
-        assert type(root_p) is str
-        assert type(uid) is int
-        assert type(gid) is int
-        #
-        # if not scan_dir:
-        #     raise IOError("No directory has been set to scan.")
-        #
-        # if not os.path.exists(scan_dir):
-        #     raise IOError(f"The directory {scan_dir} does not exist")
-        #
-        # if not os.path.isdir(scan_dir):
-        #     raise IOError(f"The path {scan_dir} is not a directory")
+        size_key, extension_key, inode_key = self._index_keys(metadata)
 
-        try:
+        self.size_index.setdefault(size_key, set()).add(file_path)
+        self.extension_index.setdefault(extension_key, set()).add(file_path)
+        self.inode_index.setdefault(inode_key, set()).add(file_path)
 
-            for entry in os.scandir(scan_dir):
+    # ------------------------------------------------------------------------------------------------------------------
+    def _unindex_file(self,
+                      file_path,
+                      metadata):
+        """
+        Removes a file from the secondary indexes (when it is about to be replaced by newer metadata).
 
-                if entry.is_dir(follow_symlinks=False) and not self.options.skip_sub_dir:
+        :param file_path:
+            The path to the file.
+        :param metadata:
+            The metadata the file was indexed with.
 
-                    if self.options.skip_hidden_dirs and entry.name[0] == ".":
-                        self.skipped_hidden_dirs += 1
-                        yield self.checked_count
-                        continue
+        :return:
+            Nothing.
+        """
 
-                    if self.options.incl_dir_regexes:
-                        if not self._match_any_regex(regexes=self.options.incl_dir_regexes, item=entry.path):
-                            self.skipped_include_dirs += 1
-                            yield self.checked_count
-                            continue
+        for index, key in zip((self.size_index, self.extension_index, self.inode_index), self._index_keys(metadata)):
+            paths = index.get(key)
+            if paths is not None:
+                paths.discard(file_path)
+                if not paths:
+                    del index[key]
 
-                    if self.options.excl_dir_regexes is not None:
-                        if self._match_any_regex(regexes=self.options.excl_dir_regexes, item=entry.path):
-                            self.skipped_exclude_dirs += 1
-                            yield self.checked_count
-                            continue
+    # ------------------------------------------------------------------------------------------------------------------
+    def candidate_groups(self,
+                         index="size"):
+        """
+        Returns the groups of files that share a key in one of the secondary indexes, leaving out any key held by a
+        single file. Grouping by size gives the candidates for duplicate detection without another pass over the files.
+        Grouping by inode gives the files that are hard links to each other. Requires the build_indexes option.
 
-                    yield from self._scan_directory(scan_dir=entry.path, root_p=root_p, uid=uid, gid=gid)
-                    continue
+        :param index:
+            Which index to group by: "size", "extension", or "inode".
 
-                self._scan_file(file_p=entry.path, root_p=root_p, uid=uid, gid=gid)
-                if self.checked_count % self.options.report_frequency == 0:
-                    yield self.checked_count
+        :return:
+            A dictionary of {key: set of paths} for every key shared by more than one file.
+        """
 
-        except PermissionError:
+        assert index in _INDEX_ATTRS
 
-            self.error_count += 1
-            self.dir_permission_err_dirs.add(scan_dir)
+        groups = getattr(self, _INDEX_ATTRS[index])
+        assert groups is not None
 
-        except FileNotFoundError:
+        return {key: paths for key, paths in groups.items() if len(paths) > 1}
 
-            self.error_count += 1
-            self.dir_not_found_err_dirs.add(scan_dir)
+    # ------------------------------------------------------------------------------------------------------------------
+    def _get_record(self):
+        """
+        Returns the results of this scan (the files, every counter, and every error set) as a dictionary of plain
+        python types.
 
-        except OSError:
+        :return:
+            A dictionary with "counters", "errors", and "files" keys.
+        """
 
-            self.error_count += 1
-            self.dir_generic_err_dirs.add(scan_dir)
+        return {"counters": {attr: getattr(self, attr) for attr in _COUNTER_ATTRS},
+                "errors": {attr: set(getattr(self, attr)) for attr in _ERROR_SET_ATTRS},
+                "files": dict(self.files)}
 
     # ------------------------------------------------------------------------------------------------------------------
-    def scan_files(self,
-                   files_p,
-                   root_p):
+    def _merge_record(self,
+                      record):
         """
-        Scan a specific list of files and store the metadata for every file.
+        Adds the results of another scan (as returned by _get_record) to the results of this scan.
 
-        :param files_p:
-            A list, set, or tuple of files (with full paths).
-        :param root_p:
-            The root path against which a relative path for the files can be extracted.
+        :param record:
+            A dictionary with "counters", "errors", and "files" keys.
 
         :return:
             Nothing.
         """
 
-        assert type(files_p) in [list, set, tuple]
-        assert type(root_p) is str
-
-        for file_p in files_p:
+        for attr, value in record["counters"].items():
+            setattr(self, attr, getattr(self, attr) + value)
 
-            if os.path.islink(file_p):
-                self.skipped_links += 1
-                return
+        for attr, paths in record["errors"].items():
+            getattr(self, attr).update(paths)
 
-            self._scan_file(file_p=file_p, root_p=root_p, uid=self.options.uid, gid=self.options.gid)
-            if self.checked_count % self.options.report_frequency == 0:
-                yield self.checked_count
+        for file_p, metadata in record["files"].items():
+            if self.options.collapse_hardlinks and self._is_repeated_hardlink(file_p=file_p, metadata=metadata):
+                # The other scan could not know about the links this scan has already kept.
+                self.initial_count -= 1
+                self.skipped_hardlinks += 1
+                continue
+            if self._stream_buffer is not None:
+                self._stream_buffer.append((file_p, metadata))
+            if self._retain_files:
+                self._append_to_scan(file_path=file_p,
+                                     metadata=metadata)
 
     # ------------------------------------------------------------------------------------------------------------------
-    def _scan_file(self,
-                   file_p,
-                   root_p,
-                   uid,
-                   gid):
+    @staticmethod
+    def _match_any_regex(regexes,
+                         item):
         """
-        Scan a single file and stores its metadata.
+        Given a list of regex expressions and an item, returns True if the item matches ANY of the regex expressions.
+        The scans themselves use the matchers built by _compile_filters instead, since those only compile the regexes
+        once.
 
-        :param file_p:
-            A full path toa file to scan.
-        :param root_p:
-            The root path against which a relative path for the files can be extracted.
-        :param uid:
-            The user id of the user running the script
-        :param gid:
-            The group id of the user running the script
+        :param regexes:
+            A list of regex expressions to check against.
+        :param item:
+            A string to run the regex against.
 
         :return:
-            Nothing.
+            True if any item matches any regex. False otherwise.
         """
 
-        assert type(file_p) is str
-        assert type(root_p) is str
-        assert type(uid) is int
-        assert type(gid) is int
-
-        self.checked_count += 1
+        return RegexMatcher(regexes=regexes).search(item)
 
-        file_d, file_n = os.path.split(file_p)
+    # ------------------------------------------------------------------------------------------------------------------
+    def _compile_filters(self):
+        """
+        Builds the regex matchers for the include and exclude filters in the options, and works out whether files can
+        be stored without being stat'ed (see _lazy_metadata_for). This is done once at the start of every scan (in case
+        the options were changed between scans) rather than once per file or directory.
 
-        if self.options.skip_hidden_files:
-            if self._is_hidden(file_p=file_p):
-                self.skipped_hidden_files += 1
-                return
+        :return:
+            Nothing.
+        """
 
+        self._incl_dir_matcher = None
         if self.options.incl_dir_regexes:
-            if not self._match_any_regex(regexes=self.options.incl_dir_regexes, item=file_d):
-                self.skipped_include_files += 1
-                return
+            self._incl_dir_matcher = RegexMatcher(regexes=self.options.incl_dir_regexes)
 
+        self._excl_dir_matcher = None
         if self.options.excl_dir_regexes is not None:
-            if self._match_any_regex(regexes=self.options.excl_dir_regexes, item=file_d):
-                self.skipped_include_files += 1
-                return
+            self._excl_dir_matcher = RegexMatcher(regexes=self.options.excl_dir_regexes)
 
+        self._incl_file_matcher = None
         if self.options.incl_file_regexes is not None:
-            if not self._match_any_regex(regexes=self.options.incl_file_regexes, item=file_n):
-                self.skipped_include_files += 1
-                return
+            self._incl_file_matcher = RegexMatcher(regexes=self.options.incl_file_regexes)
 
+        self._excl_file_matcher = None
         if self.options.excl_file_regexes is not None:
-            if self._match_any_regex(regexes=self.options.excl_file_regexes, item=file_n):
-                self.skipped_exclude_files += 1
-                return
+            self._excl_file_matcher = RegexMatcher(regexes=self.options.excl_file_regexes)
+
+        self._dir_reasons = dict()
+
+        # The lazy_metadata option only saves the stat call if nothing else needs the stat result before the file can
+        # be kept.
+        self._lazy_metadata = (self.options.lazy_metadata and
+                               not self.options.skip_zero_len and
+                               not self.options.check_read_permissions and
+                               not self.options.build_indexes and
+                               not self.options.collapse_hardlinks)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _increment(self,
+                   counter):
+        """
+        Adds one to the counter attribute with the given name.
+
+        :param counter:
+            The name of the counter attribute (for example: "skipped_hidden_dirs").
+
+        :return:
+            Nothing.
+        """
+
+        setattr(self, counter, getattr(self, counter) + 1)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _record_dir_error(self,
+                          scan_dir,
+                          err):
+        """
+        Records an error that was raised while listing a directory.
+
+        :param scan_dir:
+            The directory that was being listed.
+        :param err:
+            The OSError (or subclass) that was raised.
+
+        :return:
+            Nothing.
+        """
+
+        self.error_count += 1
+
+        if isinstance(err, PermissionError):
+            self.dir_permission_err_dirs.add(scan_dir)
+        elif isinstance(err, FileNotFoundError):
+            self.dir_not_found_err_dirs.add(scan_dir)
+        else:
+            self.dir_generic_err_dirs.add(scan_dir)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _examine_dir(self,
+                     dir_p,
+                     dir_n):
+        """
+        Runs the directory filters against a single subdirectory. Does not modify any of the scan results, so it is safe
+        to call from worker threads.
+
+        :param dir_p:
+            The full path to the directory.
+        :param dir_n:
+            The name of the directory.
+
+        :return:
+            The name of the counter that should be incremented if the directory is to be skipped. None if the directory
+            should be scanned.
+        """
+
+        if self.options.skip_hidden_dirs and dir_n[0] == ".":
+            return "skipped_hidden_dirs"
+
+        if self._incl_dir_matcher is not None:
+            if not self._incl_dir_matcher.search(dir_p):
+                return "skipped_include_dirs"
+
+        if self._excl_dir_matcher is not None:
+            if self._excl_dir_matcher.search(dir_p):
+                return "skipped_exclude_dirs"
+
+        return None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _root_device(self,
+                     root_p):
+        """
+        Returns the device that a root directory lives on (for the same_filesystem option). Only looked up once per
+        root.
+
+        :param root_p:
+            The path to the root directory.
+
+        :return:
+            The st_dev of the root. None if it cannot be stat'ed.
+        """
+
+        if root_p not in self._root_devices:
+            try:
+                self._root_devices[root_p] = os.stat(root_p).st_dev
+            except OSError:
+                self._root_devices[root_p] = None
+
+        return self._root_devices[root_p]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _visit_dir(self,
+                   dir_key):
+        """
+        Records that a directory is about to be scanned.
+
+        :param dir_key:
+            The (st_dev, st_ino) of the directory. If st_dev is None the directory is not tracked.
+
+        :return:
+            True if the directory has not been visited before (and should be scanned). False otherwise.
+        """
+
+        if dir_key[0] is None:
+            return True
+
+        if dir_key in self._visited_dirs:
+            return False
+
+        self._visited_dirs.add(dir_key)
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _unvisited_roots(self,
+                         scan_dirs):
+        """
+        Marks the roots of a scan as visited, leaving out any that have been visited already (the same directory listed
+        twice, or a directory that an earlier scan already reached). A root nested under another root is kept: it is
+        the one left out when the walk of the outer root reaches it.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+
+        :return:
+            The list of roots that should be scanned.
+        """
+
+        roots = list()
+        for scan_dir in scan_dirs:
+            try:
+                dir_stat = os.stat(scan_dir)
+            except OSError:
+                # Left for the listing of the directory itself to fail and record the error.
+                roots.append(scan_dir)
+                continue
+            self._root_devices.setdefault(scan_dir, dir_stat.st_dev)
+            if self._visit_dir((dir_stat.st_dev, dir_stat.st_ino)):
+                roots.append(scan_dir)
+            else:
+                self.skipped_repeated_dirs += 1
+
+        return roots
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _is_repeated_hardlink(self,
+                              file_p,
+                              metadata):
+        """
+        For the collapse_hardlinks option: checks whether a file is another link to a file that has already been kept,
+        and remembers it if it is not.
+
+        :param file_p:
+            The full path to the file.
+        :param metadata:
+            The metadata for the file.
+
+        :return:
+            True if a different path to the same file has already been kept. False otherwise.
+        """
+
+        file_key = (metadata["st_dev"], metadata["st_ino"])
+        kept_p = self._file_inodes.setdefault(file_key, file_p)
+
+        return kept_p != file_p
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _examine_file(self,
+                      file_p,
+                      root_p,
+                      uid,
+                      gid,
+                      entry=None,
+                      dir_reason=_UNCHECKED):
+        """
+        Runs the filters against a single file and gathers its metadata. Does not modify any of the scan results, so it
+        is safe to call from worker threads. Any OSError other than FileNotFoundError is passed on to the caller (where
+        it is treated as an error listing the directory that holds the file).
+
+        The name based filters are run first since they need no I/O at all. If the file came from os.scandir, symlinks
+        are then weeded out using the type information on the DirEntry, and (if the options ask for it) the metadata is
+        built from the DirEntry's stat result so that each file only costs a single lstat call.
+
+        :param file_p:
+            A full path to a file to examine.
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+        :param entry:
+            The os.DirEntry for the file if it came from os.scandir. None otherwise.
+        :param dir_reason:
+            The outcome of running the directory filters against the directory holding the file, if the caller has
+            already worked it out (see _match_dir_filters). Left out, it is looked up in a cache of previous decisions.
+
+        :return:
+            A tuple containing the reason the file was not added to the scan (either the name of the skip counter to
+            increment or the name of the error set to add the file to) and the metadata of the file. The reason is None
+            if the file should be added, and the metadata is None if it should not.
+        """
+
+        assert type(file_p) is str
+        assert type(root_p) is str
+        assert type(uid) is int
+        assert type(gid) is int
+
+        stats = self.stats
+
+        if entry is not None and dir_reason is not _UNCHECKED:
+            file_d, file_n = None, entry.name
+        else:
+            file_d, file_n = os.path.split(file_p)
+
+        if stats is None:
+            reason = self._filter_file(file_d=file_d, file_n=file_n, dir_reason=dir_reason)
+        else:
+            started = time.perf_counter()
+            reason = self._filter_file(file_d=file_d, file_n=file_n, dir_reason=dir_reason)
+            stats.add("filtering", time.perf_counter() - started)
+        if reason is not None:
+            return reason, None
+
+        if entry is not None and entry.is_symlink():
+            return "skipped_links", None
+
+        if entry is not None and self._lazy_metadata:
+            # The listing already showed that this is a file rather than a symlink. Nothing else needs a stat.
+            return None, self._lazy_metadata_for(file_p=file_p, root_p=root_p)
 
         try:
-            attrs = comparefiles.get_metadata(file_p=file_p, root_p=root_p)
+            if stats is None:
+                attrs = self._get_file_metadata(file_p=file_p, root_p=root_p, entry=entry)
+            else:
+                started = time.perf_counter()
+                attrs = self._get_file_metadata(file_p=file_p, root_p=root_p, entry=entry)
+                stats.add("metadata", time.perf_counter() - started)
         except FileNotFoundError:
-            self.error_count += 1
-            self.file_not_found_err_files.add(file_p)
-            return
+            return "file_not_found_err_files", None
 
         if attrs["islink"]:
-            self.skipped_links += 1
-            return
-
-        if not self._has_file_read_permissions(st_mode=attrs["st_mode"],
-                                               file_uid=attrs["file_uid"],
-                                               file_gid=attrs["file_gid"],
-                                               uid=uid,
-                                               gid=gid):
-            self.error_count += 1
-            self.file_permission_err_files.add(file_p)
-            return
+            return "skipped_links", None
+
+        if self.options.check_read_permissions:
+            if stats is not None:
+                started = time.perf_counter()
+            readable = self._has_file_read_permissions(st_mode=attrs["st_mode"],
+                                                       file_uid=attrs["file_uid"],
+                                                       file_gid=attrs["file_gid"],
+                                                       uid=uid,
+                                                       gid=gid)
+            if stats is not None:
+                stats.add("permissions", time.perf_counter() - started)
+            if not readable:
+                return "file_permission_err_files", None
 
         if self.options.skip_zero_len:
             if attrs["size"] == 0:
-                self.skipped_zero_len += 1
+                return "skipped_zero_len", None
+
+        return None, attrs
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _filter_file(self,
+                     file_d,
+                     file_n,
+                     dir_reason):
+        """
+        Runs the name based filters (hidden files and the regexes) against a single file.
+
+        :param file_d:
+            The directory holding the file. Only used if dir_reason is _UNCHECKED.
+        :param file_n:
+            The name of the file.
+        :param dir_reason:
+            The outcome of the directory filters for file_d (see _match_dir_filters), or _UNCHECKED.
+
+        :return:
+            The name of the counter that should be incremented if the file is to be skipped. None if it passes.
+        """
+
+        if self.options.skip_hidden_files:
+            if self._is_hidden_name(file_n=file_n):
+                return "skipped_hidden_files"
+
+        if dir_reason is _UNCHECKED:
+            dir_reason = self._dir_filter_reason(file_d=file_d)
+        if dir_reason is not None:
+            return dir_reason
+
+        if self._incl_file_matcher is not None:
+            if not self._incl_file_matcher.search(file_n):
+                return "skipped_include_files"
+
+        if self._excl_file_matcher is not None:
+            if self._excl_file_matcher.search(file_n):
+                return "skipped_exclude_files"
+
+        return None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _match_dir_filters(self,
+                           file_d):
+        """
+        Runs the directory regexes against the directory that holds one or more files. Every file in the same directory
+        gets the same answer, so this only needs to be done once per directory rather than once per file.
+
+        :param file_d:
+            The directory holding the files (as returned by os.path.split).
+
+        :return:
+            The name of the counter that should be incremented for every file in the directory if they are to be
+            skipped. None if they pass.
+        """
+
+        if self._incl_dir_matcher is not None:
+            if not self._incl_dir_matcher.search(file_d):
+                return "skipped_include_files"
+
+        if self._excl_dir_matcher is not None:
+            if self._excl_dir_matcher.search(file_d):
+                return "skipped_include_files"
+
+        return None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _dir_filter_reason(self,
+                           file_d):
+        """
+        The same as _match_dir_filters, but remembering the answers. Used for loose files (which arrive in no particular
+        order) so that files sharing a directory only run the directory regexes once between them.
+
+        :param file_d:
+            The directory holding the file (as returned by os.path.split).
+
+        :return:
+            The name of the counter that should be incremented if the files in the directory are to be skipped. None if
+            they pass.
+        """
+
+        if self._incl_dir_matcher is None and self._excl_dir_matcher is None:
+            return None
+
+        reason = self._dir_reasons.get(file_d, _UNCHECKED)
+        if reason is _UNCHECKED:
+            if len(self._dir_reasons) >= _MAX_CACHED_DIR_REASONS:
+                self._dir_reasons = dict()
+            reason = self._match_dir_filters(file_d=file_d)
+            self._dir_reasons[file_d] = reason
+
+        return reason
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _get_file_metadata(self,
+                           file_p,
+                           root_p,
+                           entry):
+        """
+        Gathers the metadata of a single file.
+
+        :param file_p:
+            A full path to a file.
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+        :param entry:
+            The os.DirEntry for the file if it came from os.scandir. None otherwise.
+
+        :return:
+            A dictionary of metadata.
+        """
+
+        needs_inode = self.options.build_indexes or self.options.collapse_hardlinks
+
+        if entry is not None and (self.options.direntry_metadata or self.options.lazy_metadata or needs_inode):
+            return self._metadata_from_stat(file_p=file_p,
+                                            root_p=root_p,
+                                            stat_result=entry.stat(follow_symlinks=False))
+
+        # The inode index and collapsing hardlinks need the device and inode numbers, which comparefiles does not
+        # collect. In lazy mode, a single lstat is the least that can be done for a file that was not listed.
+        if needs_inode or self.options.lazy_metadata:
+            return self._metadata_from_stat(file_p=file_p,
+                                            root_p=root_p,
+                                            stat_result=os.lstat(file_p))
+
+        return comparefiles.get_metadata(file_p=file_p, root_p=root_p)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _apply_file_result(self,
+                           file_p,
+                           reason,
+                           attrs):
+        """
+        Updates the counters and the scan results with the outcome of examining a single file.
+
+        :param file_p:
+            The full path to the file that was examined.
+        :param reason:
+            The reason returned by _examine_file. None if the file should be added to the scan.
+        :param attrs:
+            The metadata returned by _examine_file.
+
+        :return:
+            The reason the file was not added to the scan. None if it was added.
+        """
+
+        self.checked_count += 1
+
+        if reason is None and self.options.collapse_hardlinks:
+            if self._is_repeated_hardlink(file_p=file_p, metadata=attrs):
+                reason = "skipped_hardlinks"
+
+        if reason is None:
+            self.initial_count += 1
+            if self._stream_buffer is not None:
+                self._stream_buffer.append((file_p, attrs))
+            if self._retain_files:
+                self._append_to_scan(file_path=file_p,
+                                     metadata=attrs)
+        elif reason in _FILE_ERROR_SETS:
+            self.error_count += 1
+            getattr(self, reason).add(file_p)
+        else:
+            self._increment(reason)
+
+        return reason
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def scan_directories(self,
+                         scan_dirs):
+        """
+        Scan a list of directories and store the metadata for every file (optionally include subdirectories). If the
+        options ask for more than one scan process, the tree is split up and scanned by a pool of worker processes.
+        Otherwise, if they ask for more than one scan thread, the directories are listed and their files examined on a
+        pool of worker threads. The results are the same either way, only the order in which files are scanned differs.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+
+        :return:
+            Nothing.
+        """
+
+        assert type(scan_dirs) in [list, set, tuple]
+
+        self._compile_filters()
+        self._cancel.clear()
+
+        scan_dirs = self._unvisited_roots(scan_dirs)
+
+        if self.options.scan_processes > 1:
+            progress = self._scan_directories_multiprocess(scan_dirs=scan_dirs)
+        elif self.options.scan_threads > 1:
+            progress = self._scan_directories_threaded(scan_dirs=scan_dirs)
+        else:
+            progress = self._scan_directories_serial(scan_dirs=scan_dirs)
+
+        for checked_count in progress:
+            if self.stats_callback is not None:
+                self.stats_callback(checked_count, self.stats)
+            yield checked_count
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def cancel(self):
+        """
+        Asks the scan that is running to stop. Safe to call from another thread or from the stats callback. The scan
+        stops at the next point where its results are consistent: every directory (or, for scan_files, every file) is
+        either fully recorded or not recorded at all. The scan then returns normally. A resumable scan also writes a
+        final checkpoint, so that it can carry on from there later.
+
+        :return:
+            Nothing.
+        """
+
+        self._cancel.set()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _scan_directories_serial(self,
+                                 scan_dirs):
+        """
+        Scan a list of directories one after the other, in this thread.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+
+        :return:
+            Nothing.
+        """
+
+        for scan_dir in scan_dirs:
+            if self._cancel.is_set():
                 return
+            for _ in self._scan_directory(scan_dir=scan_dir,
+                                          root_p=scan_dir,
+                                          uid=self.options.uid,
+                                          gid=self.options.gid):
+                yield self.checked_count
 
-        self.initial_count += 1
+    # ------------------------------------------------------------------------------------------------------------------
+    def _scan_directory(self,
+                        scan_dir,
+                        root_p,
+                        uid,
+                        gid,
+                        depth=0):
+        """
+        Scan an entire directory and its subdirectories and store the metadata for every file. The walk is iterative:
+        directories waiting to be scanned are kept in a _Frontier (in the walk order set in the options) rather than in
+        a chain of nested generators, so deep trees cost no more per yield than shallow ones and cannot run into the
+        recursion limit.
 
-        self._append_to_scan(file_path=file_p,
-                             metadata=attrs)
+        :param scan_dir:
+            A full path to the directory to scan.
+        :param root_p:
+            The path to the root directory (for comparing relative paths)
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+        :param depth:
+            How many levels below the root of the scan this directory is (compared against the max_depth option).
+
+        :return:
+            Nothing.
+        """
+
+        assert type(scan_dir) is str
+        assert type(root_p) is str
+        assert type(uid) is int
+        assert type(gid) is int
+        assert type(depth) is int
+
+        frontier = _Frontier(order=self.options.walk_order)
+        frontier.push_children([(scan_dir, root_p, depth, 0)])
+
+        while frontier and not self._cancel.is_set():
+            dir_p, dir_root_p, dir_depth = frontier.pop()
+            yield from self._apply_examined(scan_dir=dir_p,
+                                            root_p=dir_root_p,
+                                            depth=dir_depth,
+                                            examined=self._examine_directory(dir_p, dir_root_p, dir_depth, uid, gid),
+                                            frontier=frontier)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _scan_directories_threaded(self,
+                                   scan_dirs):
+        """
+        Scan a list of directories using a pool of worker threads. Each worker lists one directory and examines every
+        file in it (which is where the blocking stat calls happen). The results are handed back to this thread which is
+        the only one that modifies the counters and the scan results. The number of directories waiting on the pool is
+        kept bounded so that very wide trees do not queue up an unbounded number of jobs.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+
+        :return:
+            Nothing.
+        """
+
+        uid = self.options.uid
+        gid = self.options.gid
+        max_in_flight = self.options.scan_threads * 2
+
+        frontier = _Frontier(order=self.options.walk_order)
+        frontier.push_children([(scan_dir, scan_dir, 0, 0) for scan_dir in scan_dirs])
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=self.options.scan_threads) as executor:
+
+            while frontier or in_flight:
+
+                if self._cancel.is_set():
+                    # Let the directories already being listed finish, so that each one is either fully recorded or
+                    # not at all.
+                    frontier = _Frontier(order=self.options.walk_order)
+
+                while frontier and len(in_flight) < max_in_flight:
+                    in_flight.add(executor.submit(self._list_directory, *frontier.pop(), uid, gid))
+
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    yield from self._apply_listing(listing=future.result(), frontier=frontier)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _scan_directories_multiprocess(self,
+                                       scan_dirs):
+        """
+        Scan a list of directories using a pool of worker processes, so that the python work done for every file is
+        not limited to a single core. The top levels of the tree are listed in this process until there are enough
+        subdirectories to hand out several to each worker (which keeps the workers busy even when the subdirectories
+        are very different sizes). Each worker scans its subdirectories serially and sends back its results, which are
+        merged into this object.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+
+        :return:
+            Nothing.
+        """
+
+        uid = self.options.uid
+        gid = self.options.gid
+
+        shards = [(scan_dir, scan_dir, 0) for scan_dir in scan_dirs]
+        target = self.options.scan_processes * _SHARDS_PER_PROCESS
+
+        levels = 0
+        while shards and len(shards) < target and levels < _MAX_SHARD_LEVELS and not self._cancel.is_set():
+            frontier = _Frontier(order="breadth")
+            for scan_dir, root_p, depth in shards:
+                yield from self._apply_listing(listing=self._list_directory(scan_dir, root_p, depth, uid, gid),
+                                               frontier=frontier)
+            shards = [frontier.pop() for _ in range(len(frontier))]
+            levels += 1
+
+        if not shards or self._cancel.is_set():
+            return
+
+        # A root nested under another root (or a directory listed above) is reached again by whichever worker walks the
+        # tree it sits in, so every worker starts out knowing which directories have been visited already.
+        visited_dirs = frozenset(self._visited_dirs)
+
+        with ProcessPoolExecutor(max_workers=self.options.scan_processes) as executor:
+            futures = [executor.submit(_scan_shard, self.options, visited_dirs, *shard) for shard in shards]
+            for future in as_completed(futures):
+                if self._cancel.is_set():
+                    # Shards are merged whole or not at all. The ones still running are waited for and dropped.
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return
+                record, stats = future.result()
+                self._merge_record(record)
+                if self.stats is not None:
+                    self.stats.merge(stats)
+                yield self.checked_count
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _examine_directory(self,
+                           scan_dir,
+                           root_p,
+                           depth,
+                           uid,
+                           gid):
+        """
+        Lists a single directory and examines everything in it without modifying any of the scan results. Yields one
+        tuple per entry, as each entry is examined:
+
+            (_FILE, path, reason, metadata) for files (see _examine_file),
+            (_DIR, path, reason, (st_dev, st_ino)) for subdirectories (see _examine_dir). st_dev is None if the
+                directory was filtered out or could not be stat'ed.
+            (_ERROR, scan_dir, None, error) if an OSError stopped the listing (this is always the last tuple).
+
+        :param scan_dir:
+            A full path to the directory to list.
+        :param root_p:
+            The path to the root directory (for comparing relative paths)
+        :param depth:
+            How many levels below the root of the scan this directory is. Subdirectories of a directory at max_depth
+            are left out entirely.
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+
+        :return:
+            Nothing.
+        """
+
+        descend = self.options.max_depth is None or depth < self.options.max_depth
+        stats = self.stats
+
+        if self._inotify is not None:
+            self._prepare_watch(dir_p=scan_dir)
+
+        try:
+
+            if stats is not None:
+                started = time.perf_counter()
+
+            with os.scandir(scan_dir) as entries:
+
+                if self.options.walk_order == "inode":
+                    entries = sorted(entries, key=lambda dir_entry: dir_entry.inode())
+                elif stats is not None:
+                    # Read the whole directory up front so that the listing can be timed on its own.
+                    entries = list(entries)
+
+                if stats is not None:
+                    stats.add_listing(scan_dir, time.perf_counter() - started)
+
+                # Every file in this directory gets the same answer from the directory filters. Work it out once, from
+                # the first file's path (which is how the filters would see it for any of the files).
+                dir_reason = _UNCHECKED
+
+                for entry in entries:
+
+                    if entry.is_dir(follow_symlinks=False) and not self.options.skip_sub_dir:
+                        if descend:
+                            yield (_DIR, entry.path) + self._examine_subdir(entry=entry, root_p=root_p)
+                        continue
+
+                    if dir_reason is _UNCHECKED:
+                        dir_reason = self._match_dir_filters(file_d=os.path.split(entry.path)[0])
+
+                    yield (_FILE, entry.path) + self._examine_file(file_p=entry.path,
+                                                                   root_p=root_p,
+                                                                   uid=uid,
+                                                                   gid=gid,
+                                                                   entry=entry,
+                                                                   dir_reason=dir_reason)
+
+        except OSError as err:
+
+            yield _ERROR, scan_dir, None, err
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _examine_subdir(self,
+                        entry,
+                        root_p):
+        """
+        Runs the directory filters (and the same_filesystem check) against a subdirectory found while listing a
+        directory. Does not modify any of the scan results, so it is safe to call from worker threads.
+
+        :param entry:
+            The os.DirEntry for the subdirectory.
+        :param root_p:
+            The path to the root directory the subdirectory was found under.
+
+        :return:
+            A tuple containing the name of the counter that should be incremented if the subdirectory is to be skipped
+            (None if it should be scanned) and its (st_dev, st_ino). st_dev is None if the subdirectory was filtered out
+            or could not be stat'ed.
+        """
+
+        stats = self.stats
+
+        if stats is None:
+            reason = self._examine_dir(dir_p=entry.path, dir_n=entry.name)
+        else:
+            started = time.perf_counter()
+            reason = self._examine_dir(dir_p=entry.path, dir_n=entry.name)
+            stats.add("filtering", time.perf_counter() - started)
+        if reason is not None:
+            return reason, (None, entry.inode())
+
+        # Not entry.inode(): for a mount point (including a bind mount) that is the inode of the directory underneath
+        # the mount rather than of the directory that is mounted there.
+        try:
+            dir_stat = entry.stat(follow_symlinks=False)
+            dir_key = (dir_stat.st_dev, dir_stat.st_ino)
+        except OSError:
+            # Left for the listing of the directory itself to fail and record the error.
+            dir_key = (None, entry.inode())
+
+        if self.options.same_filesystem and dir_key[0] is not None:
+            if dir_key[0] != self._root_device(root_p):
+                reason = "skipped_other_fs_dirs"
+
+        return reason, dir_key
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _apply_examined(self,
+                        scan_dir,
+                        root_p,
+                        depth,
+                        examined,
+                        frontier):
+        """
+        Applies the results of examining a directory (the tuples yielded by _examine_directory) to the counters and the
+        scan results, and adds the subdirectories that pass the filters to the frontier.
+
+        :param scan_dir:
+            The directory that was examined.
+        :param root_p:
+            The path to the root directory (for comparing relative paths)
+        :param depth:
+            How many levels below the root of the scan the directory is.
+        :param examined:
+            An iterable of the tuples yielded by _examine_directory.
+        :param frontier:
+            The _Frontier of directories still to be scanned.
+
+        :return:
+            Nothing.
+        """
+
+        children = list()
+        checked_before = self.checked_count
+
+        # In watch mode, the outcome of examining every entry: {name: (_FILE or _DIR, reason)}.
+        outcomes = None if self._watched is None else dict()
+
+        for kind, path, reason, value in examined:
+
+            if kind is _FILE:
+                reason = self._apply_file_result(file_p=path, reason=reason, attrs=value)
+                if outcomes is not None:
+                    outcomes[os.path.split(path)[1]] = (_FILE, reason)
+                if self.checked_count % self.options.report_frequency == 0:
+                    yield self.checked_count
+
+            elif kind is _DIR:
+                if reason is None and not self._visit_dir(value):
+                    reason = "skipped_repeated_dirs"
+                if outcomes is not None:
+                    outcomes[os.path.split(path)[1]] = (_DIR, reason)
+                if reason is not None:
+                    self._increment(reason)
+                    yield self.checked_count
+                    continue
+                children.append((path, root_p, depth + 1, value[1]))
+
+            else:
+                self._record_dir_error(scan_dir=scan_dir, err=value)
+
+        if self.stats is not None:
+            self.stats.add_root_files(root_p, self.checked_count - checked_before)
+
+        if outcomes is not None:
+            self._add_watched_dir(dir_p=scan_dir, root_p=root_p, depth=depth, outcomes=outcomes)
+
+        frontier.push_children(children)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _list_directory(self,
+                        scan_dir,
+                        root_p,
+                        depth,
+                        uid,
+                        gid):
+        """
+        Examines a whole directory in one go (see _examine_directory). This is the unit of work that is handed to the
+        worker threads.
+
+        :param scan_dir:
+            A full path to the directory to list.
+        :param root_p:
+            The path to the root directory (for comparing relative paths)
+        :param depth:
+            How many levels below the root of the scan this directory is.
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+
+        :return:
+            A tuple containing the directory, the root path, the depth, and a list of the tuples yielded by
+            _examine_directory.
+        """
+
+        return scan_dir, root_p, depth, list(self._examine_directory(scan_dir, root_p, depth, uid, gid))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _apply_listing(self,
+                       listing,
+                       frontier):
+        """
+        Applies the results of a directory listing (as returned by _list_directory) to the counters and the scan
+        results.
+
+        :param listing:
+            The tuple returned by _list_directory.
+        :param frontier:
+            The _Frontier of directories still to be scanned. Any subdirectories that pass the filters are added to it.
+
+        :return:
+            Nothing.
+        """
+
+        scan_dir, root_p, depth, examined = listing
+
+        yield from self._apply_examined(scan_dir=scan_dir,
+                                        root_p=root_p,
+                                        depth=depth,
+                                        examined=examined,
+                                        frontier=frontier)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def scan_directories_stream(self,
+                                scan_dirs,
+                                batch_size=None,
+                                retain=True):
+        """
+        Scan a list of directories exactly like scan_directories, but yield the files that pass the filters (as
+        (path, metadata) tuples) as they are found instead of the running count. This lets downstream processing start
+        before the scan is complete.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+        :param batch_size:
+            If None, every file is yielded on its own as a (path, metadata) tuple. Otherwise, lists of up to this many
+            (path, metadata) tuples are yielded.
+        :param retain:
+            If False, the files are NOT stored in self.files, so memory use does not grow with the size of the scan.
+            The counters and error sets are still updated.
+
+        :return:
+            Nothing.
+        """
+
+        yield from self._stream(progress=self.scan_directories(scan_dirs=scan_dirs),
+                                batch_size=batch_size,
+                                retain=retain)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def scan_files_stream(self,
+                          files_p,
+                          root_p,
+                          batch_size=None,
+                          retain=True):
+        """
+        Scan a specific list of files exactly like scan_files, but yield the files that pass the filters (as
+        (path, metadata) tuples) as they are found instead of the running count.
+
+        :param files_p:
+            A list, set, or tuple of files (with full paths).
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+        :param batch_size:
+            If None, every file is yielded on its own as a (path, metadata) tuple. Otherwise, lists of up to this many
+            (path, metadata) tuples are yielded.
+        :param retain:
+            If False, the files are NOT stored in self.files.
+
+        :return:
+            Nothing.
+        """
+
+        yield from self._stream(progress=self.scan_files(files_p=files_p, root_p=root_p),
+                                batch_size=batch_size,
+                                retain=retain)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _stream(self,
+                progress,
+                batch_size,
+                retain):
+        """
+        Drives one of the scan generators, yielding the files it adds instead of its progress counts.
+
+        :param progress:
+            The scan generator (for example, the one returned by scan_directories).
+        :param batch_size:
+            None to yield single (path, metadata) tuples. Otherwise, the largest number of tuples to yield per list.
+        :param retain:
+            Whether the files should also be stored in self.files.
+
+        :return:
+            Nothing.
+        """
+
+        assert batch_size is None or (type(batch_size) is int and batch_size > 0)
+        assert type(retain) is bool
+
+        buffer = list()
+        self._stream_buffer = buffer
+        self._retain_files = retain
+
+        try:
+            for _ in progress:
+                if batch_size is None:
+                    yield from buffer
+                    buffer.clear()
+                    continue
+                while len(buffer) >= batch_size:
+                    yield buffer[:batch_size]
+                    del buffer[:batch_size]
+
+            if batch_size is None:
+                yield from buffer
+                return
+            while buffer:
+                yield buffer[:batch_size]
+                del buffer[:batch_size]
+
+        finally:
+            self._stream_buffer = None
+            self._retain_files = True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    async def ascan_directories(self,
+                                scan_dirs,
+                                max_concurrency=16,
+                                per_root_concurrency=4,
+                                batch_size=100,
+                                retain=True):
+        """
+        Scan a list of directories from asyncio, walking all the roots at the same time so that one slow mount does not
+        hold up the others. Yields lists of (path, metadata) tuples for the files that pass the filters:
+
+            async for batch in scan_obj.ascan_directories(scan_dirs):
+                ...
+
+        The blocking directory listings and stat calls run on a thread pool (the same work done by each thread when
+        scanning with scan_threads). The counters, error sets, and self.files are only ever updated on the event loop,
+        and end up the same as they would with scan_directories.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+        :param max_concurrency:
+            The largest number of directories being listed at the same time, across all roots.
+        :param per_root_concurrency:
+            The largest number of directories being listed at the same time under any one root.
+        :param batch_size:
+            The largest number of (path, metadata) tuples in each list that is yielded.
+        :param retain:
+            If False, the files are NOT stored in self.files.
+
+        :return:
+            Nothing.
+        """
+
+        assert type(scan_dirs) in [list, set, tuple]
+        assert type(max_concurrency) is int and max_concurrency > 0
+        assert type(per_root_concurrency) is int and per_root_concurrency > 0
+        assert type(batch_size) is int and batch_size > 0
+
+        self._compile_filters()
+        self._cancel.clear()
+
+        scan_dirs = self._unvisited_roots(scan_dirs)
+
+        uid = self.options.uid
+        gid = self.options.gid
+
+        loop = asyncio.get_running_loop()
+        overall = asyncio.Semaphore(max_concurrency)
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+        # Bounded, so that the walk stops getting further ahead of a consumer that cannot keep up.
+        batches = asyncio.Queue(maxsize=max_concurrency)
+
+        buffer = list()
+        self._stream_buffer = buffer
+        self._retain_files = retain
+
+        async def list_directory(scan_dir, root_p, depth):
+            async with overall:
+                return await loop.run_in_executor(executor, self._list_directory, scan_dir, root_p, depth, uid, gid)
+
+        async def walk_root(root_p):
+            frontier = _Frontier(order=self.options.walk_order)
+            frontier.push_children([(root_p, root_p, 0, 0)])
+            running = set()
+            try:
+                while frontier or running:
+                    if self._cancel.is_set():
+                        frontier = _Frontier(order=self.options.walk_order)
+                        if not running:
+                            break
+                    while frontier and len(running) < per_root_concurrency:
+                        running.add(asyncio.ensure_future(list_directory(*frontier.pop())))
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        for checked_count in self._apply_listing(listing=task.result(), frontier=frontier):
+                            if self.stats_callback is not None:
+                                self.stats_callback(checked_count, self.stats)
+                    while len(buffer) >= batch_size:
+                        batch = buffer[:batch_size]
+                        del buffer[:batch_size]
+                        await batches.put(batch)
+            finally:
+                # If the walk is cancelled (the consumer stopped early), the listings still running are cancelled
+                # and waited for too, rather than being left behind as pending tasks.
+                for task in running:
+                    task.cancel()
+                if running:
+                    await asyncio.wait(running)
+
+        producer = asyncio.ensure_future(asyncio.gather(*(walk_root(scan_dir) for scan_dir in scan_dirs)))
+
+        try:
+            while True:
+                getter = asyncio.ensure_future(batches.get())
+                await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                producer.result()
+                break
+
+            while not batches.empty():
+                yield batches.get_nowait()
+
+            while buffer:
+                batch = buffer[:batch_size]
+                del buffer[:batch_size]
+                yield batch
+
+        finally:
+            producer.cancel()
+            await asyncio.wait({producer})
+            if not producer.cancelled():
+                producer.exception()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._stream_buffer = None
+            self._retain_files = True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def scan_directories_resumable(self,
+                                   scan_dirs,
+                                   checkpoint_p,
+                                   checkpoint_interval=60.0):
+        """
+        Scan a list of directories exactly like scan_directories, but write a checkpoint file every so often holding
+        the directories still waiting to be scanned together with everything found so far. If the scan is cancelled
+        (see cancel) a final checkpoint is written. If the process dies, the last checkpoint is left behind. Calling
+        this again with the same directories and options (on a new object) picks up from the checkpoint instead of
+        starting over. The checkpoint is removed once the scan completes.
+
+        Each checkpoint rewrites the results found so far, so it takes longer as the scan grows. To keep that from
+        dominating the scan, the time between checkpoints grows with the time the last one took, so that no more than
+        about 5% of the scan is spent writing them.
+
+        Directories are listed on a pool of worker threads if the options ask for more than one scan thread. Multiple
+        scan processes are not used.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+        :param checkpoint_p:
+            The path to the checkpoint file.
+        :param checkpoint_interval:
+            The shortest time (in seconds) between checkpoints.
+
+        :return:
+            Nothing.
+        """
+
+        assert type(scan_dirs) in [list, set, tuple]
+        assert type(checkpoint_p) is str
+        assert checkpoint_interval > 0
+
+        self._compile_filters()
+        self._cancel.clear()
+
+        uid = self.options.uid
+        gid = self.options.gid
+        scan_dirs = list(scan_dirs)
+
+        frontier = self._read_checkpoint(checkpoint_p=checkpoint_p, scan_dirs=scan_dirs)
+        if frontier is None:
+            frontier = _Frontier(order=self.options.walk_order)
+            frontier.push_children([(scan_dir, scan_dir, 0, 0) for scan_dir in self._unvisited_roots(scan_dirs)])
+
+        executor = None
+        if self.options.scan_threads > 1:
+            executor = ThreadPoolExecutor(max_workers=self.options.scan_threads)
+        max_in_flight = self.options.scan_threads * 2
+        in_flight = set()
+
+        interval = checkpoint_interval
+        last_checkpoint = time.monotonic()
+
+        try:
+            while frontier or in_flight:
+
+                # Only checkpoint (or stop) when nothing is in flight, so that the frontier holds every directory that
+                # has not been recorded yet.
+                pausing = self._cancel.is_set() or time.monotonic() - last_checkpoint >= interval
+
+                if pausing and not in_flight:
+                    if self._cancel.is_set():
+                        break
+                    started = time.perf_counter()
+                    self._write_checkpoint(checkpoint_p=checkpoint_p, scan_dirs=scan_dirs, frontier=frontier)
+                    interval = max(checkpoint_interval, (time.perf_counter() - started) / _CHECKPOINT_BUDGET)
+                    last_checkpoint = time.monotonic()
+                    continue
+
+                if executor is None:
+                    dir_p, root_p, depth = frontier.pop()
+                    progress = self._apply_examined(scan_dir=dir_p,
+                                                    root_p=root_p,
+                                                    depth=depth,
+                                                    examined=self._examine_directory(dir_p, root_p, depth, uid, gid),
+                                                    frontier=frontier)
+                else:
+                    while frontier and len(in_flight) < max_in_flight and not pausing:
+                        in_flight.add(executor.submit(self._list_directory, *frontier.pop(), uid, gid))
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    progress = (checked_count for future in done
+                                for checked_count in self._apply_listing(listing=future.result(), frontier=frontier))
+
+                for checked_count in progress:
+                    if self.stats_callback is not None:
+                        self.stats_callback(checked_count, self.stats)
+                    yield checked_count
+
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        if frontier:
+            self._write_checkpoint(checkpoint_p=checkpoint_p, scan_dirs=scan_dirs, frontier=frontier)
+        elif os.path.exists(checkpoint_p):
+            os.remove(checkpoint_p)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _write_checkpoint(self,
+                          checkpoint_p,
+                          scan_dirs,
+                          frontier):
+        """
+        Writes a checkpoint of a resumable scan: a saved scan (see save) whose header also holds the directories passed
+        to the scan and the frontier of directories still waiting to be scanned. The file is written next to the
+        checkpoint and then moved over it, so a crash while writing never leaves a broken checkpoint behind.
+
+        :param checkpoint_p:
+            The path to the checkpoint file.
+        :param scan_dirs:
+            The list of directories passed to the scan.
+        :param frontier:
+            The _Frontier of directories still to be scanned.
+
+        :return:
+            Nothing.
+        """
+
+        header = self._state_header()
+        header["checkpoint"] = {"scan_dirs": list(scan_dirs),
+                                "signature": ScanIndex._options_signature(self.options),
+                                "walk_order": frontier.order,
+                                "frontier": frontier.to_list()}
+
+        write_scan(file_p=checkpoint_p + ".tmp", header=header, files=self.files.items())
+        os.replace(checkpoint_p + ".tmp", checkpoint_p)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _read_checkpoint(self,
+                         checkpoint_p,
+                         scan_dirs):
+        """
+        Restores the results held in the checkpoint of a resumable scan, if there is one for the same directories and
+        the same options.
+
+        :param checkpoint_p:
+            The path to the checkpoint file.
+        :param scan_dirs:
+            The list of directories passed to the scan.
+
+        :return:
+            The _Frontier of directories still to be scanned. None if there is no usable checkpoint (in which case
+            nothing is restored).
+        """
+
+        if not os.path.exists(checkpoint_p):
+            return None
+
+        with open(checkpoint_p, "rb") as f:
+
+            try:
+                header = read_header(f)
+                checkpoint = header.get("checkpoint")
+                if checkpoint is None or checkpoint["scan_dirs"] != list(scan_dirs):
+                    return None
+                if checkpoint["signature"] != ScanIndex._options_signature(self.options):
+                    return None
+                if checkpoint["walk_order"] != self.options.walk_order:
+                    return None
+                frontier = _Frontier.from_list(order=checkpoint["walk_order"], items=checkpoint["frontier"])
+            except (ValueError, KeyError, TypeError, EOFError, struct.error, pickle.UnpicklingError, AttributeError,
+                    ImportError):
+                # Not a checkpoint, one written by a different version, or a damaged one. Start over.
+                return None
+
+            self._restore_state(header=header, f=f)
+
+        return frontier
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def scan_directories_incremental(self,
+                                     scan_dirs,
+                                     index_p):
+        """
+        Scan a list of directories, reusing the results stored in a scan index by a previous run wherever possible.
+        Every directory is still stat'ed, but only the directories whose mtime (or device or inode) changed since the
+        previous run are listed again. Everything else is taken from the index. The index is then updated with the
+        results of this scan.
+
+        The counters, error sets, and files end up the same as for a full scan with the same options. In addition,
+        self.delta is set to a ScanDelta holding the files that were added, removed, or modified since the previous
+        run. Because editing a file in place does not change the mtime of its directory, "modified" only covers files
+        in directories that had to be listed again.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan.
+        :param index_p:
+            The path to the index file. It is created (and every file reported as added) if it does not exist yet.
+
+        :return:
+            Nothing.
+        """
+
+        assert type(scan_dirs) in [list, set, tuple]
+        assert type(index_p) is str
+
+        self._compile_filters()
+        self._cancel.clear()
+
+        uid = self.options.uid
+        gid = self.options.gid
+
+        self.delta = ScanDelta()
+
+        with ScanIndex(index_p=index_p, options=self.options) as index:
+
+            indexed_dirs = index.dir_paths()
+            visited_dirs = set()
+
+            # As in scan_directories, every root is marked as visited up front, so that a root nested under another
+            # root is scanned as a root of its own (and skipped when the walk of the outer root reaches it).
+            pending = [(scan_dir, scan_dir, 0, True) for scan_dir in reversed(self._unvisited_roots(scan_dirs))]
+
+            while pending:
+
+                if self._cancel.is_set():
+                    # Everything stored in the index so far is still valid. Skip the clean up of directories that were
+                    # not visited, since they may only have been missed because of the cancel.
+                    return
+
+                scan_dir, root_p, depth, is_root = pending.pop()
+                visited_dirs.add(scan_dir)
+
+                cached = index.get_dir(scan_dir) if scan_dir in indexed_dirs else None
+
+                try:
+                    dir_stat = os.stat(scan_dir)
+                except OSError as err:
+                    self._record_dir_error(scan_dir=scan_dir, err=err)
+                    continue
+
+                if not is_root and not self._visit_dir((dir_stat.st_dev, dir_stat.st_ino)):
+                    self.skipped_repeated_dirs += 1
+                    continue
+
+                dir_state = (root_p, dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime_ns)
+
+                if cached is not None and cached[:4] == dir_state:
+                    record = cached[4]
+                else:
+                    record = self._scan_directory_record(scan_dir=scan_dir,
+                                                         root_p=root_p,
+                                                         depth=depth,
+                                                         uid=uid,
+                                                         gid=gid)
+                    self._add_to_delta(old_files=cached[4]["files"] if cached is not None else dict(),
+                                       new_files=record["files"])
+                    if any(record["errors"][attr] for attr in _DIR_ERROR_SET_ATTRS):
+                        # Never reuse a directory that could not be listed completely. Try it again next time.
+                        index.remove_dirs([scan_dir])
+                    else:
+                        index.put_dir(scan_dir, *dir_state, record)
+
+                self._merge_record(record)
+                pending.extend((dir_p, root_p, depth + 1, False) for dir_p in reversed(record["subdirs"]))
+
+                if self.stats_callback is not None:
+                    self.stats_callback(self.checked_count, self.stats)
+                yield self.checked_count
+
+            for dir_p in indexed_dirs - visited_dirs:
+                cached = index.get_dir(dir_p)
+                if cached is not None:
+                    self.delta.removed.update(cached[4]["files"])
+            index.remove_dirs(indexed_dirs - visited_dirs)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _scan_directory_record(self,
+                               scan_dir,
+                               root_p,
+                               depth,
+                               uid,
+                               gid):
+        """
+        Lists a single directory (without descending into its subdirectories) and returns a record of everything found
+        directly inside it. Does not modify the results of this scan.
+
+        :param scan_dir:
+            A full path to the directory to list.
+        :param root_p:
+            The path to the root directory (for comparing relative paths)
+        :param depth:
+            How many levels below the root of the scan this directory is.
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+
+        :return:
+            A dictionary (see _get_record) with an additional "subdirs" key holding the list of subdirectories that
+            passed the directory filters.
+        """
+
+        scratch = ScanFiles(scan_options=self.options)
+        scratch._root_devices = self._root_devices
+
+        frontier = _Frontier(order="breadth")
+        listing = scratch._list_directory(scan_dir, root_p, depth, uid, gid)
+        for _ in scratch._apply_listing(listing=listing, frontier=frontier):
+            pass
+
+        if self.stats is not None:
+            self.stats.merge(scratch.stats)
+
+        record = scratch._get_record()
+        record["subdirs"] = [frontier.pop()[0] for _ in range(len(frontier))]
+
+        return record
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _add_to_delta(self,
+                      old_files,
+                      new_files):
+        """
+        Compares the files found in a directory during the previous and the current scans and adds the differences to
+        self.delta.
+
+        :param old_files:
+            A dictionary of the files (and their metadata) found in the directory by the previous scan.
+        :param new_files:
+            A dictionary of the files (and their metadata) found in the directory by this scan.
+
+        :return:
+            Nothing.
+        """
+
+        for file_p, metadata in new_files.items():
+            if file_p not in old_files:
+                self.delta.added.add(file_p)
+            elif old_files[file_p] != metadata:
+                self.delta.modified.add(file_p)
+
+        for file_p in old_files:
+            if file_p not in new_files:
+                self.delta.removed.add(file_p)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def watch(self,
+              scan_dirs,
+              poll_interval=1.0):
+        """
+        Scan a list of directories and then keep the results current by watching the scanned tree for changes with
+        inotify (Linux only). Files that are created, deleted, renamed, or written to (once they are closed) are put
+        through exactly the same filters as during the scan, and the files, counters, and error sets are updated to
+        match. New subdirectories are scanned and watched, and deleted ones are dropped along with everything under
+        them.
+
+        The initial scan runs on scan_threads threads (scan_processes is ignored) and reports its progress through the
+        stats callback. An empty ScanDelta is yielded once it is done. After that, a ScanDelta holding the files that
+        were added, removed, or modified is yielded for every batch of events that changed the results. The generator
+        runs until cancel() is called (which takes effect within poll_interval seconds) or it is closed.
+
+        Nothing is ever rescanned in full. If the kernel drops events because its event queue overflowed, only the
+        watched directories whose mtime changed are listed again. Directories that cannot be watched (for example
+        because the fs.inotify.max_user_watches limit has been reached) are polled instead: each is stat'ed every
+        poll_interval seconds, listed again when its mtime changes, and watched as soon as a watch can be added. Since
+        editing a file in place does not change the mtime of its directory, such edits are missed in those two cases
+        until something else touches the file.
+
+        :param scan_dirs:
+            A list containing full paths to directories to scan and watch.
+        :param poll_interval:
+            The number of seconds to wait for events before checking for a cancel and polling the directories that
+            are not watched.
+
+        :return:
+            Nothing. Yields ScanDelta objects.
+        """
+
+        assert type(scan_dirs) in [list, set, tuple]
+        assert poll_interval > 0
+
+        self._compile_filters()
+        self._cancel.clear()
+
+        self._inotify = inotify.Inotify()
+        self._watched = dict()
+        self._watch_wds = dict()
+        self._watch_pending = dict()
+        self._watch_polled = set()
+
+        try:
+
+            scan_dirs = self._unvisited_roots(scan_dirs)
+
+            if self.options.scan_threads > 1:
+                progress = self._scan_directories_threaded(scan_dirs=scan_dirs)
+            else:
+                progress = self._scan_directories_serial(scan_dirs=scan_dirs)
+
+            for checked_count in progress:
+                if self.stats_callback is not None:
+                    self.stats_callback(checked_count, self.stats)
+
+            if self._cancel.is_set():
+                return
+
+            self.delta = ScanDelta()
+            yield self.delta
+
+            last_poll = time.monotonic()
+
+            while not self._cancel.is_set():
+
+                events = self._inotify.read_events(timeout=poll_interval)
+
+                poll = self._watch_polled and time.monotonic() - last_poll >= poll_interval
+                if poll:
+                    last_poll = time.monotonic()
+
+                if not events and not poll:
+                    continue
+
+                delta = self._apply_watch_events(events=events, poll=poll)
+                if delta.added or delta.removed or delta.modified:
+                    self.delta = delta
+                    yield delta
+
+        finally:
+
+            self._inotify.close()
+            self._inotify = None
+            self._watched = None
+            self._watch_wds = None
+            self._watch_pending = None
+            self._watch_polled = None
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _prepare_watch(self,
+                       dir_p):
+        """
+        Watches a directory that is about to be listed (in watch mode). The watch is added before the directory's mtime
+        is read and before it is listed, so that no change made after the listing can be missed. May be called from
+        worker threads.
+
+        :param dir_p:
+            The full path to the directory.
+
+        :return:
+            Nothing.
+        """
+
+        try:
+            wd = self._inotify.add_watch(dir_p, _WATCH_MASK)
+        except OSError:
+            wd = None
+
+        try:
+            dir_stat = os.stat(dir_p)
+            self._watch_pending[dir_p] = (wd, dir_stat.st_mtime_ns, (dir_stat.st_dev, dir_stat.st_ino))
+        except OSError:
+            self._watch_pending[dir_p] = (wd, None, (None, None))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _add_watched_dir(self,
+                         dir_p,
+                         root_p,
+                         depth,
+                         outcomes):
+        """
+        Records a directory whose listing has just been applied (in watch mode).
+
+        :param dir_p:
+            The full path to the directory.
+        :param root_p:
+            The path to the root directory the directory was scanned under.
+        :param depth:
+            How many levels below the root the directory is.
+        :param outcomes:
+            The outcome of examining every entry in the directory: {name: (_FILE or _DIR, reason)}.
+
+        :return:
+            Nothing.
+        """
+
+        wd, mtime_ns, dir_key = self._watch_pending.pop(dir_p, (None, None, (None, None)))
+
+        record = _WatchedDir(root_p=root_p, depth=depth, wd=wd, mtime_ns=mtime_ns, dir_key=dir_key, entries=outcomes)
+        self._watched[dir_p] = record
+
+        if wd is None:
+            self._watch_polled.add(dir_p)
+        else:
+            self._watch_wds[wd] = dir_p
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _apply_watch_events(self,
+                            events,
+                            poll):
+        """
+        Applies a batch of inotify events to the scan results. Every entry named by an event is forgotten and then
+        examined again as it is now, so the order of the events (and whether any were dropped in between) does not
+        matter. All entries are forgotten before any are examined, so that a directory moved within the tree is not
+        mistaken for one that has already been visited.
+
+        :param events:
+            The list of events returned by Inotify.read_events.
+        :param poll:
+            If True, the directories that are not watched are checked for changes as well.
+
+        :return:
+            A ScanDelta holding the changes made to the scan results.
+        """
+
+        touched = dict()
+        stale = set()
+        overflowed = False
+
+        for wd, mask, cookie, name in events:
+
+            if mask & inotify.IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+
+            dir_p = self._watch_wds.get(wd)
+            if dir_p is None:
+                continue
+
+            if mask & inotify.IN_IGNORED:
+                # The kernel removed the watch (the directory was deleted or its filesystem unmounted).
+                del self._watch_wds[wd]
+                record = self._watched.get(dir_p)
+                if record is not None and record.wd == wd:
+                    record.wd = None
+                    self._watch_polled.add(dir_p)
+                continue
+
+            if name:
+                touched[(dir_p, name)] = None
+
+        if overflowed:
+            candidates = list(self._watched)
+        elif poll:
+            candidates = list(self._watch_polled)
+        else:
+            candidates = list()
+
+        for dir_p in candidates:
+            if self._watched_dir_changed(dir_p=dir_p, record=self._watched[dir_p]):
+                stale.add(dir_p)
+
+        for dir_p in stale:
+            for name in self._relist_watched_dir(dir_p=dir_p):
+                touched[(dir_p, name)] = None
+
+        forgotten = dict()
+        self._stream_buffer = list()
+
+        try:
+            touched = [key for key in touched if not self._is_unchanged_subdir(*key)]
+            for dir_p, name in touched:
+                self._forget_entry(dir_p=dir_p, name=name, forgotten=forgotten)
+            for dir_p, name in touched:
+                self._examine_watched_entry(dir_p=dir_p, name=name)
+            kept = self._stream_buffer
+        finally:
+            self._stream_buffer = None
+
+        delta = ScanDelta()
+        for file_p, metadata in kept:
+            previous = forgotten.pop(file_p, None)
+            if previous is None:
+                delta.added.add(file_p)
+            elif previous != metadata:
+                delta.modified.add(file_p)
+        delta.removed.update(forgotten)
+
+        return delta
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _watched_dir_changed(dir_p,
+                             record):
+        """
+        :param dir_p:
+            The full path to a directory that has been scanned in watch mode.
+        :param record:
+            The _WatchedDir for the directory.
+
+        :return:
+            True if the mtime of the directory is not the one it had when it was listed (or it cannot be stat'ed).
+        """
+
+        try:
+            return os.stat(dir_p).st_mtime_ns != record.mtime_ns
+        except OSError:
+            return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _relist_watched_dir(self,
+                            dir_p):
+        """
+        Gets a directory whose events may have been missed ready to be examined again: tries to watch it if it is not
+        watched, takes its new mtime, and lists it.
+
+        :param dir_p:
+            The full path to a directory that has been scanned in watch mode.
+
+        :return:
+            The names of every entry that is in the directory now or was in it when it was last examined.
+        """
+
+        record = self._watched[dir_p]
+
+        if record.wd is None:
+            try:
+                record.wd = self._inotify.add_watch(dir_p, _WATCH_MASK)
+                self._watch_wds[record.wd] = dir_p
+                self._watch_polled.discard(dir_p)
+            except OSError:
+                pass
+
+        self._clear_dir_error(dir_p=dir_p)
+
+        try:
+            record.mtime_ns = os.stat(dir_p).st_mtime_ns
+            names = os.listdir(dir_p)
+        except OSError as err:
+            self._record_dir_error(scan_dir=dir_p, err=err)
+            names = list()
+
+        return set(record.entries).union(names)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _is_unchanged_subdir(self,
+                             dir_p,
+                             name):
+        """
+        Checks whether an entry is a subdirectory that was scanned and is still the same directory. Its contents are
+        kept up to date through its own watch, so there is no need to forget and scan it again.
+
+        :param dir_p:
+            The full path to the directory holding the entry.
+        :param name:
+            The name of the entry.
+
+        :return:
+            True if the entry can be left alone.
+        """
+
+        record = self._watched.get(dir_p)
+        if record is None or record.entries.get(name) != (_DIR, None):
+            return False
+
+        sub_dir_p = os.path.join(dir_p, name)
+        sub_record = self._watched.get(sub_dir_p)
+        if sub_record is None:
+            return False
+
+        try:
+            dir_stat = os.lstat(sub_dir_p)
+        except OSError:
+            return False
+
+        return stat.S_ISDIR(dir_stat.st_mode) and (dir_stat.st_dev, dir_stat.st_ino) == sub_record.dir_key
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _forget_entry(self,
+                      dir_p,
+                      name,
+                      forgotten):
+        """
+        Winds back whatever examining an entry of a watched directory did to the scan results.
+
+        :param dir_p:
+            The full path to the directory holding the entry.
+        :param name:
+            The name of the entry.
+        :param forgotten:
+            A dictionary that the path and metadata of every file removed from the scan is added to.
+
+        :return:
+            Nothing.
+        """
+
+        record = self._watched.get(dir_p)
+        if record is None:
+            return
+
+        outcome = record.entries.pop(name, None)
+        if outcome is None:
+            return
+
+        self._forget(path=os.path.join(dir_p, name), kind=outcome[0], reason=outcome[1], forgotten=forgotten)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _forget(self,
+                path,
+                kind,
+                reason,
+                forgotten):
+        """
+        Winds back the outcome of examining a single file or subdirectory (the reverse of _apply_file_result, or of
+        skipping or scanning the subdirectory).
+
+        :param path:
+            The full path to the file or subdirectory.
+        :param kind:
+            _FILE or _DIR.
+        :param reason:
+            The reason it was skipped. None if it was kept (or scanned).
+        :param forgotten:
+            A dictionary that the path and metadata of every file removed from the scan is added to.
+
+        :return:
+            Nothing.
+        """
+
+        if kind is _DIR:
+            if reason is None:
+                self._forget_dir(dir_p=path, forgotten=forgotten)
+            else:
+                setattr(self, reason, getattr(self, reason) - 1)
+            return
+
+        self.checked_count -= 1
+
+        if reason is None:
+            self.initial_count -= 1
+            forgotten[path] = self._remove_from_scan(file_path=path)
+        elif reason in _FILE_ERROR_SETS:
+            self.error_count -= 1
+            getattr(self, reason).discard(path)
+        else:
+            setattr(self, reason, getattr(self, reason) - 1)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _forget_dir(self,
+                    dir_p,
+                    forgotten):
+        """
+        Removes a scanned directory, and everything found under it, from the scan results and stops watching it. The
+        directories under it are kept on an explicit stack (as in _Frontier) rather than handled by recursion, so that
+        a very deep tree cannot run into the recursion limit.
+
+        :param dir_p:
+            The full path to the directory.
+        :param forgotten:
+            A dictionary that the path and metadata of every file removed from the scan is added to.
+
+        :return:
+            Nothing.
+        """
+
+        pending = [dir_p]
+
+        while pending:
+
+            dir_p = pending.pop()
+
+            record = self._watched.pop(dir_p, None)
+            if record is None:
+                continue
+
+            if record.wd is not None:
+                self._inotify.rm_watch(record.wd)
+                self._watch_wds.pop(record.wd, None)
+            self._watch_polled.discard(dir_p)
+
+            self._visited_dirs.discard(record.dir_key)
+            self._clear_dir_error(dir_p=dir_p)
+
+            for name, (kind, reason) in record.entries.items():
+                path = os.path.join(dir_p, name)
+                if kind is _DIR and reason is None:
+                    pending.append(path)
+                else:
+                    self._forget(path=path, kind=kind, reason=reason, forgotten=forgotten)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _clear_dir_error(self,
+                         dir_p):
+        """
+        Removes a directory from the directory error sets (the reverse of _record_dir_error).
+
+        :param dir_p:
+            The full path to the directory.
+
+        :return:
+            Nothing.
+        """
+
+        for attr in _DIR_ERROR_SET_ATTRS:
+            errors = getattr(self, attr)
+            if dir_p in errors:
+                errors.discard(dir_p)
+                self.error_count -= 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _examine_watched_entry(self,
+                               dir_p,
+                               name):
+        """
+        Examines a single entry of a watched directory as it is now, following the same rules as _examine_directory,
+        and applies the outcome to the scan results. A new subdirectory is scanned (and watched) in full.
+
+        :param dir_p:
+            The full path to the directory holding the entry.
+        :param name:
+            The name of the entry.
+
+        :return:
+            Nothing.
+        """
+
+        record = self._watched.get(dir_p)
+        if record is None or name in record.entries:
+            return
+
+        entry_p = os.path.join(dir_p, name)
+        try:
+            entry = _PathEntry(path=entry_p, stat_result=os.lstat(entry_p))
+        except OSError:
+            return
+
+        uid = self.options.uid
+        gid = self.options.gid
+
+        if entry.is_dir(follow_symlinks=False) and not self.options.skip_sub_dir:
+
+            if self.options.max_depth is not None and record.depth >= self.options.max_depth:
+                return
+
+            reason, dir_key = self._examine_subdir(entry=entry, root_p=record.root_p)
+            if reason is None and not self._visit_dir(dir_key):
+                reason = "skipped_repeated_dirs"
+            record.entries[name] = (_DIR, reason)
+
+            if reason is not None:
+                self._increment(reason)
+                return
+
+            for _ in self._scan_directory(scan_dir=entry_p,
+                                          root_p=record.root_p,
+                                          uid=uid,
+                                          gid=gid,
+                                          depth=record.depth + 1):
+                pass
+            return
+
+        try:
+            reason, attrs = self._examine_file(file_p=entry_p,
+                                               root_p=record.root_p,
+                                               uid=uid,
+                                               gid=gid,
+                                               entry=entry,
+                                               dir_reason=self._dir_filter_reason(file_d=dir_p))
+        except OSError:
+            # Most likely changed again while it was being examined. The event for that change will try again.
+            return
+
+        record.entries[name] = (_FILE, self._apply_file_result(file_p=entry_p, reason=reason, attrs=attrs))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def scan_files(self,
+                   files_p,
+                   root_p):
+        """
+        Scan a specific list of files and store the metadata for every file.
+
+        With the batch_loose_files option, the files are grouped by directory, and a directory holding enough of them
+        is listed once instead of checking each of its files on its own. Whether a directory holds enough of them is
+        judged from its size, which tracks the number of entries on ext4, btrfs, and tmpfs but not on Lustre or on many
+        NFS servers, where even a huge directory is listed if it holds a few of the files (see _DIRENT_BYTES).
+
+        :param files_p:
+            A list, set, or tuple of files (with full paths).
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+
+        :return:
+            Nothing.
+        """
+
+        assert type(files_p) in [list, set, tuple]
+        assert type(root_p) is str
+
+        self._compile_filters()
+        self._cancel.clear()
+
+        if self.options.batch_loose_files:
+            progress = self._scan_files_batched(files_p=files_p, root_p=root_p)
+        else:
+            progress = self._scan_files_serial(files_p=files_p, root_p=root_p)
+
+        for checked_count in progress:
+            if self.stats_callback is not None:
+                self.stats_callback(checked_count, self.stats)
+            yield checked_count
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _scan_files_serial(self,
+                           files_p,
+                           root_p):
+        """
+        Scan a specific list of files one after the other, in the order given.
+
+        :param files_p:
+            A list, set, or tuple of files (with full paths).
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+
+        :return:
+            Nothing.
+        """
+
+        for file_p in files_p:
+
+            if self._cancel.is_set():
+                return
+
+            if os.path.islink(file_p):
+                self.skipped_links += 1
+                continue
+
+            self._scan_file(file_p=file_p, root_p=root_p, uid=self.options.uid, gid=self.options.gid)
+            if self.checked_count % self.options.report_frequency == 0:
+                yield self.checked_count
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _scan_files_batched(self,
+                            files_p,
+                            root_p):
+        """
+        Scan a specific list of files grouped by the directory they are in. A directory where the files make up a good
+        share of its entries is listed once and its files are examined from the listing (which already knows which
+        entries are symlinks and, with the direntry_metadata option, holds their stat results). The files in the
+        remaining directories are examined in jobs of several files each. With more than one scan thread, the listings
+        and jobs run on a pool of worker threads. Either way, this thread is the only one that modifies the counters
+        and the scan results, and every file is accounted for exactly as scan_files does it one file at a time.
+
+        :param files_p:
+            A list, set, or tuple of files (with full paths).
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+
+        :return:
+            Nothing.
+        """
+
+        uid = self.options.uid
+        gid = self.options.gid
+
+        groups = dict()
+        for file_p in files_p:
+            groups.setdefault(os.path.split(file_p)[0], list()).append(file_p)
+
+        jobs = list()
+        sparse = list()
+        for file_d in sorted(groups):
+            if len(groups[file_d]) >= _DENSE_GROUP_FILES:
+                jobs.append((self._examine_loose_dir, file_d, groups[file_d], root_p, uid, gid))
+            else:
+                sparse.extend(groups[file_d])
+        for start in range(0, len(sparse), _LOOSE_FILES_PER_JOB):
+            jobs.append((self._examine_loose_files, sparse[start:start + _LOOSE_FILES_PER_JOB], root_p, uid, gid))
+
+        if self.options.scan_threads > 1:
+            results = self._run_jobs_threaded(jobs=jobs)
+        else:
+            results = (job[0](*job[1:]) for job in jobs)
+
+        for examined in results:
+            if self._cancel.is_set():
+                return
+            for file_p, result in examined:
+                if result is None:
+                    self.skipped_links += 1
+                    continue
+                self._apply_file_result(file_p, *result)
+                if self.checked_count % self.options.report_frequency == 0:
+                    yield self.checked_count
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _run_jobs_threaded(self,
+                           jobs):
+        """
+        Runs a list of jobs on a pool of scan_threads worker threads, keeping the number of jobs waiting on the pool
+        bounded.
+
+        :param jobs:
+            A list of tuples, each holding a function followed by its arguments.
+
+        :return:
+            Nothing. Yields the value returned by each job, in the order they finish.
+        """
+
+        max_in_flight = self.options.scan_threads * 2
+        pending = iter(jobs)
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=self.options.scan_threads) as executor:
+
+            for job in pending:
+                in_flight.add(executor.submit(*job))
+                if len(in_flight) < max_in_flight:
+                    continue
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+            for future in as_completed(in_flight):
+                yield future.result()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _examine_loose_dir(self,
+                           file_d,
+                           files_p,
+                           root_p,
+                           uid,
+                           gid):
+        """
+        Examines several loose files that share a directory by listing the directory once, unless the directory is
+        large enough (judging by its size) that the files make up less than 1/_DENSE_GROUP_SHARE of its entries, in
+        which case they are examined one at a time. Files that are not in the listing (or the whole group, if the
+        directory cannot be listed) are examined one at a time too, which records the right error for each of them.
+        Does not modify any of the scan results.
+
+        Judging the directory by its size costs a stat of the directory, and is only meaningful on filesystems where
+        the size of a directory grows with its entries (see _DIRENT_BYTES). Elsewhere the directory is always listed.
+
+        :param file_d:
+            The directory holding the files.
+        :param files_p:
+            A list of full paths to files in that directory.
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+
+        :return:
+            A list of (path, result) tuples (see _examine_loose_file).
+        """
+
+        try:
+            dir_entries = os.stat(file_d or os.curdir).st_size // _DIRENT_BYTES
+        except OSError:
+            dir_entries = None
+        if dir_entries is None or len(files_p) * _DENSE_GROUP_SHARE < dir_entries:
+            return self._examine_loose_files(files_p=files_p, root_p=root_p, uid=uid, gid=gid)
+
+        stats = self.stats
+
+        wanted = dict()
+        for file_p in files_p:
+            wanted.setdefault(os.path.split(file_p)[1], list()).append(file_p)
+
+        found = list()
+        try:
+            if stats is not None:
+                started = time.perf_counter()
+            with os.scandir(file_d or os.curdir) as entries:
+                for entry in entries:
+                    paths = wanted.pop(entry.name, None)
+                    if paths is None:
+                        continue
+                    # Anything other than a file or a symlink (a directory passed in as a file, say) is left to be
+                    # examined on its own, the same way scan_files would.
+                    if entry.is_symlink() or entry.is_file(follow_symlinks=False):
+                        found.extend((file_p, entry) for file_p in paths)
+                    else:
+                        found.extend((file_p, None) for file_p in paths)
+                    if not wanted:
+                        break
+            if stats is not None:
+                stats.add_listing(file_d, time.perf_counter() - started)
+        except OSError:
+            pass
+
+        dir_reason = self._match_dir_filters(file_d=file_d)
+
+        examined = [(file_p, self._examine_loose_file(file_p=file_p,
+                                                      root_p=root_p,
+                                                      uid=uid,
+                                                      gid=gid,
+                                                      entry=entry,
+                                                      dir_reason=dir_reason if entry is not None else _UNCHECKED))
+                    for file_p, entry in found]
+        examined.extend(self._examine_loose_files(files_p=[file_p for paths in wanted.values() for file_p in paths],
+                                                  root_p=root_p,
+                                                  uid=uid,
+                                                  gid=gid))
+
+        return examined
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _examine_loose_files(self,
+                             files_p,
+                             root_p,
+                             uid,
+                             gid):
+        """
+        Examines several loose files one at a time. Does not modify any of the scan results.
+
+        :param files_p:
+            A list of full paths to files.
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+
+        :return:
+            A list of (path, result) tuples (see _examine_loose_file).
+        """
+
+        return [(file_p, self._examine_loose_file(file_p=file_p, root_p=root_p, uid=uid, gid=gid))
+                for file_p in files_p]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _examine_loose_file(self,
+                            file_p,
+                            root_p,
+                            uid,
+                            gid,
+                            entry=None,
+                            dir_reason=_UNCHECKED):
+        """
+        Examines a single loose file the way scan_files does: symlinks are skipped before anything else is checked (and
+        are not counted as checked files). Does not modify any of the scan results.
+
+        :param file_p:
+            A full path to the file.
+        :param root_p:
+            The root path against which a relative path for the file can be extracted.
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+        :param entry:
+            The os.DirEntry for the file if its directory was listed. None otherwise.
+        :param dir_reason:
+            The outcome of the directory filters for the file's directory, if already known (see _examine_file).
+
+        :return:
+            None if the file is a symlink. Otherwise the tuple returned by _examine_file.
+        """
+
+        if entry is not None:
+            if entry.is_symlink():
+                return None
+        elif os.path.islink(file_p):
+            return None
+
+        return self._examine_file(file_p=file_p, root_p=root_p, uid=uid, gid=gid, entry=entry, dir_reason=dir_reason)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _scan_file(self,
+                   file_p,
+                   root_p,
+                   uid,
+                   gid,
+                   entry=None):
+        """
+        Scan a single file and stores its metadata.
+
+        :param file_p:
+            A full path toa file to scan.
+        :param root_p:
+            The root path against which a relative path for the files can be extracted.
+        :param uid:
+            The user id of the user running the script
+        :param gid:
+            The group id of the user running the script
+        :param entry:
+            The os.DirEntry for the file if it came from os.scandir. None otherwise.
+
+        :return:
+            Nothing.
+        """
+
+        reason, attrs = self._examine_file(file_p=file_p, root_p=root_p, uid=uid, gid=gid, entry=entry)
+        self._apply_file_result(file_p=file_p, reason=reason, attrs=attrs)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def hash_files(self,
+                   cache_p=None,
+                   candidates_only=True,
+                   hash_threads=4,
+                   algorithm="blake2b"):
+        """
+        Hashes the contents of the files found by the scan, adding the hashes to their metadata: "partial_hash" for a
+        hash of the first and last 64 KB of a file, and "hash" for a hash of the whole file.
+
+        With candidates_only, only files that could have a duplicate are read. Files with a unique size (and empty
+        files) are not hashed at all. The rest are given a partial hash, and only the files that share both their size
+        and their partial hash are then hashed in full. Otherwise every file is hashed in full.
+
+        The files are read on a pool of threads. With a cache_p, hashes are also kept in a HashCache between runs, so a
+        file whose device, inode, size, and mtime have not changed is not read again.
+
+        When done, self.hash_report holds a HashReport with the number of files hashed and the read throughput. Files
+        that could not be read are listed in its failed set (and get no hashes).
+
+        This is a generator, like the scan methods: nothing is hashed until it is iterated, so calling it without
+        iterating over the result does nothing at all.
+
+        :param cache_p:
+            The path to a hash cache file. It is created if it does not exist. If None, no cache is used.
+        :param candidates_only:
+            If True, only hash files that share their size with another file, and only hash them in full if their
+            partial hashes match too.
+        :param hash_threads:
+            The number of threads reading files at once.
+        :param algorithm:
+            The name of the hashlib algorithm to use.
+
+        :return:
+            Nothing. Yields the number of files hashed so far (read or taken from the cache), every report_frequency
+            files.
+        """
+
+        assert cache_p is None or type(cache_p) is str
+        assert type(candidates_only) is bool
+        assert type(hash_threads) is int and hash_threads > 0
+        assert type(algorithm) is str
+
+        self.hash_report = HashReport()
+        started = time.perf_counter()
+
+        partial_digests = dict()
+        full_digests = dict()
+
+        cache = None if cache_p is None else HashCache(cache_p=cache_p, algorithm=algorithm)
+
+        try:
+            with ThreadPoolExecutor(max_workers=hash_threads) as executor:
+
+                if candidates_only:
+                    if self.size_index is not None:
+                        groups = self.size_index
+                    else:
+                        groups = dict()
+                        for file_p in list(self.files):
+                            try:
+                                metadata = self.file_metadata(file_p)
+                            except OSError:
+                                self.hash_report.failed.add(file_p)
+                                continue
+                            groups.setdefault(metadata["size"], list()).append(file_p)
+
+                    files_p = [file_p for size, paths in groups.items() if size and len(paths) > 1 for file_p in paths]
+                    yield from self._hash_stage(files_p=files_p,
+                                                partial=True,
+                                                algorithm=algorithm,
+                                                cache=cache,
+                                                executor=executor,
+                                                partial_digests=partial_digests,
+                                                full_digests=full_digests)
+
+                    groups = dict()
+                    for file_p, digest in partial_digests.items():
+                        groups.setdefault((self.files[file_p]["size"], digest), list()).append(file_p)
+                    files_p = [file_p for paths in groups.values() if len(paths) > 1
+                               for file_p in paths if file_p not in full_digests]
+
+                else:
+                    files_p = list(self.files)
+
+                yield from self._hash_stage(files_p=files_p,
+                                            partial=False,
+                                            algorithm=algorithm,
+                                            cache=cache,
+                                            executor=executor,
+                                            partial_digests=partial_digests,
+                                            full_digests=full_digests)
+
+            if cache is not None:
+                cache.connection.commit()
+
+        finally:
+            if cache is not None:
+                cache.close()
+            self.hash_report.seconds = time.perf_counter() - started
+
+        for file_p in partial_digests.keys() | full_digests.keys():
+            metadata = dict(self.files[file_p])
+            if file_p in partial_digests:
+                metadata["partial_hash"] = partial_digests[file_p]
+            if file_p in full_digests:
+                metadata["hash"] = full_digests[file_p]
+            self.files[file_p] = metadata
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _hash_stage(self,
+                    files_p,
+                    partial,
+                    algorithm,
+                    cache,
+                    executor,
+                    partial_digests,
+                    full_digests):
+        """
+        Hashes a list of files (partially or in full), taking whatever it can from the cache and reading the rest on
+        the executor's threads.
+
+        :param files_p:
+            A list of full paths to files in self.files.
+        :param partial:
+            If True, the files are given partial hashes. Otherwise full hashes.
+        :param algorithm:
+            The name of the hashlib algorithm to use.
+        :param cache:
+            A HashCache object, or None.
+        :param executor:
+            The ThreadPoolExecutor to read the files on.
+        :param partial_digests:
+            A dictionary of {path: partial hash} that is filled in as files are hashed.
+        :param full_digests:
+            A dictionary of {path: full hash} that is filled in as files are hashed (including files small enough for
+            their partial hash to cover the whole file).
+
+        :return:
+            Nothing. Yields the number of files hashed so far in the whole run (see hash_files), every report_frequency
+            files read in this stage.
+        """
+
+        report = self.hash_report
+        done = 0
+
+        futures = dict()
+        for file_p in files_p:
+
+            if cache is not None:
+                try:
+                    cached = cache.get(self._hash_key(file_p=file_p, metadata=self.files[file_p]))
+                except OSError:
+                    report.failed.add(file_p)
+                    continue
+
+                if cached is not None:
+                    cached_partial, cached_full = cached
+                    if cached_full is not None:
+                        full_digests[file_p] = cached_full
+                    if partial and cached_partial is not None:
+                        partial_digests[file_p] = cached_partial
+                        report.files_cached += 1
+                        continue
+                    if not partial and cached_full is not None:
+                        report.files_cached += 1
+                        continue
+
+            futures[executor.submit(hash_file, file_p, algorithm, partial)] = file_p
+
+        for future in as_completed(futures):
+
+            file_p = futures[future]
+            try:
+                digest, complete, bytes_read, key = future.result()
+            except OSError:
+                report.failed.add(file_p)
+                continue
+
+            report.files_hashed += 1
+            report.bytes_read += bytes_read
+
+            if partial:
+                partial_digests[file_p] = digest
+            if complete:
+                full_digests[file_p] = digest
+            if cache is not None:
+                cache.put(key=key,
+                          partial=digest if partial else None,
+                          full=digest if complete else None)
+
+            done += 1
+            if done % self.options.report_frequency == 0:
+                yield report.files_hashed + report.files_cached
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _hash_key(file_p,
+                  metadata):
+        """
+        Returns the key a file is stored under in a HashCache. The device and inode numbers come from the metadata when
+        the scan collected them. Otherwise the file is stat'ed.
+
+        :param file_p:
+            The full path to the file.
+        :param metadata:
+            The metadata for the file.
+
+        :return:
+            A tuple containing the device, inode, size, and mtime of the file.
+        """
+
+        if "st_ino" in metadata:
+            return metadata["st_dev"], metadata["st_ino"], metadata["size"], metadata["mtime"]
+
+        stat_result = os.lstat(file_p)
+        return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def save(self,
+             file_p):
+        """
+        Saves the results of this scan (the files, every counter and error set, and the options) to a versioned binary
+        file that ScanFiles.load can read back, so that other tools can reuse a scan instead of running it again. The
+        files are written in chunks, so saving needs little memory beyond the scan itself.
+
+        The file is made up of pickled sections that hold only plain python data (no classes), and load refuses to
+        unpickle anything else. The file is not signed or encrypted though: anyone who can write to it can change the
+        results it holds, so keep saved scans where only trusted users can write to them.
+
+        :param file_p:
+            The path to save to. It is overwritten if it exists.
+
+        :return:
+            The number of files saved.
+        """
+
+        assert type(file_p) is str
+
+        return write_scan(file_p=file_p, header=self._state_header(), files=self.files.items())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _state_header(self):
+        """
+        :return:
+            A dictionary holding everything that makes up the results of this scan other than the files (see save).
+        """
+
+        return {"options": asdict(self.options),
+                "counters": {attr: getattr(self, attr) for attr in _COUNTER_ATTRS},
+                "errors": {attr: set(getattr(self, attr)) for attr in _ERROR_SET_ATTRS},
+                "scanned_files": set(self.scanned_files),
+                "visited_dirs": set(self._visited_dirs),
+                "stats": None if self.stats is None else self.stats.to_dict()}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def load(cls,
+             file_p,
+             stats_callback=None):
+        """
+        Loads a scan saved by ScanFiles.save. The object returned is the same as the one that was saved (same options,
+        files, counters, and error sets), so it can be used in its place or scanned further. Loading takes roughly
+        1.5 seconds per million files (most of it spent building the metadata dictionaries). Use iter_saved_files to
+        work through a large scan without loading all of it.
+
+        Only plain python data is unpickled (a file that refers to any class or function is rejected with
+        pickle.UnpicklingError), so loading a file cannot run code. Its contents are otherwise taken as they are: only
+        load files from a source you trust to hold genuine scan results.
+
+        :param file_p:
+            The path to the saved scan.
+        :param stats_callback:
+            An optional stats callback for the new object (see __init__).
+
+        :return:
+            A new object of this class.
+        """
+
+        assert type(file_p) is str
+
+        # Loading creates millions of dictionaries and none of them can be garbage, so the cyclic garbage collector
+        # (which would otherwise run over and over as they pile up) is paused. This cuts the load time by about a third.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            return cls._load(file_p=file_p, stats_callback=stats_callback)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def _load(cls,
+              file_p,
+              stats_callback):
+        """
+        Does the work of load.
+
+        :param file_p:
+            The path to the saved scan.
+        :param stats_callback:
+            An optional stats callback for the new object (see __init__).
+
+        :return:
+            A new object of this class.
+        """
+
+        with open(file_p, "rb") as f:
+
+            header = read_header(f)
+
+            # Options added since the scan was saved keep their defaults. Options that no longer exist are dropped.
+            names = {option.name for option in fields(Options)}
+            options = Options(**{name: value for name, value in header["options"].items() if name in names})
+
+            scan_obj = cls(scan_options=options, stats_callback=stats_callback)
+            scan_obj._restore_state(header=header, f=f)
+
+        return scan_obj
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _restore_state(self,
+                       header,
+                       f):
+        """
+        Adds the results held in a saved scan to the results of this scan.
+
+        :param header:
+            The header of the saved scan (see _state_header).
+        :param f:
+            The saved scan file, opened for reading and positioned just after the header.
+
+        :return:
+            Nothing.
+        """
+
+        for attr, value in header["counters"].items():
+            setattr(self, attr, getattr(self, attr) + value)
+        for attr, paths in header["errors"].items():
+            getattr(self, attr).update(paths)
+        self.scanned_files.update(header["scanned_files"])
+        self._visited_dirs.update(header["visited_dirs"])
+        if self.stats is not None and header["stats"] is not None:
+            self.stats.merge(ScanStats.from_dict(header["stats"]))
+
+        # Unless something more than storing the file happens in _append_to_scan (the secondary indexes, or a subclass
+        # that overrides it), the files can be handed to the files dictionary in bulk.
+        bulk = self.size_index is None and type(self)._append_to_scan is ScanFiles._append_to_scan
+
+        for files in iter_files(f):
+            if self.options.collapse_hardlinks:
+                for file_p, metadata in files:
+                    self._file_inodes.setdefault((metadata["st_dev"], metadata["st_ino"]), file_p)
+            if bulk:
+                self.files.update(files)
+                continue
+            for file_p, metadata in files:
+                self._append_to_scan(file_path=file_p,
+                                     metadata=metadata)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def iter_saved_files(file_p):
+        """
+        Streams the files out of a scan saved by ScanFiles.save without loading the whole scan.
+
+        :param file_p:
+            The path to the saved scan.
+
+        :return:
+            Nothing. Yields lists of (path, metadata dictionary) tuples.
+        """
+
+        assert type(file_p) is str
+
+        with open(file_p, "rb") as f:
+            read_header(f)
+            yield from iter_files(f)
@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+import pickle
+
+from bvzscanfilesystem.savedscan import loads_plain
+from bvzscanfilesystem.sqlitefile import SQLiteFile
+
+# Bump this whenever the layout of the tables or of the pickled directory records changes. An index with a different
+# version is thrown away and rebuilt from scratch.
+INDEX_VERSION = 1
+
+# Options that only change how a scan is run, not what it finds. Changing these does not invalidate an index.
+_RUN_ONLY_OPTIONS = ("report_frequency",
+                     "scan_threads",
+                     "scan_processes",
+                     "compact_storage",
+                     "walk_order",
+                     "instrument",
+                     "batch_loose_files")
+
+
+@dataclass
+class ScanDelta:
+    """
+    The files that changed between the previous scan stored in a ScanIndex and the current one.
+    """
+    added: set = field(default_factory=set)
+    removed: set = field(default_factory=set)
+    modified: set = field(default_factory=set)
+
+
+class ScanIndex(SQLiteFile):
+    """
+    A persistent (SQLite) index of the results of a previous scan, stored one directory at a time. For every directory
+    it holds the directory's device, inode, and mtime at the time it was listed, together with a record of everything
+    that was found directly inside it: the metadata of the files that were kept, the files and subdirectories that
+    were skipped or caused errors (as counters and error sets), and the subdirectories that were descended into.
+
+    Since a directory's mtime changes whenever an entry is added, removed, or renamed inside it, a directory whose
+    device, inode, and mtime are unchanged can have its record reused without listing it again. Note that editing the
+    contents of an existing file does NOT change the mtime of its directory.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 index_p,
+                 options):
+        """
+        :param index_p:
+            The path to the index file. It is created if it does not exist.
+        :param options:
+            The options object of the scan that will use this index. If the filters differ from the ones the index was
+            built with, the index is cleared.
+        """
+
+        assert type(index_p) is str
+
+        super().__init__(file_p=index_p,
+                         tables={"dirs": "path TEXT PRIMARY KEY, "
+                                         "root TEXT, "
+                                         "st_dev INTEGER, "
+                                         "st_ino INTEGER, "
+                                         "mtime_ns INTEGER, "
+                                         "record BLOB"},
+                         settings={"version": str(INDEX_VERSION),
+                                   "options": self._options_signature(options)})
+
+        self.index_p = index_p
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _options_signature(options):
+        """
+        Returns a string that identifies the filter settings of an options object.
+
+        :param options:
+            The options object.
+
+        :return:
+            A string representation of every option that changes the results of a scan.
+        """
+
+        settings = asdict(options)
+        for name in _RUN_ONLY_OPTIONS:
+            settings.pop(name, None)
+
+        return repr(sorted(settings.items()))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def dir_paths(self):
+        """
+        :return:
+            A set of every directory stored in the index.
+        """
+
+        return {row[0] for row in self.connection.execute("SELECT path FROM dirs")}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def get_dir(self,
+                dir_p):
+        """
+        Returns the stored state of a single directory.
+
+        :param dir_p:
+            The full path to the directory.
+
+        :return:
+            A tuple containing the root path the directory was scanned under, its device, inode, mtime (in
+            nanoseconds), and its record. None if the directory is not in the index, or if its record holds anything
+            other than plain data (an index file may have been tampered with, and unpickling anything else could run
+            code), in which case the directory is listed again as if it had never been indexed.
+        """
+
+        row = self.connection.execute("SELECT root, st_dev, st_ino, mtime_ns, record FROM dirs WHERE path = ?",
+                                      (dir_p,)).fetchone()
+        if row is None:
+            return None
+
+        try:
+            record = loads_plain(row[4])
+        except (pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return None
+
+        return row[0], row[1], row[2], row[3], record
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def put_dir(self,
+                dir_p,
+                root_p,
+                st_dev,
+                st_ino,
+                mtime_ns,
+                record):
+        """
+        Stores the state of a single directory, replacing anything previously stored for it.
+
+        :param dir_p:
+            The full path to the directory.
+        :param root_p:
+            The root path the directory was scanned under.
+        :param st_dev:
+            The device the directory lives on.
+        :param st_ino:
+            The inode of the directory.
+        :param mtime_ns:
+            The mtime of the directory in nanoseconds, taken BEFORE the directory was listed.
+        :param record:
+            A dictionary describing the contents of the directory.
+
+        :return:
+            Nothing.
+        """
+
+        self.connection.execute("INSERT OR REPLACE INTO dirs (path, root, st_dev, st_ino, mtime_ns, record) "
+                                "VALUES (?, ?, ?, ?, ?, ?)",
+                                (dir_p, root_p, st_dev, st_ino, mtime_ns,
+                                 pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def remove_dirs(self,
+                    dirs_p):
+        """
+        Removes directories from the index.
+
+        :param dirs_p:
+            An iterable of full paths to directories.
+
+        :return:
+            Nothing.
+        """
+
+        self.connection.executemany("DELETE FROM dirs WHERE path = ?", ((dir_p,) for dir_p in dirs_p))
+
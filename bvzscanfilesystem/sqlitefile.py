@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+
+import sqlite3
+
+
+class SQLiteFile(object):
+    """
+    The shared base of the persistent (SQLite) files kept between scans (see ScanIndex and HashCache). Besides its own
+    tables, every file holds a meta table of settings (a version number, and whatever else its contents depend on). If
+    any stored setting differs from the current one when the file is opened, the other tables are emptied and the new
+    settings stored, so stale contents are never handed back.
+
+    Changes are committed when the file is used as a context manager and the block exits without an exception.
+    """
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __init__(self,
+                 file_p,
+                 tables,
+                 settings):
+        """
+        :param file_p:
+            The path to the file. It is created if it does not exist.
+        :param tables:
+            A dictionary of the tables the file holds (other than the meta table), with the name of each table as the
+            key and its column definitions (as used in CREATE TABLE) as the value.
+        :param settings:
+            A dictionary of the settings (as strings) the contents of the file depend on.
+        """
+
+        assert type(file_p) is str
+        assert type(tables) is dict
+        assert type(settings) is dict
+
+        self.connection = sqlite3.connect(file_p)
+
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        for table_n, columns in tables.items():
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table_n} ({columns})")
+
+        if any(self._get_meta(key) != value for key, value in settings.items()):
+            for table_n in tables:
+                self.connection.execute(f"DELETE FROM {table_n}")
+            for key, value in settings.items():
+                self._set_meta(key, value)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.commit()
+        self.close()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _get_meta(self,
+                  key):
+        """
+        :param key:
+            The key to look up in the meta table.
+
+        :return:
+            The value stored for the key. None if there is no such key.
+        """
+
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def _set_meta(self,
+                  key,
+                  value):
+        """
+        :param key:
+            The key to set in the meta table.
+        :param value:
+            The value to store.
+
+        :return:
+            Nothing.
+        """
+
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Closes the connection to the file. Anything not yet committed is discarded.
+
+        :return:
+            Nothing.
+        """
+
+        self.connection.close()
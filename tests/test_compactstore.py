@@ -0,0 +1,46 @@
+#! /usr/bin/env python3
+
+import unittest
+
+from bvzscanfilesystem.compactstore import CompactFileStore
+
+
+def metadata(file_p,
+             size):
+    """
+    :param file_p:
+        The path of the file.
+    :param size:
+        The size of the file.
+
+    :return:
+        A metadata dictionary shaped like the ones ScanFiles stores.
+    """
+
+    file_d, file_n = file_p.rsplit("/", 1)
+    return {"file_n": file_n, "file_d": file_d, "size": size, "mtime": 1.5, "islink": False}
+
+
+class CompactFileStoreTestCase(unittest.TestCase):
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_deleted_rows_are_reclaimed(self):
+        store = CompactFileStore()
+        expected = dict()
+
+        for generation in range(10):
+            for file_i in range(5000):
+                file_p = f"/data/g{generation}/f{file_i}.txt"
+                store[file_p] = expected[file_p] = metadata(file_p, file_i)
+            for file_i in range(0, 5000, 2 if generation % 2 else 1):
+                file_p = f"/data/g{generation}/f{file_i}.txt"
+                del store[file_p]
+                del expected[file_p]
+
+        self.assertEqual(dict(store), expected)
+        self.assertEqual(list(store), list(expected))
+        self.assertLess(len(store._row_name), 2 * len(store) + 5000)
+
+
+if __name__ == "__main__":
+    unittest.main()
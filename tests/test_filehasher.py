@@ -0,0 +1,162 @@
+#! /usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from bvzscanfilesystem.filehasher import hash_file
+from bvzscanfilesystem.filehasher import PARTIAL_BYTES
+from bvzscanfilesystem.options import Options
+from bvzscanfilesystem.scanfiles import ScanFiles
+
+# Large enough that a partial hash does not read the whole file.
+LARGE_SIZE = 3 * PARTIAL_BYTES
+
+
+class HashFilesTestCase(unittest.TestCase):
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def setUp(self):
+        self.root_p = tempfile.mkdtemp()
+        self.cache_p = self.root_p + ".hashes"
+        self.addCleanup(lambda: os.path.exists(self.cache_p) and os.remove(self.cache_p))
+
+        large = bytearray(b"x" * LARGE_SIZE)
+        middle_changed = bytearray(large)
+        middle_changed[LARGE_SIZE // 2] = ord("y")
+        start_changed = bytearray(large)
+        start_changed[0] = ord("y")
+
+        contents = {"unique.bin": b"u" * 100,
+                    "small_1.bin": b"s" * 50,
+                    "small_2.bin": b"s" * 50,
+                    "small_3.bin": b"t" * 50,
+                    "large_1.bin": large,
+                    "large_2.bin": large,
+                    "large_middle_changed.bin": middle_changed,
+                    "large_start_changed.bin": start_changed}
+
+        for file_n, data in contents.items():
+            self.write(file_n, data)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.root_p)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def write(self,
+              file_n,
+              data):
+        with open(os.path.join(self.root_p, file_n), "wb") as f:
+            f.write(data)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def hash(self,
+             **kwargs):
+        """
+        Scans the test directory and hashes the files, recording every file that is read.
+
+        :return:
+            A tuple containing the ScanFiles object and a sorted list of (file name, partial) tuples for every file that
+            was read.
+        """
+
+        scan_obj = ScanFiles(scan_options=Options())
+        for _ in scan_obj.scan_directories([self.root_p]):
+            pass
+
+        with mock.patch("bvzscanfilesystem.scanfiles.hash_file", wraps=hash_file) as reads:
+            for _ in scan_obj.hash_files(**kwargs):
+                pass
+
+        return scan_obj, sorted((os.path.split(args[0])[1], args[2]) for args, _ in reads.call_args_list)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def hashes(self,
+               scan_obj):
+        """
+        :return:
+            A dictionary of {file name: (partial hash, hash)} for every file in the scan.
+        """
+
+        return {metadata["file_n"]: (metadata.get("partial_hash"), metadata.get("hash"))
+                for metadata in scan_obj.files.values()}
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_only_candidates_are_read(self):
+        scan_obj, reads = self.hash()
+
+        # Files with a unique size are never read. Small files are read in full by their partial hash, so only the
+        # large files whose partial hashes match are read a second time.
+        self.assertEqual(reads, [("large_1.bin", False),
+                                 ("large_1.bin", True),
+                                 ("large_2.bin", False),
+                                 ("large_2.bin", True),
+                                 ("large_middle_changed.bin", False),
+                                 ("large_middle_changed.bin", True),
+                                 ("large_start_changed.bin", True),
+                                 ("small_1.bin", True),
+                                 ("small_2.bin", True),
+                                 ("small_3.bin", True)])
+
+        hashes = self.hashes(scan_obj)
+        self.assertEqual(hashes["unique.bin"], (None, None))
+        self.assertIsNone(hashes["large_start_changed.bin"][1])
+        self.assertEqual(hashes["large_1.bin"], hashes["large_2.bin"])
+        self.assertEqual(hashes["large_1.bin"][0], hashes["large_middle_changed.bin"][0])
+        self.assertNotEqual(hashes["large_1.bin"][1], hashes["large_middle_changed.bin"][1])
+        self.assertEqual(hashes["small_1.bin"][0], hashes["small_1.bin"][1])
+        self.assertEqual(hashes["small_1.bin"], hashes["small_2.bin"])
+        self.assertNotEqual(hashes["small_1.bin"], hashes["small_3.bin"])
+
+        self.assertEqual(scan_obj.hash_report.files_hashed, len(reads))
+        self.assertEqual(scan_obj.hash_report.bytes_read, 4 * 2 * PARTIAL_BYTES + 3 * LARGE_SIZE + 3 * 50)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_every_file_without_candidates_only(self):
+        scan_obj, reads = self.hash(candidates_only=False)
+
+        self.assertEqual(reads, sorted((file_n, False) for file_n in os.listdir(self.root_p)))
+        for partial_hash, full_hash in self.hashes(scan_obj).values():
+            self.assertIsNone(partial_hash)
+            self.assertIsNotNone(full_hash)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_unchanged_files_are_not_read_again(self):
+        first_obj, _ = self.hash(cache_p=self.cache_p)
+
+        scan_obj, reads = self.hash(cache_p=self.cache_p)
+        self.assertEqual(reads, [])
+        self.assertEqual(self.hashes(scan_obj), self.hashes(first_obj))
+        self.assertEqual(scan_obj.hash_report.files_hashed, 0)
+        # Each file is counted once, even when both of its hashes come from the cache.
+        self.assertEqual(scan_obj.hash_report.files_cached, 7)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_modified_file_is_read_again(self):
+        first_obj, _ = self.hash(cache_p=self.cache_p)
+
+        # Change the middle of the file (so its partial hash still matches) and move its mtime on.
+        large_p = os.path.join(self.root_p, "large_1.bin")
+        data = bytearray(b"x" * LARGE_SIZE)
+        data[LARGE_SIZE // 2 + 1] = ord("z")
+        self.write("large_1.bin", data)
+        os.utime(large_p, (os.stat(large_p).st_atime, os.stat(large_p).st_mtime + 10))
+
+        scan_obj, reads = self.hash(cache_p=self.cache_p)
+        self.assertEqual(reads, [("large_1.bin", False), ("large_1.bin", True)])
+
+        hashes = self.hashes(scan_obj)
+        first_hashes = self.hashes(first_obj)
+        self.assertEqual(hashes["large_1.bin"][0], first_hashes["large_1.bin"][0])
+        self.assertNotEqual(hashes["large_1.bin"][1], first_hashes["large_1.bin"][1])
+        self.assertNotEqual(hashes["large_1.bin"][1], hashes["large_2.bin"][1])
+        del hashes["large_1.bin"]
+        del first_hashes["large_1.bin"]
+        self.assertEqual(hashes, first_hashes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+
+import fnmatch
+import random
+import unittest
+
+from bvzscanfilesystem.queryindex import Query
+from bvzscanfilesystem.queryindex import QueryIndex
+
+
+def make_files(count=3000,
+               seed=5):
+    """
+    Builds a {path: metadata} dictionary of made up files, spread over nested directories with a few extensions. Some
+    of the files only hold the attributes stored in lazy mode (no size or mtime).
+
+    :param count:
+        The number of files.
+    :param seed:
+        The seed of the random numbers used to pick the paths, sizes, and mtimes.
+
+    :return:
+        The dictionary.
+    """
+
+    rand = random.Random(seed)
+    dirs = ["/data", "/data/a", "/data/ab", "/data/a/b", "/data/a/b/c", "/data/archive", "/other"]
+    extensions = [".exr", ".txt", ".tmp", ".exr.bak", ""]
+
+    files = dict()
+    while len(files) < count:
+        file_d = rand.choice(dirs)
+        file_n = f"f{rand.randrange(2000)}{rand.choice(extensions)}"
+        metadata = {"file_n": file_n, "file_d": file_d}
+        if rand.random() > 0.05:
+            metadata["size"] = rand.randrange(5000)
+            metadata["mtime"] = rand.randrange(1000) + rand.random()
+        files[f"{file_d}/{file_n}"] = metadata
+
+    return files
+
+
+class QueryIndexTestCase(unittest.TestCase):
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def setUp(self):
+        self.files = make_files()
+        self.index = QueryIndex(self.files)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def assertQuery(self,
+                    query,
+                    keep):
+        """
+        Checks that a query holds exactly the files a brute force pass over all of them would keep, in sorted order.
+        """
+
+        expected = sorted(file_p for file_p, metadata in self.files.items() if keep(file_p, metadata))
+        self.assertEqual(list(query), expected)
+        self.assertEqual(len(query), len(expected))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_all(self):
+        self.assertEqual(len(self.index), len(self.files))
+        self.assertQuery(self.index.all(), lambda file_p, metadata: True)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_under(self):
+        for dir_p in ("/data", "/data/a", "/data/a/", "/data/a/b/c", "/data/missing", "/"):
+            prefix = dir_p.rstrip("/") + "/"
+            self.assertQuery(self.index.under(dir_p), lambda file_p, metadata: file_p.startswith(prefix))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_glob(self):
+        patterns = ("*.exr",
+                    "*",
+                    "/data/a/*",
+                    "/data/a/*/f1?.txt",
+                    "*[0-9].tmp",
+                    "/data/[!a]*",
+                    "/other/f1*.exr.bak",
+                    "*.missing",
+                    next(iter(self.files)))
+        for pattern in patterns:
+            self.assertQuery(self.index.glob(pattern),
+                             lambda file_p, metadata: fnmatch.fnmatchcase(file_p, pattern))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_size(self):
+        for min_size, max_size in ((None, None), (100, None), (None, 100), (100, 200), (200, 100), (4999, 4999)):
+            self.assertQuery(self.index.size(min_size=min_size, max_size=max_size),
+                             lambda file_p, metadata: ("size" in metadata and
+                                                       (min_size is None or metadata["size"] >= min_size) and
+                                                       (max_size is None or metadata["size"] <= max_size)))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_mtime(self):
+        for min_mtime, max_mtime in ((None, None), (500, None), (None, 10.5), (100, 101), (300.25, 900.75)):
+            self.assertQuery(self.index.mtime(min_mtime=min_mtime, max_mtime=max_mtime),
+                             lambda file_p, metadata: ("mtime" in metadata and
+                                                       (min_mtime is None or metadata["mtime"] >= min_mtime) and
+                                                       (max_mtime is None or metadata["mtime"] <= max_mtime)))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_combinations(self):
+        index = self.index
+
+        # Each query paired with the brute force test for the same files.
+        queries = {"under": (index.under("/data/a"),
+                             lambda file_p, metadata: file_p.startswith("/data/a/")),
+                   "glob": (index.glob("*.exr"),
+                            lambda file_p, metadata: file_p.endswith(".exr")),
+                   "narrow glob": (index.glob("/data/ab/f1*"),
+                                   lambda file_p, metadata: file_p.startswith("/data/ab/f1")),
+                   "size": (index.size(min_size=1000),
+                            lambda file_p, metadata: metadata.get("size", -1) >= 1000),
+                   "mtime": (index.mtime(max_mtime=100.0),
+                             lambda file_p, metadata: metadata.get("mtime", 1e9) <= 100.0),
+                   "all": (index.all(),
+                           lambda file_p, metadata: True)}
+
+        for name_a, (query_a, keep_a) in queries.items():
+            for name_b, (query_b, keep_b) in queries.items():
+                with self.subTest(a=name_a, b=name_b):
+                    self.assertQuery(query_a & query_b,
+                                     lambda file_p, metadata: keep_a(file_p, metadata) and keep_b(file_p, metadata))
+                    self.assertQuery(query_a | query_b,
+                                     lambda file_p, metadata: keep_a(file_p, metadata) or keep_b(file_p, metadata))
+                    self.assertQuery(query_a - query_b,
+                                     lambda file_p, metadata: keep_a(file_p, metadata) and not keep_b(file_p, metadata))
+
+        under, under_keep = queries["under"]
+        glob, glob_keep = queries["glob"]
+        size, size_keep = queries["size"]
+        mtime, mtime_keep = queries["mtime"]
+
+        self.assertQuery((under & glob) & (size & mtime),
+                         lambda *file: (under_keep(*file) and glob_keep(*file)
+                                        and size_keep(*file) and mtime_keep(*file)))
+        self.assertQuery((under | glob) & size - mtime,
+                         lambda *file: (under_keep(*file) or glob_keep(*file)) and size_keep(*file)
+                         and not mtime_keep(*file))
+        self.assertQuery(under - (glob | size) | mtime & glob,
+                         lambda *file: (under_keep(*file) and not (glob_keep(*file) or size_keep(*file)))
+                         or (mtime_keep(*file) and glob_keep(*file)))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_incomplete_query_is_refused(self):
+
+        class NoContains(Query):
+
+            def _estimate(self):
+                return 0
+
+            def _candidates(self):
+                return ()
+
+        with self.assertRaises(TypeError):
+            NoContains(self.index)
+
+
+if __name__ == "__main__":
+    unittest.main()
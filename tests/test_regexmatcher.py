@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+
+import re
+import unittest
+
+from bvzscanfilesystem.regexmatcher import RegexMatcher
+
+# The strings every pattern is run against.
+ITEMS = ("",
+         "\n",
+         "foo",
+         "foo\n",
+         "foo\nbar",
+         "xfoo",
+         "xfoo\n",
+         "foox",
+         "FOO",
+         "Foo.Tmp",
+         "file.tmp",
+         "file.tmp\n",
+         "file.tmp.bak",
+         "filextmp",
+         "price$",
+         "$price",
+         "a^b",
+         "^cache",
+         "cache/data",
+         "abab",
+         "abba",
+         "a.b\\c",
+         "/mnt/show/.hidden/file.exr")
+
+
+class RegexMatcherTestCase(unittest.TestCase):
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def assertSearchesLikeRe(self,
+                             regexes):
+        matcher = RegexMatcher(regexes)
+        for item in ITEMS:
+            expected = any(re.search(regex, item) is not None for regex in regexes)
+            self.assertEqual(matcher.search(item), expected, f"{regexes!r} searching {item!r}")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def assertEachSearchesLikeRe(self,
+                                 regexes):
+        for regex in regexes:
+            self.assertSearchesLikeRe([regex])
+        self.assertSearchesLikeRe(regexes)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_literals(self):
+        self.assertEachSearchesLikeRe(["foo", "tmp", "cache/", "\\.tmp", "a\\.b\\\\c", ""])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_anchored_literals(self):
+        self.assertEachSearchesLikeRe(["^foo", "foo$", "^foo$", "\\.tmp$", "^/mnt/show", "^", "$", "^$"])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_end_anchor_before_trailing_newline(self):
+        matcher = RegexMatcher(["foo$", "^file\\.tmp$"])
+        self.assertTrue(matcher.search("xfoo\n"))
+        self.assertTrue(matcher.search("file.tmp\n"))
+        self.assertFalse(matcher.search("foo\nbar"))
+        self.assertFalse(matcher.search("file.tmp\n\n"))
+        self.assertEachSearchesLikeRe(["foo$", "^foo$", "^$", "\n$"])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_escaped_anchors(self):
+        self.assertEachSearchesLikeRe(["\\$", "e\\$", "\\$price", "\\^cache", "^\\^", "a\\^b", "\\\\$", "\\\\\\$"])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_patterns(self):
+        self.assertEachSearchesLikeRe(["f.o", "\\.(tmp|bak)$", "^[a-z]+$", "\\bfoo\\b", "\\d", "o{2}", "x?foo\\Z"])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_inline_flags(self):
+        self.assertEachSearchesLikeRe(["(?i)foo", "(?i)^file\\.TMP$", "(?m)^bar", "(?s)foo.bar", "(?i:f)oo$", "tmp"])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_ignorecase(self):
+        # Regexes are given as strings, so re.IGNORECASE is asked for with an inline (?i).
+        matcher = RegexMatcher(["(?i)foo$", "(?i)\\.tmp"])
+        for item in ITEMS:
+            expected = any(re.search(regex, item, re.IGNORECASE) is not None for regex in ["foo$", "\\.tmp"])
+            self.assertEqual(matcher.search(item), expected, item)
+        self.assertTrue(matcher.search("Foo.Tmp"))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_groups_and_backreferences(self):
+        regexes = ["(a)b\\1", "(?P<x>b)\\1", "(ab)\\1", "f(o)o", "cache"]
+        self.assertEachSearchesLikeRe(regexes)
+
+        # Backreferences count the groups of the whole pattern, so merging these into the alternation would break them.
+        matcher = RegexMatcher(regexes)
+        self.assertEqual([compiled.pattern for compiled in matcher._compiled], regexes[:4])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_flags_are_not_merged(self):
+        matcher = RegexMatcher(["f.o", "(?i)bar", "b.z"])
+        self.assertEqual([compiled.pattern for compiled in matcher._compiled], ["(?:f.o)|(?:b.z)", "(?i)bar"])
+        self.assertSearchesLikeRe(["f.o", "(?i)FOO\\n", "b.z"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+#! /usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bvzscanfilesystem import savedscan
+from bvzscanfilesystem.scandiff import ADDED
+from bvzscanfilesystem.scandiff import diff_scans
+from bvzscanfilesystem.scandiff import MODIFIED
+from bvzscanfilesystem.scandiff import MOVED
+from bvzscanfilesystem.scandiff import REMOVED
+
+
+def metadata(file_p,
+             size,
+             mtime,
+             st_ino,
+             root_p="/data"):
+    """
+    :param file_p:
+        The path of the file.
+    :param size:
+        The size of the file.
+    :param mtime:
+        The mtime of the file.
+    :param st_ino:
+        The inode of the file. None to leave the device and inode out.
+    :param root_p:
+        The root the file was scanned under.
+
+    :return:
+        A metadata dictionary shaped like the ones ScanFiles stores.
+    """
+
+    file_d, file_n = os.path.split(file_p)
+    output = {"file_n": file_n,
+              "file_d": file_d,
+              "rel_p": os.path.relpath(file_p, root_p),
+              "size": size,
+              "mtime": mtime,
+              "islink": False}
+
+    if st_ino is not None:
+        output["st_dev"] = 1
+        output["st_ino"] = st_ino
+
+    return output
+
+
+def make_scans():
+    """
+    :return:
+        An old and a new {path: metadata} dictionary, between which files were added, removed, modified, and moved.
+    """
+
+    old = {"/data/same.txt": metadata("/data/same.txt", 10, 1.0, 1),
+           "/data/edited.txt": metadata("/data/edited.txt", 10, 1.0, 2),
+           "/data/touched.txt": metadata("/data/touched.txt", 10, 1.0, 3),
+           "/data/gone.txt": metadata("/data/gone.txt", 10, 1.0, 4),
+           "/data/a/moved.txt": metadata("/data/a/moved.txt", 20, 2.0, 5),
+           "/data/a/renamed.txt": metadata("/data/a/renamed.txt", 30, 3.0, 6),
+           "/data/a/moved_and_edited.txt": metadata("/data/a/moved_and_edited.txt", 40, 4.0, 7),
+           "/data/reused.txt": metadata("/data/reused.txt", 50, 5.0, 8),
+           "/data/lazy_gone.txt": {"file_n": "lazy_gone.txt", "file_d": "/data", "rel_p": "lazy_gone.txt"}}
+
+    new = {"/data/same.txt": metadata("/data/same.txt", 10, 1.0, 1),
+           "/data/edited.txt": metadata("/data/edited.txt", 11, 1.0, 2),
+           "/data/touched.txt": metadata("/data/touched.txt", 10, 9.0, 3),
+           "/data/b/moved.txt": metadata("/data/b/moved.txt", 20, 2.0, 5),
+           "/data/a/new_name.txt": metadata("/data/a/new_name.txt", 30, 3.0, 6),
+           "/data/b/moved_and_edited.txt": metadata("/data/b/moved_and_edited.txt", 41, 4.0, 7),
+           "/data/unrelated.txt": metadata("/data/unrelated.txt", 60, 6.0, 8),
+           "/data/added.txt": metadata("/data/added.txt", 70, 7.0, 9),
+           "/data/lazy_added.txt": {"file_n": "lazy_added.txt", "file_d": "/data", "rel_p": "lazy_added.txt"}}
+
+    return old, new
+
+
+class DiffScansTestCase(unittest.TestCase):
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def setUp(self):
+        self.temp_d = tempfile.mkdtemp()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.temp_d)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def save(self,
+             files,
+             name):
+        """
+        :param files:
+            A {path: metadata} dictionary.
+        :param name:
+            The name of the file to save the scan to.
+
+        :return:
+            The path of the saved scan.
+        """
+
+        saved_p = os.path.join(self.temp_d, name)
+        savedscan.write_scan(saved_p, header={}, files=files.items())
+        return saved_p
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def assertSameDiffEverywhere(self,
+                                 old,
+                                 new,
+                                 expected,
+                                 **kwargs):
+        """
+        Diffs the scans in memory, on disk with several numbers of partitions, and with either or both of them saved,
+        and checks that every one of them yields the expected changes.
+        """
+
+        old_p = self.save(old, "old.scan")
+        new_p = self.save(new, "new.scan")
+
+        runs = {"memory": diff_scans(old, new, **kwargs),
+                "mixed old": diff_scans(old_p, new, temp_d=self.temp_d, **kwargs),
+                "mixed new": diff_scans(old, new_p, temp_d=self.temp_d, **kwargs),
+                "saved": diff_scans(old_p, new_p, temp_d=self.temp_d, **kwargs)}
+        for partitions in (1, 3, 128):
+            runs[f"{partitions} partitions"] = diff_scans(old, new, partitions=partitions, temp_d=self.temp_d, **kwargs)
+
+        for name, changes in runs.items():
+            changes = list(changes)
+            self.assertEqual(len(changes), len(set(changes)), name)
+            self.assertEqual(set(changes), expected, name)
+
+        # Nothing is left behind in the temporary directory.
+        self.assertEqual(sorted(os.listdir(self.temp_d)), ["new.scan", "old.scan"])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_changes(self):
+        old, new = make_scans()
+        expected = {(MODIFIED, "/data/edited.txt", None),
+                    (MODIFIED, "/data/touched.txt", None),
+                    (REMOVED, "/data/gone.txt", None),
+                    (MOVED, "/data/b/moved.txt", "/data/a/moved.txt"),
+                    (MOVED, "/data/a/new_name.txt", "/data/a/renamed.txt"),
+                    (REMOVED, "/data/a/moved_and_edited.txt", None),
+                    (ADDED, "/data/b/moved_and_edited.txt", None),
+                    (REMOVED, "/data/reused.txt", None),
+                    (ADDED, "/data/unrelated.txt", None),
+                    (ADDED, "/data/added.txt", None),
+                    (REMOVED, "/data/lazy_gone.txt", None),
+                    (ADDED, "/data/lazy_added.txt", None)}
+
+        self.assertSameDiffEverywhere(old, new, expected)
+        self.assertSameDiffEverywhere(old, new, expected, move_key="size_mtime")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_no_moves(self):
+        old, new = make_scans()
+        expected = {(MODIFIED, "/data/edited.txt", None),
+                    (MODIFIED, "/data/touched.txt", None)}
+        expected.update((REMOVED, old_p, None) for old_p in old if old_p not in new)
+        expected.update((ADDED, new_p, None) for new_p in new if new_p not in old)
+
+        self.assertSameDiffEverywhere(old, new, expected, move_key=None)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_moves_without_inodes(self):
+        old = {f"/data/a/copy{file_i}.txt": metadata(f"/data/a/copy{file_i}.txt", 10, 1.0, None) for file_i in range(3)}
+        new = {"/data/b/copy1.txt": metadata("/data/b/copy1.txt", 10, 1.0, None),
+               "/data/b/other.txt": metadata("/data/b/other.txt", 10, 1.0, None)}
+
+        # Files with the same name are paired first, then the rest in path order.
+        expected = {(MOVED, "/data/b/copy1.txt", "/data/a/copy1.txt"),
+                    (MOVED, "/data/b/other.txt", "/data/a/copy0.txt"),
+                    (REMOVED, "/data/a/copy2.txt", None)}
+
+        self.assertSameDiffEverywhere(old, new, expected)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_rescan_from_another_root(self):
+        old, _ = make_scans()
+        new = {file_p: dict(old_metadata, rel_p=os.path.relpath(file_p, "/")) for file_p, old_metadata in old.items()}
+        new["/data/same.txt"] = dict(new["/data/same.txt"], ctime=5.0)
+
+        # Only attributes held by both scans are compared, and not the ones worked out from the path.
+        self.assertSameDiffEverywhere(old, new, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,413 @@
+#! /usr/bin/env python3
+
+import asyncio
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from bvzscanfilesystem import inotify
+from bvzscanfilesystem import savedscan
+from bvzscanfilesystem.options import Options
+from bvzscanfilesystem.scanfiles import ScanFiles
+
+# The counters and error sets compared between two scans that should have found the same thing.
+COUNTERS = ("initial_count",
+            "checked_count",
+            "skipped_links",
+            "error_count",
+            "skipped_zero_len",
+            "skipped_hidden_files",
+            "skipped_hidden_dirs",
+            "skipped_exclude_dirs",
+            "skipped_include_dirs",
+            "skipped_exclude_files",
+            "skipped_include_files",
+            "skipped_repeated_dirs",
+            "skipped_other_fs_dirs",
+            "skipped_hardlinks")
+
+ERROR_SETS = ("file_permission_err_files",
+              "dir_permission_err_dirs",
+              "file_not_found_err_files",
+              "dir_not_found_err_dirs",
+              "dir_generic_err_dirs",
+              "file_generic_err_files")
+
+# Options that make a scan of a tree built by make_varied_tree skip something for every reason it can.
+VARIED_OPTIONS = {"skip_hidden_files": True,
+                  "skip_hidden_dirs": True,
+                  "excl_dir_regexes": ["excluded"],
+                  "excl_file_regexes": ["\\.tmp$"]}
+
+
+def make_tree(root_p,
+              width=3,
+              depth=3,
+              files=4):
+    """
+    Builds a small tree of directories, each holding a few non-empty files.
+
+    :param root_p:
+        The directory to build the tree in.
+    :param width:
+        The number of subdirectories in each directory.
+    :param depth:
+        The number of levels of subdirectories.
+    :param files:
+        The number of files in each directory.
+
+    :return:
+        Nothing.
+    """
+
+    for file_i in range(files):
+        with open(os.path.join(root_p, f"f{file_i}.txt"), "w") as f:
+            f.write("x" * (file_i + 1))
+
+    if depth:
+        for dir_i in range(width):
+            dir_p = os.path.join(root_p, f"d{dir_i}")
+            os.mkdir(dir_p)
+            make_tree(dir_p, width=width, depth=depth - 1, files=files)
+
+
+def make_varied_tree(root_p):
+    """
+    Builds a small tree (see make_tree) that also holds hidden files and directories, empty files, symlinks to files
+    and directories, an unreadable file, and files and directories that VARIED_OPTIONS exclude by name.
+
+    :param root_p:
+        The directory to build the tree in.
+
+    :return:
+        Nothing.
+    """
+
+    make_tree(root_p, width=3, depth=3, files=3)
+
+    for dir_p in (os.path.join(root_p, ".hidden"), os.path.join(root_p, "d1", "excluded")):
+        os.mkdir(dir_p)
+        make_tree(dir_p, width=1, depth=1, files=2)
+
+    for file_p in (os.path.join(root_p, ".hidden.txt"), os.path.join(root_p, "d0", "d2", "scratch.tmp")):
+        with open(file_p, "w") as f:
+            f.write("skipped")
+
+    open(os.path.join(root_p, "d2", "empty.txt"), "w").close()
+
+    unreadable_p = os.path.join(root_p, "d0", "unreadable.txt")
+    with open(unreadable_p, "w") as f:
+        f.write("unreadable")
+    os.chmod(unreadable_p, 0)
+
+    os.symlink(os.path.join(root_p, "f0.txt"), os.path.join(root_p, "d1", "file_link.txt"))
+    os.symlink(os.path.join(root_p, "d2"), os.path.join(root_p, "d0", "dir_link"))
+
+
+def scan(scan_dirs,
+         **options):
+    """
+    :param scan_dirs:
+        The directories to scan.
+    :param options:
+        Any options to set.
+
+    :return:
+        The ScanFiles object, after scanning the directories.
+    """
+
+    scan_obj = ScanFiles(scan_options=Options(**options))
+    for _ in scan_obj.scan_directories(scan_dirs):
+        pass
+
+    return scan_obj
+
+
+class ScanFilesTestCase(unittest.TestCase):
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def setUp(self):
+        self.root_p = tempfile.mkdtemp()
+        make_tree(self.root_p, width=2, depth=5, files=2)
+
+        # Deep enough to sit inside one of the shards handed to a worker when scanning with multiple processes.
+        self.nested_roots = [self.root_p, os.path.join(self.root_p, "d0", "d1", "d0", "d1")]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.root_p)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def assertSameScan(self,
+                       scan_obj,
+                       expected_obj):
+        self.assertEqual({attr: getattr(scan_obj, attr) for attr in COUNTERS + ERROR_SETS},
+                         {attr: getattr(expected_obj, attr) for attr in COUNTERS + ERROR_SETS})
+        self.assertEqual(dict(scan_obj.files), dict(expected_obj.files))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def make_varied_tree(self):
+        """
+        :return:
+            The path to a tree built by make_varied_tree, which is removed along with the rest of the test directory.
+        """
+
+        varied_p = os.path.join(self.root_p, "varied")
+        os.mkdir(varied_p)
+        make_varied_tree(varied_p)
+        return varied_p
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_threaded_scan(self):
+        varied_p = self.make_varied_tree()
+        expected_obj = scan([varied_p], **VARIED_OPTIONS)
+        for attr in ("skipped_links",
+                     "skipped_zero_len",
+                     "skipped_hidden_files",
+                     "skipped_hidden_dirs",
+                     "skipped_exclude_dirs",
+                     "skipped_exclude_files",
+                     "file_permission_err_files"):
+            self.assertTrue(getattr(expected_obj, attr), attr)
+
+        for scan_threads in (2, 8):
+            for direntry_metadata in (False, True):
+                with self.subTest(scan_threads=scan_threads, direntry_metadata=direntry_metadata):
+                    scan_obj = scan([varied_p],
+                                    scan_threads=scan_threads,
+                                    direntry_metadata=direntry_metadata,
+                                    **VARIED_OPTIONS)
+                    self.assertSameScan(scan_obj,
+                                        scan([varied_p], direntry_metadata=direntry_metadata, **VARIED_OPTIONS))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_walk_orders(self):
+        varied_p = self.make_varied_tree()
+        expected_obj = scan([varied_p], **VARIED_OPTIONS)
+
+        for walk_order in ("breadth", "inode"):
+            for scan_threads in (1, 4):
+                with self.subTest(walk_order=walk_order, scan_threads=scan_threads):
+                    scan_obj = scan([varied_p], walk_order=walk_order, scan_threads=scan_threads, **VARIED_OPTIONS)
+                    self.assertSameScan(scan_obj, expected_obj)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_max_depth(self):
+        full_obj = scan([self.root_p])
+
+        for max_depth in (0, 1, 3, 5):
+            expected_files = {file_p: metadata for file_p, metadata in full_obj.files.items()
+                              if metadata["rel_p"].count(os.sep) <= max_depth}
+            expected_obj = scan([self.root_p], max_depth=max_depth)
+            self.assertEqual(dict(expected_obj.files), expected_files)
+            self.assertEqual(expected_obj.checked_count, len(expected_files))
+
+            for walk_order in ("breadth", "inode"):
+                for scan_threads in (1, 4):
+                    with self.subTest(max_depth=max_depth, walk_order=walk_order, scan_threads=scan_threads):
+                        scan_obj = scan([self.root_p],
+                                        max_depth=max_depth,
+                                        walk_order=walk_order,
+                                        scan_threads=scan_threads)
+                        self.assertSameScan(scan_obj, expected_obj)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_lazy_metadata(self):
+        varied_p = self.make_varied_tree()
+
+        for paths_only in (True, False):
+            options = dict(VARIED_OPTIONS)
+            if paths_only:
+                options.update(skip_zero_len=False, check_read_permissions=False)
+            expected_obj = scan([varied_p], direntry_metadata=True, **options)
+
+            for scan_threads in (1, 4):
+                with self.subTest(paths_only=paths_only, scan_threads=scan_threads):
+                    scan_obj = scan([varied_p], lazy_metadata=True, scan_threads=scan_threads, **options)
+                    self.assertEqual({attr: getattr(scan_obj, attr) for attr in COUNTERS + ERROR_SETS},
+                                     {attr: getattr(expected_obj, attr) for attr in COUNTERS + ERROR_SETS})
+                    self.assertEqual(set(scan_obj.files), set(expected_obj.files))
+
+                    if paths_only:
+                        for metadata in scan_obj.files.values():
+                            self.assertEqual(set(metadata), {"file_n", "file_d", "rel_p"})
+
+                    for file_p, metadata in expected_obj.files.items():
+                        self.assertEqual(scan_obj.file_metadata(file_p), metadata)
+                    self.assertEqual(dict(scan_obj.files), dict(expected_obj.files))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_nested_roots_multiprocess(self):
+        expected_obj = scan(self.nested_roots)
+        self.assertEqual(expected_obj.skipped_repeated_dirs, 1)
+
+        scan_obj = scan(self.nested_roots, scan_processes=2)
+        self.assertSameScan(scan_obj, expected_obj)
+        self.assertEqual(scan_obj.checked_count, len(scan_obj.files))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    @unittest.skipUnless(inotify.available(), "inotify is not available")
+    def test_watch_rename_deep_tree(self):
+        deep_p = os.path.join(self.root_p, "deep")
+        dir_p = deep_p
+        for _ in range(700):
+            dir_p = os.path.join(dir_p, "d")
+        os.makedirs(dir_p)
+        with open(os.path.join(dir_p, "leaf.txt"), "w") as f:
+            f.write("leaf")
+
+        scan_obj = ScanFiles(scan_options=Options())
+        watching = scan_obj.watch([self.root_p], poll_interval=0.1)
+        try:
+            next(watching)
+            os.rename(deep_p, os.path.join(self.root_p, "moved"))
+            delta = next(watching)
+        finally:
+            scan_obj.cancel()
+            watching.close()
+
+        self.assertEqual(len(delta.removed), 1)
+        self.assertEqual(len(delta.added), 1)
+        self.assertEqual(dict(scan_obj.files), dict(scan([self.root_p]).files))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_save_and_load(self):
+        scan_obj = scan([self.root_p], instrument=True)
+        saved_p = os.path.join(self.root_p, "scan.bin")
+        scan_obj.save(saved_p)
+
+        loaded_obj = ScanFiles.load(saved_p)
+        self.assertSameScan(loaded_obj, scan_obj)
+        self.assertEqual(loaded_obj.stats.counts, scan_obj.stats.counts)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_load_refuses_code(self):
+        saved_p = os.path.join(self.root_p, "scan.bin")
+        savedscan.write_scan(saved_p, header={"options": {}, "payload": os.getcwd}, files=[])
+
+        with self.assertRaises(pickle.UnpicklingError):
+            ScanFiles.load(saved_p)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_resume_ignores_unusable_checkpoint(self):
+        checkpoint_p = self.root_p + ".checkpoint"
+        savedscan.write_scan(checkpoint_p, header={"checkpoint": os.getcwd}, files=[])
+        self.addCleanup(lambda: os.path.exists(checkpoint_p) and os.remove(checkpoint_p))
+
+        scan_obj = ScanFiles(scan_options=Options())
+        for _ in scan_obj.scan_directories_resumable([self.root_p], checkpoint_p=checkpoint_p):
+            pass
+
+        self.assertSameScan(scan_obj, scan([self.root_p]))
+        self.assertFalse(os.path.exists(checkpoint_p))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_nested_roots_incremental(self):
+        expected_obj = scan(self.nested_roots)
+        index_p = self.root_p + ".index"
+        self.addCleanup(os.remove, index_p)
+
+        for _ in range(2):
+            scan_obj = ScanFiles(scan_options=Options())
+            for _ in scan_obj.scan_directories_incremental(self.nested_roots, index_p=index_p):
+                pass
+            self.assertSameScan(scan_obj, expected_obj)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_incremental_scan_reports_progress(self):
+        index_p = self.root_p + ".index"
+        self.addCleanup(os.remove, index_p)
+
+        for _ in range(2):
+            progress = list()
+            scan_obj = ScanFiles(scan_options=Options(),
+                                 stats_callback=lambda checked_count, stats: progress.append(checked_count))
+            for _ in scan_obj.scan_directories_incremental([self.root_p], index_p=index_p):
+                pass
+            self.assertTrue(progress)
+            self.assertEqual(progress, sorted(progress))
+            self.assertEqual(progress[-1], scan_obj.checked_count)
+
+        # Cancelling from the callback stops the scan.
+        scan_obj = ScanFiles(scan_options=Options(), stats_callback=lambda checked_count, stats: scan_obj.cancel())
+        for _ in scan_obj.scan_directories_incremental([self.root_p], index_p=index_p):
+            pass
+        self.assertLess(len(scan_obj.files), len(scan([self.root_p]).files))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_incremental_refuses_code_in_index(self):
+        index_p = self.root_p + ".index"
+        self.addCleanup(os.remove, index_p)
+
+        scan_obj = ScanFiles(scan_options=Options())
+        for _ in scan_obj.scan_directories_incremental([self.root_p], index_p=index_p):
+            pass
+
+        with sqlite3.connect(index_p) as connection:
+            connection.execute("UPDATE dirs SET record = ?", (pickle.dumps({"files": os.getcwd}),))
+
+        scan_obj = ScanFiles(scan_options=Options())
+        for _ in scan_obj.scan_directories_incremental([self.root_p], index_p=index_p):
+            pass
+        self.assertSameScan(scan_obj, scan([self.root_p]))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_batched_files_in_large_directory(self):
+        large_p = os.path.join(self.root_p, "large")
+        os.mkdir(large_p)
+        for file_i in range(5000):
+            with open(os.path.join(large_p, f"file_{file_i:05d}.txt"), "w") as f:
+                f.write("x")
+        files_p = [os.path.join(large_p, f"file_{file_i:05d}.txt") for file_i in range(0, 5000, 500)]
+        files_p.extend(os.path.join(self.root_p, f"f{file_i}.txt") for file_i in range(2))
+
+        expected_obj = ScanFiles(scan_options=Options())
+        for _ in expected_obj.scan_files(files_p=files_p, root_p=self.root_p):
+            pass
+
+        scan_obj = ScanFiles(scan_options=Options(batch_loose_files=True))
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            for _ in scan_obj.scan_files(files_p=files_p, root_p=self.root_p):
+                pass
+
+        self.assertNotIn(mock.call(large_p), scandir.call_args_list)
+        self.assertSameScan(scan_obj, expected_obj)
+        self.assertEqual(len(scan_obj.files), len(files_p))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_async_scan_stopped_early(self):
+        progress = list()
+        scan_obj = ScanFiles(scan_options=Options(report_frequency=1),
+                             stats_callback=lambda checked_count, stats: progress.append(checked_count))
+
+        async def first_batch():
+            batches = scan_obj.ascan_directories([self.root_p], batch_size=5)
+            async for batch in batches:
+                break
+            await batches.aclose()
+            return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+        self.assertEqual(asyncio.run(first_batch()), [])
+        self.assertTrue(progress)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_async_scan_reports_progress(self):
+        progress = list()
+        scan_obj = ScanFiles(scan_options=Options(report_frequency=1),
+                             stats_callback=lambda checked_count, stats: progress.append(checked_count))
+
+        async def scan_all():
+            async for _ in scan_obj.ascan_directories([self.root_p]):
+                pass
+
+        asyncio.run(scan_all())
+        self.assertSameScan(scan_obj, scan([self.root_p]))
+        self.assertEqual(progress[-1], scan_obj.checked_count)
+
+
+if __name__ == "__main__":
+    unittest.main()